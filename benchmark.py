@@ -0,0 +1,227 @@
+"""
+Benchmark não interativo da multiplicação distribuída.
+
+Para cada tamanho de matriz executa algumas repetições (após o aquecimento)
+e registra, com perf_counter_ns, o tempo de cada fase: divisão, serialização,
+envio, cálculo no servidor, preparo do resultado no servidor, recepção e
+montagem. Também registra os bytes transferidos e os percentis de cada
+medida. O relatório é gravado em JSON; com --baseline ele é comparado a um
+relatório anterior e o programa termina com código 1 se houver regressão.
+
+Exemplos:
+    python benchmark.py --servers localhost:5000 localhost:5001 --sizes 256,512
+    python benchmark.py --config bench.json --baseline baseline.json --threshold 0.1
+
+O arquivo de configuração é um JSON com as mesmas chaves das opções
+(ex.: {"servers": ["localhost:5000"], "sizes": [256, 512], "repeats": 5});
+opções da linha de comando têm prioridade sobre ele.
+"""
+import argparse
+import json
+import sys
+import time
+from datetime import datetime
+import numpy as np
+from client import MatrixClient, load_servers
+from run_system import load_config
+
+# Fases registradas em MatrixClient.last_timings, na ordem do caminho dos dados
+PHASES = ('split_ns', 'serialize_ns', 'send_ns', 'server_compute_ns', 'server_serialize_ns',
+          'receive_ns', 'assemble_ns')
+
+PERCENTILES = (50, 90, 99)
+
+DEFAULTS = {
+    'servers': ['localhost:5000'],
+    'servers_file': None,
+    'sizes': [128, 256, 512],
+    'repeats': 5,
+    'warmup': 1,
+    'dtype': 'int64',
+    'schedule': 'static',
+    'partition': 'grid',
+    'compression': None,
+    'local_transport': True,
+    'cache': True,
+    'serial': False,
+    'seed': 0,
+    'output': None,
+    'baseline': None,
+    'threshold': 0.10,
+    'metric': 'p50',
+}
+
+
+def parse_server(address):
+    """'host:porta' -> (host, porta)"""
+    host, _, port = address.rpartition(':')
+    return (host or 'localhost', int(port))
+
+
+def summarize(values):
+    """Média, mínimo, máximo e percentis de uma lista de medidas"""
+    values = np.asarray(values, dtype=np.float64)
+    if values.size == 0:
+        return {}
+    summary = {'mean': float(values.mean()), 'min': float(values.min()), 'max': float(values.max())}
+    for percentile in PERCENTILES:
+        summary[f'p{percentile}'] = float(np.percentile(values, percentile))
+    return summary
+
+
+def make_operands(size, dtype, rng):
+    """Par de matrizes quadradas de teste no tipo pedido"""
+    dtype = np.dtype(dtype)
+    if dtype.kind == 'f':
+        return rng.random((size, size)).astype(dtype), rng.random((size, size)).astype(dtype)
+    return (rng.integers(-10, 10, size=(size, size)).astype(dtype),
+            rng.integers(-10, 10, size=(size, size)).astype(dtype))
+
+
+def run_benchmark(config):
+    """Executa o benchmark descrito em config e retorna o relatório (dict)"""
+    if config['servers_file']:
+        servers = load_servers(config['servers_file'])
+    else:
+        servers = [parse_server(address) for address in config['servers']]
+    rng = np.random.default_rng(config['seed'])
+    options = {'schedule': config['schedule'], 'partition': config['partition'],
+               'cache': config['cache'], 'show_details': False}
+    results = []
+    
+    with MatrixClient(servers, compression=config['compression'],
+                      local_transport=config['local_transport']) as client:
+        for size in config['sizes']:
+            print(f"[BENCHMARK] Matrizes {size}x{size} ({config['dtype']}): "
+                  f"{config['warmup']} aquecimento(s), {config['repeats']} repetição(ões)")
+            A, B = make_operands(size, config['dtype'], rng)
+            
+            for _ in range(config['warmup']):
+                client.distribute_multiplication(A, B, **options)
+            
+            runs = []
+            for rep in range(config['repeats']):
+                C, _ = client.distribute_multiplication(A, B, **options)
+                if not client.verify_result(A, B, C):
+                    raise RuntimeError(f"Resultado incorreto para {size}x{size}")
+                runs.append(client.last_timings)
+                print(f"  Repetição {rep+1}: {client.last_timings['total_ns'] / 1e6:.2f} ms")
+            
+            entry = {
+                'size': size,
+                'total_ns': summarize([run['total_ns'] for run in runs]),
+                'phases': {phase: summarize([run[phase] for run in runs]) for phase in PHASES},
+                'bytes_sent': summarize([run['bytes_sent'] for run in runs]),
+                'bytes_received': summarize([run['bytes_received'] for run in runs]),
+                'runs': runs,
+            }
+            if config['serial']:
+                serial = []
+                for _ in range(config['repeats']):
+                    started = time.perf_counter_ns()
+                    np.dot(A, B)
+                    serial.append(time.perf_counter_ns() - started)
+                entry['serial_ns'] = summarize(serial)
+            results.append(entry)
+    
+    return {'timestamp': datetime.now().isoformat(timespec='seconds'), 'config': config,
+            'results': results}
+
+
+def compare(report, baseline, threshold, metric='p50'):
+    """
+    Compara o tempo total de cada tamanho com o do relatório de referência.
+    Retorna a lista de regressões (tamanhos mais lentos que a referência
+    por mais de threshold, ex.: 0.1 = 10%).
+    """
+    reference = {entry['size']: entry for entry in baseline.get('results', [])}
+    regressions = []
+    
+    print(f"\n[BENCHMARK] Comparação com a referência ({metric}, limite {threshold:.0%})")
+    for entry in report['results']:
+        base = reference.get(entry['size'])
+        if base is None:
+            print(f"  {entry['size']:>6}: sem referência")
+            continue
+        current, previous = entry['total_ns'][metric], base['total_ns'][metric]
+        change = current / previous - 1 if previous else 0.0
+        regressed = change > threshold
+        print(f"  {entry['size']:>6}: {previous / 1e6:9.2f} ms -> {current / 1e6:9.2f} ms "
+              f"({change:+.1%}){'  REGRESSÃO' if regressed else ''}")
+        
+        # Fases que mais mudaram ajudam a localizar a regressão
+        for phase in PHASES:
+            before = base['phases'].get(phase, {}).get(metric)
+            after = entry['phases'][phase].get(metric)
+            if regressed and before and after and after / before - 1 > threshold:
+                print(f"          {phase}: {before / 1e6:.2f} ms -> {after / 1e6:.2f} ms")
+        if regressed:
+            regressions.append({'size': entry['size'], 'baseline_ns': previous,
+                                'current_ns': current, 'change': change})
+    return regressions
+
+
+def print_report(report):
+    """Tabela resumida das fases de cada tamanho"""
+    metric = report['config']['metric']
+    print(f"\n[BENCHMARK] Tempos por fase ({metric}, ms; fases somadas entre threads)")
+    header = ['tamanho', 'total'] + [phase[:-3] for phase in PHASES] + ['MB env.', 'MB rec.']
+    print('  ' + ' '.join(f"{name:>12}" for name in header))
+    for entry in report['results']:
+        row = [f"{entry['size']}", f"{entry['total_ns'][metric] / 1e6:.2f}"]
+        row += [f"{entry['phases'][phase][metric] / 1e6:.2f}" for phase in PHASES]
+        row += [f"{entry['bytes_sent'][metric] / 1e6:.2f}", f"{entry['bytes_received'][metric] / 1e6:.2f}"]
+        print('  ' + ' '.join(f"{value:>12}" for value in row))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark da multiplicação distribuída de matrizes")
+    parser.add_argument('--config', help="arquivo JSON com as opções")
+    parser.add_argument('--servers', nargs='+', help="endereços host:porta")
+    parser.add_argument('--servers-file', help="lista de servidores gravada pelo run_system")
+    parser.add_argument('--sizes', help="tamanhos das matrizes, ex.: 128,256,512")
+    parser.add_argument('--repeats', type=int, help="repetições medidas por tamanho")
+    parser.add_argument('--warmup', type=int, help="repetições de aquecimento (não medidas)")
+    parser.add_argument('--dtype', help="tipo das matrizes (ex.: int64, float64)")
+    parser.add_argument('--schedule', choices=['static', 'dynamic', 'tiled'])
+    parser.add_argument('--partition', choices=['grid', 'rows'])
+    parser.add_argument('--compression', choices=['zlib', 'lzma'])
+    parser.add_argument('--no-local-transport', dest='local_transport', action='store_const',
+                        const=False, help="usa TCP também com servidores da mesma máquina")
+    parser.add_argument('--no-cache', dest='cache', action='store_const', const=False,
+                        help="envia B em toda requisição")
+    parser.add_argument('--serial', action='store_const', const=True,
+                        help="mede também a multiplicação local")
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('--output', help="arquivo JSON do relatório")
+    parser.add_argument('--baseline', help="relatório de referência para comparação")
+    parser.add_argument('--threshold', type=float, help="regressão tolerada (0.1 = 10%%)")
+    parser.add_argument('--metric', choices=['mean', 'min'] + [f'p{p}' for p in PERCENTILES])
+    config = load_config(parser.parse_args(argv), DEFAULTS)
+    if isinstance(config['sizes'], str):
+        config['sizes'] = [int(size) for size in config['sizes'].split(',')]
+    
+    report = run_benchmark(config)
+    print_report(report)
+    
+    regressions = []
+    if config['baseline']:
+        with open(config['baseline']) as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, config['threshold'], config['metric'])
+        report['regressions'] = regressions
+    
+    output = config['output'] or f"benchmark_results_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"\n[SALVO] Relatório salvo em: {output}")
+    
+    if regressions:
+        print(f"[BENCHMARK] {len(regressions)} regressão(ões) acima de {config['threshold']:.0%}")
+        return 1
+    if config['baseline']:
+        print("[BENCHMARK] Sem regressões")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
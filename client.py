@@ -1,20 +1,444 @@
 import socket
-import pickle
 import numpy as np
 import time
-import matplotlib.pyplot as plt
 import json
 from datetime import datetime
 import os
+import select
+import threading
+import queue
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
+from protocol import (ProtocolError, Connection, check_reply, array_digest, narrow_array,
+                      wire_dtype, narrowest_int_dtype, is_sparse, pack_operands,
+                      unpack_operands, attach_shared_memory, detach_array, local_host_id,
+                      STAT_KEYS)
+from tracing import Tracer, NULL_SPAN
+from expression import (MatrixHandle, chain_order, left_to_right_cost, format_order, left_spine,
+                        tree_leaves)
+
+class ConnectionPool:
+    """
+    Pool de conexões persistentes, indexado pelo endereço do servidor.
+    Cada conexão carrega várias requisições; conexões ociosas são verificadas
+    antes do reuso e refeitas se o servidor as tiver encerrado.
+    
+    Com local_transport, servidores na mesma máquina são atendidos pelo
+    transporte local: socket Unix para as mensagens e memória compartilhada
+    para as matrizes.
+    """
+    def __init__(self, max_idle=4, health_check_after=5.0, compression=None,
+                 local_transport=True):
+        """
+        max_idle: conexões ociosas mantidas por servidor
+        health_check_after: segundos de ociosidade a partir dos quais um ping
+                            é enviado antes de reutilizar a conexão
+        compression: compressão das mensagens ('zlib', 'lzma' ou None); o
+                     servidor responde com a mesma
+        local_transport: usa o transporte local com os servidores detectados
+                         na mesma máquina (os demais continuam por TCP)
+        """
+        self.max_idle = max_idle
+        self.health_check_after = health_check_after
+        self.compression = compression
+        self.local_transport = local_transport and hasattr(socket, 'AF_UNIX')
+        self._idle = {}
+        # Caminho do socket Unix de cada servidor local (None: só TCP)
+        self._routes = {}
+        self._lock = threading.Lock()
+        self._totals = dict.fromkeys(STAT_KEYS, 0)
+    
+    def _local_route(self, server_addr, timeout):
+        """
+        Caminho do socket Unix do servidor, se ele estiver nesta máquina.
+        Na primeira conexão pergunta ao servidor (operação 'hello') seu host
+        e um segmento de teste: só é local quem enxerga o mesmo segmento.
+        """
+        if not self.local_transport:
+            return None
+        with self._lock:
+            if server_addr in self._routes:
+                return self._routes[server_addr]
+        
+        conn = self._connect_tcp(server_addr, timeout)
+        try:
+            meta, _ = conn.exchange({'op': 'hello'})
+        except ProtocolError:
+            meta = {}
+        finally:
+            conn.close()
+        route = None
+        if meta.get('status') == 'ok' and meta.get('host_id') == local_host_id():
+            route = self._check_probe(meta)
+        with self._lock:
+            self._routes[server_addr] = route
+        return route
+    
+    @staticmethod
+    def _check_probe(meta):
+        """Confere o segmento de teste do servidor; retorna o caminho do socket Unix ou None"""
+        path = meta.get('unix_path')
+        if not isinstance(path, str) or not os.path.exists(path):
+            return None
+        try:
+            probe = attach_shared_memory(str(meta.get('probe')))
+        except (OSError, ValueError):
+            return None
+        try:
+            token = bytes(probe.buf[:16]).hex()
+        finally:
+            probe.close()
+        return path if token == meta.get('token') else None
+    
+    def _connect(self, server_addr, timeout):
+        """Abre uma nova conexão com o servidor (local, se possível)"""
+        path = self._local_route(server_addr, timeout)
+        if path is not None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(timeout)
+            try:
+                sock.connect(path)
+                # As matrizes vão por memória compartilhada: comprimir não ajuda
+                conn = Connection(sock, shared_memory=True)
+                meta, _ = conn.exchange({'op': 'hello'})
+                if meta.get('status') == 'ok' and meta.get('shm_prefix'):
+                    conn.shared_memory.bind(meta['shm_prefix'], 'c')
+                return conn
+            except OSError:
+                # Servidor reiniciado ou socket removido: volta ao TCP e
+                # detecta de novo na próxima conexão
+                sock.close()
+                with self._lock:
+                    self._routes.pop(server_addr, None)
+        return self._connect_tcp(server_addr, timeout)
+    
+    def _connect_tcp(self, server_addr, timeout):
+        """Abre uma nova conexão TCP com o servidor"""
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.settimeout(timeout)
+        sock.connect(server_addr)
+        
+        # Aumenta buffer para transferências grandes
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 1024 * 1024)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1024 * 1024)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return Connection(sock, self.compression)
+    
+    def _is_healthy(self, conn, idle_time):
+        """
+        Verifica uma conexão ociosa: se há algo para ler, o servidor a encerrou;
+        após muito tempo ociosa, confirma com um ping.
+        """
+        try:
+            readable, _, _ = select.select([conn], [], [], 0)
+            if readable:
+                return False
+            if idle_time >= self.health_check_after:
+                message = conn.exchange({'op': 'ping'})
+                return message[0].get('status') == 'ok'
+            return True
+        except (OSError, ValueError, ProtocolError):
+            return False
+    
+    def acquire(self, server_addr, timeout=None):
+        """
+        Retorna (conexão, reutilizada) com uma conexão saudável para o servidor.
+        """
+        while True:
+            with self._lock:
+                idle = self._idle.get(server_addr)
+                entry = idle.pop() if idle else None
+            if entry is None:
+                return self._connect(server_addr, timeout), False
+            
+            conn, last_used = entry
+            conn.settimeout(timeout)
+            if self._is_healthy(conn, time.monotonic() - last_used):
+                return conn, True
+            conn.close()
+    
+    def release(self, server_addr, conn):
+        """Devolve uma conexão em bom estado ao pool"""
+        with self._lock:
+            idle = self._idle.setdefault(server_addr, [])
+            if len(idle) < self.max_idle:
+                idle.append((conn, time.monotonic()))
+                return
+        conn.close()
+    
+    def call(self, server_addr, function, timeout=None):
+        """
+        Executa function(conexão) com uma conexão do pool e retorna seu resultado.
+        Se uma conexão reutilizada tiver sido encerrada pelo servidor, repete
+        a chamada uma vez em uma conexão nova.
+        """
+        while True:
+            conn, reused = self.acquire(server_addr, timeout)
+            before = dict(conn.stats)
+            try:
+                result = function(conn)
+            except ConnectionError:
+                conn.close()
+                if reused:
+                    continue
+                raise
+            except BaseException:
+                conn.close()
+                raise
+            finally:
+                self._account(conn, before)
+            
+            self.release(server_addr, conn)
+            return result
+    
+    def _account(self, conn, before):
+        """Soma aos totais do pool o que a conexão registrou desde before"""
+        with self._lock:
+            for key in STAT_KEYS:
+                self._totals[key] += conn.stats[key] - before[key]
+    
+    def totals(self):
+        """
+        Tempos (ns) e bytes acumulados pelas chamadas do pool, somados entre
+        conexões e threads (ver protocol.STAT_KEYS)
+        """
+        with self._lock:
+            return dict(self._totals)
+    
+    def request(self, server_addr, meta, arrays=(), timeout=None):
+        """Envia uma requisição e retorna (meta, arrays) da resposta"""
+        return self.call(server_addr, lambda conn: conn.exchange(meta, arrays), timeout)
+    
+    def close(self):
+        """Fecha todas as conexões ociosas"""
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for entries in idle.values():
+            for conn, _ in entries:
+                conn.close()
+
+
+class GuidedScheduler:
+    """
+    Fila de trabalho compartilhada com guided self-scheduling: cada servidor
+    pega o próximo bloco de linhas quando termina o anterior. O tamanho do
+    bloco diminui conforme resta menos trabalho e é ajustado pela vazão
+    (linhas/s) observada em cada servidor.
+    """
+    def __init__(self, rows, num_servers, min_chunk=16, factor=2, smoothing=0.5):
+        """
+        min_chunk: menor bloco entregue (exceto o resto final)
+        factor: quanto maior, menores os blocos (restante / (factor * servidores))
+        smoothing: peso da última medição na média móvel da vazão
+        """
+        self.rows = rows
+        self.num_servers = num_servers
+        self.min_chunk = min_chunk
+        self.factor = factor
+        self.smoothing = smoothing
+        self.next_row = 0
+        self.rates = {}
+        self.requeued = deque()
+        self._lock = threading.Lock()
+    
+    def next_chunk(self, server):
+        """Retorna o próximo intervalo (início, fim) para o servidor, ou None"""
+        with self._lock:
+            if self.requeued:
+                return self.requeued.popleft()
+            remaining = self.rows - self.next_row
+            if remaining <= 0:
+                return None
+            
+            size = remaining / (self.factor * self.num_servers)
+            if server in self.rates:
+                # Servidores mais rápidos que a média recebem blocos maiores
+                size *= self.rates[server] / np.mean(list(self.rates.values()))
+            size = min(remaining, max(self.min_chunk, int(np.ceil(size))))
+            
+            start = self.next_row
+            self.next_row += size
+            return start, start + size
+    
+    def requeue(self, chunk):
+        """Devolve à fila um intervalo cujo servidor falhou"""
+        with self._lock:
+            self.requeued.append(chunk)
+    
+    def pending(self):
+        """True se ainda há linhas a distribuir"""
+        with self._lock:
+            return bool(self.requeued) or self.next_row < self.rows
+    
+    def record(self, server, rows, elapsed):
+        """Atualiza a vazão observada do servidor"""
+        rate = rows / max(elapsed, 1e-9)
+        with self._lock:
+            previous = self.rates.get(server, rate)
+            self.rates[server] = self.smoothing * rate + (1 - self.smoothing) * previous
+
+
+class ShardAttempt:
+    """
+    Uma tentativa de executar um shard em um servidor. Pode ser cancelada a
+    partir de outro thread (quando outra tentativa do mesmo shard termina
+    antes), o que interrompe a conexão em uso.
+    """
+    def __init__(self, index, server, speculative=False):
+        self.index = index
+        self.server = server
+        self.speculative = speculative
+        self.started = None
+        self.cancelled = False
+        self._conn = None
+        self._lock = threading.Lock()
+    
+    def attach(self, conn):
+        """Registra a conexão usada pela tentativa"""
+        with self._lock:
+            self._conn = conn
+            cancelled = self.cancelled
+        if cancelled:
+            conn.abort()
+    
+    def cancel(self):
+        with self._lock:
+            self.cancelled = True
+            conn = self._conn
+        if conn is not None:
+            conn.abort()
+
+
+class CostModel:
+    """
+    Modelo de custo calibrado para decidir onde executar uma multiplicação:
+    localmente ou em k servidores (os k mais rápidos).
+    
+    tempo_local(k=0) = flops / local_flops
+    tempo_distribuido(k) = latency + bytes_transferidos(k) / bandwidth
+                           + (flops / k) / menor taxa entre os k servidores
+    """
+    def __init__(self, latency, bandwidth, local_flops, server_flops):
+        """
+        latency: tempo (s) de ida e volta de uma requisição vazia
+        bandwidth: bytes/s entre o cliente e os servidores (enlace compartilhado)
+        local_flops: operações/s da multiplicação local
+        server_flops: operações/s de cada servidor (na ordem de servers)
+        """
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.local_flops = local_flops
+        self.server_flops = list(server_flops)
+    
+    def to_dict(self):
+        return {
+            'latency': self.latency,
+            'bandwidth': self.bandwidth,
+            'local_flops': self.local_flops,
+            'server_flops': self.server_flops,
+        }
+    
+    @staticmethod
+    def flops(A, B):
+        """Operações de ponto flutuante (ou inteiras) de A @ B"""
+        return 2 * A.shape[0] * A.shape[1] * B.shape[1]
+    
+    @staticmethod
+    def wire_itemsizes(A, B, compact=True):
+        """
+        Bytes por elemento de A, B e C como trafegam. Com compact, inteiros vão
+        no menor tipo (ver narrow_array); para C, o que comporta o maior
+        produto interno possível com os tipos de A e B.
+        """
+        if not compact:
+            return A.dtype.itemsize, B.dtype.itemsize, np.result_type(A.dtype, B.dtype).itemsize
+        a, b = wire_dtype(A), wire_dtype(B)
+        if a.kind not in 'iu' or b.kind not in 'iu':
+            return a.itemsize, b.itemsize, np.result_type(a, b).itemsize
+        bound = A.shape[1] * max(abs(int(np.iinfo(a).min)), int(np.iinfo(a).max)) \
+                           * max(abs(int(np.iinfo(b).min)), int(np.iinfo(b).max))
+        low = 0 if a.kind == b.kind == 'u' else -bound
+        return a.itemsize, b.itemsize, narrowest_int_dtype(low, bound).itemsize
+    
+    def estimate(self, A, B, num_servers, grid=None, itemsizes=None, b_cached=False):
+        """
+        Tempo estimado (s) usando os num_servers servidores mais rápidos
+        (0 = execução local). grid: (p, q) usado para contar os bytes enviados.
+        itemsizes: bytes por elemento de A, B e C (padrão: wire_itemsizes)
+        b_cached: B já está no cache dos servidores e não é enviada
+        """
+        flops = self.flops(A, B)
+        if num_servers == 0:
+            return flops / self.local_flops
+        
+        p, q = grid or (num_servers, 1)
+        rate = sorted(self.server_flops, reverse=True)[num_servers - 1]
+        if rate <= 0:
+            # Entre os num_servers mais rápidos há um que não respondeu
+            return float('inf')
+        a_size, b_size, c_size = itemsizes or self.wire_itemsizes(A, B)
+        bytes_sent = (q * A.shape[0] * A.shape[1] * a_size
+                      + (0 if b_cached else p * B.shape[0] * B.shape[1] * b_size)
+                      + A.shape[0] * B.shape[1] * c_size)
+        return self.latency + bytes_sent / self.bandwidth + (flops / num_servers) / rate
+
 
 class MatrixClient:
-    def __init__(self, servers):
+    def __init__(self, servers, timeout=None, compression=None, compact_dtypes=True,
+                 local_transport=True, trace=False):
         """
         Inicializa o cliente com lista de servidores.
         servers: lista de tuplas [(host, port), ...]
+        timeout: tempo máximo (s) de cada operação de socket por servidor
+        compression: 'zlib' ou 'lzma' para comprimir as mensagens (enlaces lentos)
+        compact_dtypes: envia matrizes inteiras no menor tipo que comporta os
+                        valores e pede o resultado também no menor tipo
+        local_transport: com servidores na mesma máquina, usa socket Unix e
+                         memória compartilhada em vez do TCP
+        trace: registra a linha do tempo de cada multiplicação distribuída
+               (spans do cliente e dos servidores) em last_trace
         """
         self.servers = servers
         self.num_servers = len(servers)
+        self.timeout = timeout
+        self.compact_dtypes = compact_dtypes
+        self.last_shard_times = []
+        # Tempos por fase (ns) e bytes da última multiplicação distribuída
+        self.last_timings = {}
+        # Trace (spans do cliente e dos servidores) da última multiplicação
+        self.trace = trace
+        self.last_trace = None
+        self._trace_root = None
+        self.min_chunk_rows = 16
+        self.speculation_factor = 3.0
+        self.stream_block_bytes = 4 * 1024 * 1024
+        # Shards com A a partir deste tamanho vão em pipeline (blocos de A)
+        self.pipeline_min_bytes = 8 * 1024 * 1024
+        # Tamanho máximo de cada lote de batch_multiply
+        self.batch_frame_bytes = 8 * 1024 * 1024
+        self.connections = ConnectionPool(compression=compression,
+                                          local_transport=local_transport)
+        self.cost_model = None
+        self.last_plan = None
+        # Blocos de colunas de B deixados no cache dos servidores pela última
+        # distribuição estática em cada conjunto de servidores: (q, hashes)
+        self._placed_b = {}
+        # Handles ainda fixados nos servidores (liberados no close)
+        self._handles = []
+        # Ordem das multiplicações da última avaliação de expressão
+        self.last_chain_order = None
+    
+    def close(self):
+        """Libera os handles e encerra as conexões persistentes com os servidores"""
+        for handle in list(self._handles):
+            self.release(handle)
+        self.connections.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc_info):
+        self.close()
     
     def generate_matrices(self, rows_a, cols_a, cols_b):
         """Gera matrizes A e B aleatórias"""
@@ -22,129 +446,1203 @@ class MatrixClient:
         B = np.random.randint(-10, 10, size=(cols_a, cols_b))
         return A, B
     
+    def split_ranges(self, size, num_parts):
+        """
+        Divide size linhas (ou colunas) em num_parts intervalos contíguos.
+        Retorna lista de (início, fim).
+        """
+        per_part = size // num_parts
+        ranges = []
+        
+        for i in range(num_parts):
+            start = i * per_part
+            # Última parte pega todas as linhas restantes
+            end = size if i == num_parts - 1 else (i + 1) * per_part
+            ranges.append((start, end))
+        
+        return ranges
+    
     def split_matrix(self, matrix, num_parts):
         """
         Divide a matriz A em submatrizes para distribuição.
         Retorna lista de submatrizes.
         """
-        rows = matrix.shape[0]
-        rows_per_part = rows // num_parts
-        submatrices = []
+        return [matrix[start:end] for start, end in self.split_ranges(matrix.shape[0], num_parts)]
+    
+    def split_by_nnz(self, A, num_parts):
+        """
+        Divide as linhas de uma matriz CSR em faixas com números de não-zeros
+        equilibrados (em vez do mesmo número de linhas).
+        Retorna lista de (início, fim)
+        """
+        targets = np.linspace(0, A.nnz, num_parts + 1)
+        bounds = np.searchsorted(A.indptr, targets, side='left')
+        bounds[0], bounds[-1] = 0, A.shape[0]
+        bounds = np.maximum.accumulate(np.minimum(bounds, A.shape[0]))
+        return [(int(r0), int(r1)) for r0, r1 in zip(bounds[:-1], bounds[1:])]
+    
+    def choose_grid(self, A, B, num_servers, cached_q=None):
+        """
+        Escolhe a grade p x q (p * q = num_servers) que minimiza os bytes
+        enviados: cada bloco de linhas de A vai para q servidores e cada bloco
+        de colunas de B para p servidores.
+        cached_q: q cujos blocos de B já estão no cache dos servidores; nessa
+                  grade só os bytes de A contam
+        Empates ficam com menos blocos de colunas (q menor): as faixas de
+        linhas de C são contíguas e recebidas sem cópia.
+        Retorna (p, q)
+        """
+        bytes_a = A.shape[0] * A.shape[1] * A.itemsize
+        bytes_b = B.shape[0] * B.shape[1] * B.itemsize
         
-        for i in range(num_parts):
-            start_row = i * rows_per_part
-            if i == num_parts - 1:
-                # Última parte pega todas as linhas restantes
-                end_row = rows
-            else:
-                end_row = (i + 1) * rows_per_part
-            
-            submatrices.append(matrix[start_row:end_row])
+        def cost(grid):
+            p, q = grid
+            return q * bytes_a + (0 if q == cached_q else p * bytes_b)
         
-        return submatrices
+        grids = [(p, num_servers // p) for p in range(1, num_servers + 1) if num_servers % p == 0]
+        return min(grids, key=lambda grid: (cost(grid), grid[1]))
     
-    def send_to_server(self, server_addr, submatrix_a, matrix_b):
+    def column_blocks(self, B, q, cache=True):
         """
-        Envia submatriz para um servidor e recebe resultado.
-        Otimizado para grandes volumes de dados.
+        Os q blocos de colunas de B como são enviados (prepare_operand) e seus
+        hashes (None sem cache)
+        """
+        blocks = [self.prepare_operand(B if q == 1 else np.ascontiguousarray(B[:, c0:c1]))
+                  for c0, c1 in self.split_ranges(B.shape[1], q)]
+        return blocks, [array_digest(block) if cache else None for block in blocks]
+    
+    def static_grid(self, A, B, servers, partition='grid', cache=True):
+        """
+        Grade (p, q) da distribuição estática nos servidores dados. Com cache,
+        a grade da última distribuição nesses servidores não conta B se os
+        blocos de colunas de B forem os mesmos (já estão no cache deles).
+        Retorna (p, q, blocos) em que blocos são os column_blocks de B já
+        calculados para essa grade, ou None.
+        """
+        if partition == 'rows':
+            return len(servers), 1, None
+        if partition != 'grid':
+            raise ValueError(f"Particionamento desconhecido: {partition}")
+        placed = self._placed_b.get(tuple(servers)) if cache else None
+        known, cached_q = None, None
+        if placed is not None:
+            known = self.column_blocks(B, placed[0])
+            if known[1] == placed[1]:
+                cached_q = placed[0]
+        p, q = self.choose_grid(A, B, len(servers), cached_q)
+        return p, q, known if placed is not None and q == placed[0] else None
+    
+    def split_grid(self, A, B, p, q):
+        """
+        Particionamento 2D: blocos de linhas de A x blocos de colunas de B.
+        Retorna lista de blocos (linha_inicio, linha_fim, coluna_inicio, coluna_fim)
+        de C, um por servidor.
+        """
+        row_ranges = self.split_ranges(A.shape[0], p)
+        col_ranges = self.split_ranges(B.shape[1], q)
+        return [(r0, r1, c0, c1) for r0, r1 in row_ranges for c0, c1 in col_ranges]
+    
+    def prepare_operand(self, matrix):
+        """Matriz como será enviada (no menor tipo inteiro, se compact_dtypes)"""
+        return narrow_array(matrix) if self.compact_dtypes else matrix
+    
+    @staticmethod
+    def _block_target(out):
+        """Destino de cada bloco de resultado recebido: a faixa correspondente de out"""
+        def target(meta, index, wire_dtype, shape):
+            if meta.get('status') != 'block':
+                return None
+            row = int(meta['row'])
+            if row < 0 or row + shape[0] > out.shape[0]:
+                raise ProtocolError(f"Bloco fora do resultado: linha {row}, {shape}")
+            return out[row:row + shape[0]]
+        return target
+    
+    @staticmethod
+    def _receive_reply(conn, upload, into=None):
+        """
+        Recebe mensagens até a resposta final, que é retornada.
+        Blocos do resultado são escritos por into (ver _block_target); a cada
+        'cache_miss', upload(meta) dá (hash, matriz) a reenviar ao servidor.
+        """
+        while True:
+            message = conn.recv(into=into)
+            if message is None:
+                raise ConnectionError("Servidor encerrou a conexão sem responder")
+            meta, _ = message
+            if meta.get('status') == 'cache_miss':
+                digest, matrix = upload(meta)
+                conn.send({'op': 'upload', 'b_hash': digest}, [matrix])
+            elif meta.get('status') != 'block':
+                return meta
+    
+    def _call_server(self, server_addr, function, timeout, attempt, span):
+        """
+        Executa function(conn) em uma conexão do servidor e confere a resposta
+        final (com os spans do servidor). Retorna a resposta, ou None em caso
+        de falha (avisada, exceto se a tentativa foi cancelada).
         """
         try:
-            # Cria conexão com servidor
-            client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            client_socket.connect(server_addr)
-            
-            # Aumenta buffer para transferências grandes
-            client_socket.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 1024 * 1024)
-            client_socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1024 * 1024)
-            
-            # Serializa com protocolo otimizado
-            data = pickle.dumps((submatrix_a, matrix_b), protocol=pickle.HIGHEST_PROTOCOL)
-            data_size = len(data)
-            
-            # Envia tamanho primeiro
-            client_socket.sendall(data_size.to_bytes(8, byteorder='big'))
-            
-            # Envia dados em chunks maiores
-            chunk_size = 65536  # 64KB chunks
-            for i in range(0, data_size, chunk_size):
-                client_socket.sendall(data[i:i+chunk_size])
-            
-            # Recebe tamanho do resultado
-            result_size_bytes = client_socket.recv(8)
-            result_size = int.from_bytes(result_size_bytes, byteorder='big')
-            
-            # Recebe resultado em chunks
-            result_data = b''
-            remaining = result_size
-            while remaining > 0:
-                chunk = client_socket.recv(min(65536, remaining))
-                if not chunk:
-                    break
-                result_data += chunk
-                remaining -= len(chunk)
+            meta = self.connections.call(server_addr, function, timeout=timeout)
+            span.add_remote(meta.get('spans'), f"servidor {server_addr[0]}:{server_addr[1]}")
+            check_reply(meta)
+            return meta
+        except Exception as e:
+            if attempt is None or not attempt.cancelled:
+                print(f"[ERRO] Falha ao comunicar com servidor {server_addr}: {e}")
+            return None
+    
+    def send_to_server(self, server_addr, submatrix_a, matrix_b, timeout=None, engine=None,
+                       b_hash=None, dtype=None, out=None, attempt=None, span=None):
+        """
+        Envia submatriz para um servidor e recebe resultado.
+        Usa uma conexão persistente do pool; otimizado para grandes volumes de dados.
+        O servidor devolve o resultado em blocos de linhas, escritos direto em out
+        à medida que chegam. Se A tiver pelo menos pipeline_min_bytes, ela também
+        vai em blocos de linhas (enviados por um thread próprio) e o servidor
+        multiplica cada bloco assim que chega.
+        timeout: limite (s) para conectar e para cada envio/recebimento
+        engine: motor de cálculo do servidor ('blas', 'tiles', 'threads', 'auto');
+                None usa o padrão do servidor
+        b_hash: hash de matrix_b (array_digest); se dado, B só é enviada quando
+                o servidor não a tem em cache
+        dtype: tipo em que o servidor calcula (padrão: np.result_type(A, B));
+               necessário quando matrix_b já foi reduzida com prepare_operand
+        out: array (ou visão) de destino com shape (linhas de A, colunas de B);
+             se None, um novo array é alocado
+        attempt: ShardAttempt que pode cancelar esta chamada
+        span: span do shard (tracing); seus IDs vão na requisição e os spans
+              do servidor voltam na resposta
+        """
+        span = span or NULL_SPAN
+        if dtype is None:
+            dtype = np.result_type(submatrix_a, matrix_b)
+        if out is None:
+            out = np.empty((submatrix_a.shape[0], matrix_b.shape[1]), dtype=dtype)
+        stream_rows = max(1, self.stream_block_bytes // max(1, out.shape[1] * out.itemsize))
+        request = {'op': 'multiply', 'engine': engine, 'dtype': np.dtype(dtype).str,
+                   'narrow_result': self.compact_dtypes, 'stream_rows': stream_rows}
+        if span.context():
+            request['trace'] = span.context()
+        pipelined = submatrix_a.nbytes >= self.pipeline_min_bytes
+        if not pipelined:
+            submatrix_a = self.prepare_operand(submatrix_a)
+        
+        block_target = self._block_target(out)
+        
+        def receive_blocks(conn):
+            """Recebe blocos do resultado (B é reenviada se o servidor a perdeu)"""
+            return self._receive_reply(conn, lambda meta: (b_hash, matrix_b), block_target)
+        
+        def multiply(conn):
+            connect.finish()
+            if attempt is not None:
+                attempt.attach(conn)
+            with span.child('transfer'):
+                if b_hash is None:
+                    conn.send(request, [submatrix_a, matrix_b])
+                else:
+                    conn.send(dict(request, b_hash=b_hash), [submatrix_a])
+            with span.child('receive'):
+                return receive_blocks(conn)
+        
+        def multiply_pipelined(conn):
+            connect.finish()
+            if attempt is not None:
+                attempt.attach(conn)
+            start = dict(request, op='multiply_pipelined')
+            with span.child('transfer', operand='B'):
+                if b_hash is None:
+                    conn.send(start, [matrix_b])
+                else:
+                    conn.send(dict(start, b_hash=b_hash))
+            # Aguarda B estar no servidor (enviada ou do cache) antes dos blocos de A
+            meta = receive_blocks(conn)
+            if meta.get('status') != 'ready':
+                return meta
             
-            result = pickle.loads(result_data)
-            client_socket.close()
+            failures = []
+            row_bytes = max(out.shape[1] * out.itemsize, submatrix_a.shape[1] * submatrix_a.itemsize)
+            block_rows = max(1, self.stream_block_bytes // max(1, row_bytes))
             
-            return result
+            def send_blocks():
+                try:
+                    with span.child('transfer', operand='A', pipelined=True):
+                        for row in range(0, submatrix_a.shape[0], block_rows):
+                            block = self.prepare_operand(submatrix_a[row:row + block_rows])
+                            conn.send({'op': 'a_block', 'row': row}, [block])
+                        conn.send({'op': 'a_end'})
+                except Exception as e:
+                    failures.append(e)
+                    conn.abort()
             
+            # Envio de A e recebimento de C acontecem ao mesmo tempo
+            sender = threading.Thread(target=send_blocks, daemon=True)
+            sender.start()
+            try:
+                with span.child('receive'):
+                    meta = receive_blocks(conn)
+            except Exception:
+                conn.abort()
+                raise
+            finally:
+                sender.join()
+            if failures:
+                raise failures[0]
+            return meta
+        
+        # Envia A (e B, se necessário) direto da memória por uma conexão persistente
+        connect = span.child('connect')
+        meta = self._call_server(server_addr, multiply_pipelined if pipelined else multiply,
+                                 timeout, attempt, span)
+        return None if meta is None else out
+    
+    def send_sparse(self, server_addr, submatrix_a, matrix_b, dtype, timeout=None, attempt=None,
+                    span=None):
+        """
+        Envia um par em que A e/ou B são esparsas (CSR/CSC, só os não-zeros) e
+        recebe o produto: denso, ou CSR se as duas forem esparsas.
+        Retorna o resultado, ou None em caso de falha.
+        """
+        specs, arrays = pack_operands([self.prepare_operand(submatrix_a),
+                                       self.prepare_operand(matrix_b)])
+        request = {'op': 'multiply_sparse', 'operands': specs, 'dtype': np.dtype(dtype).str,
+                   'narrow_result': self.compact_dtypes}
+        span = span or NULL_SPAN
+        if span.context():
+            request['trace'] = span.context()
+        
+        def multiply(conn):
+            if attempt is not None:
+                attempt.attach(conn)
+            with span.child('exchange'):
+                return conn.exchange(request, arrays)
+        
+        try:
+            meta, result_arrays = self.connections.call(server_addr, multiply, timeout=timeout)
+            span.add_remote(meta.get('spans'), f"servidor {server_addr[0]}:{server_addr[1]}")
+            check_reply(meta)
+            # O resultado sobrevive à requisição: não pode apontar para a memória do servidor
+            result, = unpack_operands(meta.get('operands'), [detach_array(a) for a in result_arrays])
+            return result.astype(dtype, copy=False)
+        except Exception as e:
+            if attempt is None or not attempt.cancelled:
+                print(f"[ERRO] Falha ao comunicar com servidor {server_addr}: {e}")
+            return None
+    
+    def send_batch(self, server_addr, batch_a, batch_b, out, timeout=None, attempt=None):
+        """
+        Envia um lote de pares empilhados (A_i, B_i) em uma única mensagem e
+        recebe os produtos direto em out (shape (n, linhas de A_i, colunas de B_i)).
+        Retorna out, ou None em caso de falha.
+        """
+        request = {'op': 'batch_multiply', 'dtype': out.dtype.str,
+                   'narrow_result': self.compact_dtypes}
+        
+        def result_target(meta, index, wire_dtype, shape):
+            return out if meta.get('status') == 'ok' else None
+        
+        def multiply(conn):
+            if attempt is not None:
+                attempt.attach(conn)
+            conn.send(request, [self.prepare_operand(batch_a), self.prepare_operand(batch_b)])
+            message = conn.recv(into=result_target)
+            if message is None:
+                raise ConnectionError("Servidor encerrou a conexão sem responder")
+            return message[0]
+        
+        try:
+            check_reply(self.connections.call(server_addr, multiply, timeout=timeout))
+            return out
         except Exception as e:
-            print(f"[ERRO] Falha ao comunicar com servidor {server_addr}: {e}")
+            if attempt is None or not attempt.cancelled:
+                print(f"[ERRO] Falha ao comunicar com servidor {server_addr}: {e}")
             return None
     
-    def distribute_multiplication(self, A, B, show_details=True):
+    def _pin_handle(self, server_addr, handle, timeout=None):
+        """Fixa o handle no servidor, enviando a matriz só se ele não a tiver"""
+        def pin(conn):
+            conn.send({'op': 'pin', 'digest': handle.digest})
+            return self._receive_reply(conn, lambda meta: (handle.digest, handle.wire))
+        
+        check_reply(self.connections.call(server_addr, pin, timeout=timeout))
+    
+    def send_chain(self, server_addr, handles, rows, dtype, out, timeout=None, engine=None,
+                   attempt=None, span=None):
+        """
+        Pede ao servidor a cadeia de produtos dos handles para as linhas
+        rows = (início, fim) do primeiro; o resultado chega em blocos direto
+        em out. Handles que o servidor não tiver são reenviados sob demanda.
+        Retorna (out, resposta final) ou None em caso de falha.
+        """
+        span = span or NULL_SPAN
+        stream_rows = max(1, self.stream_block_bytes // max(1, out.shape[1] * out.itemsize))
+        request = {'op': 'evaluate_chain', 'operands': [handle.digest for handle in handles],
+                   'rows': list(rows), 'dtype': np.dtype(dtype).str, 'engine': engine,
+                   'narrow_result': self.compact_dtypes, 'stream_rows': stream_rows}
+        if span.context():
+            request['trace'] = span.context()
+        by_digest = {handle.digest: handle for handle in handles}
+        
+        def upload(meta):
+            """Handle pedido de novo pelo servidor (que o perdeu do cache)"""
+            handle = by_digest.get(meta.get('digest'))
+            if handle is None:
+                raise ProtocolError(f"Servidor pediu matriz desconhecida: {meta.get('digest')}")
+            return handle.digest, handle.wire
+        
+        def evaluate(conn):
+            if attempt is not None:
+                attempt.attach(conn)
+            with span.child('transfer'):
+                conn.send(request)
+            with span.child('receive'):
+                return self._receive_reply(conn, upload, self._block_target(out))
+        
+        meta = self._call_server(server_addr, evaluate, timeout, attempt, span)
+        return None if meta is None else (out, meta)
+    
+    def server_stats(self, server_addr, timeout=None):
+        """
+        Consulta os contadores de um servidor: cache de B ('cache') e métricas
+        de requisições, filas, bytes e tempos de cálculo ('metrics')
+        """
+        meta, _ = self.connections.request(server_addr, {'op': 'stats'}, timeout=timeout)
+        check_reply(meta)
+        return meta
+    
+    def _run_shard(self, index, server_addr, submatrix, B, timeout, engine=None, b_hash=None,
+                   dtype=None, out=None, attempt=None):
+        """
+        Executa um shard em um servidor e mede seu tempo de parede.
+        Retorna (índice, resultado, tempo)
+        """
+        shard_start = time.time()
+        with self._shard_span(index, server_addr, attempt, rows=submatrix.shape[0],
+                              cols=B.shape[1]) as span:
+            result = self.send_to_server(server_addr, submatrix, B, timeout=timeout, engine=engine,
+                                         b_hash=b_hash, dtype=dtype, out=out, attempt=attempt,
+                                         span=span)
+            span.finish(ok=result is not None)
+        return index, result, time.time() - shard_start
+    
+    def _shard_span(self, index, server_addr, attempt=None, **args):
+        """Span de um shard da multiplicação em andamento (ou NULL_SPAN, sem trace)"""
+        if self._trace_root is None:
+            return NULL_SPAN
+        if attempt is not None:
+            args['speculative'] = attempt.speculative
+        return self._trace_root.child('shard', shard=index + 1,
+                                      server=f"{server_addr[0]}:{server_addr[1]}", **args)
+    
+    def _distribute_static(self, servers, A, B, result, partition, concurrent, timeout, engine,
+                           cache, show_details):
+        """
+        Um bloco de C por servidor (grade 2D ou só linhas).
+        Retorna o tempo de cada shard.
+        """
+        split_started = time.perf_counter_ns()
+        # Divide C em blocos: linhas de A x colunas de B
+        p, q, blocks = self.static_grid(A, B, servers, partition, cache)
+        tiles = self.split_grid(A, B, p, q)
+        
+        # Cada bloco de colunas de B é preparado (e tem seu hash calculado) uma vez
+        b_blocks, b_hashes = blocks or self.column_blocks(B, q, cache)
+        self.last_timings['split_ns'] = time.perf_counter_ns() - split_started
+        
+        if show_details:
+            print(f"[CLIENTE] Grade {p}x{q}: A dividida em {p} blocos de linhas, B em {q} de colunas")
+            for i, (r0, r1, c0, c1) in enumerate(tiles):
+                print(f"  - Bloco {i+1}: A[{r0}:{r1}] x B[:, {c0}:{c1}]")
+        
+        # Envia para servidores; cada bloco de C é escrito direto na sua posição
+        dtype = np.result_type(A, B)
+        shards = [(A[r0:r1], b_blocks[i % q], b_hashes[i % q], result[r0:r1, c0:c1])
+                  for i, (r0, r1, c0, c1) in enumerate(tiles)]
+        
+        def run(i, k, attempt):
+            a_block, b_block, b_hash, out = shards[i]
+            # Cópias especulativas recebem em memória própria; só a vencedora é copiada
+            target = np.empty(out.shape, dtype=dtype) if attempt and attempt.speculative else out
+            _, block, _ = self._run_shard(i, servers[k], a_block, b_block, timeout, engine, b_hash,
+                                          dtype, target, attempt)
+            if block is None:
+                return False
+            if target is not out:
+                out[...] = block
+            return True
+        
+        if concurrent:
+            if show_details:
+                print(f"\n[CLIENTE] Enviando {len(shards)} blocos simultaneamente...")
+            shard_times = self._run_with_failover(servers, len(shards), run, show_details)
+        else:
+            shard_times = self._run_sequential(servers, shards, run, show_details)
+        if cache:
+            self._placed_b[tuple(servers)] = (q, b_hashes)
+        return shard_times
+    
+    def _run_sequential(self, servers, shards, run, show_details):
+        """
+        Executa os shards um por vez (o shard i começa no servidor i); um
+        servidor que falha dá lugar aos demais. Retorna o tempo de cada shard.
+        """
+        shard_times = [0.0] * len(shards)
+        healthy = list(range(len(servers)))
+        for i in range(len(shards)):
+            # Tenta o servidor do shard; se falhar, os demais servidores saudáveis
+            candidates = sorted(healthy, key=lambda k: k != i)
+            shard_start = time.time()
+            for k in candidates:
+                if show_details:
+                    print(f"\n[CLIENTE] Enviando para servidor {k+1} ({servers[k][0]}:{servers[k][1]})...")
+                if run(i, k, None):
+                    shard_times[i] = time.time() - shard_start
+                    if show_details:
+                        print(f"[CLIENTE] Resultado recebido do servidor {k+1}: "
+                              f"{shards[i][3].shape} ({shard_times[i]:.4f}s)")
+                    break
+                healthy.remove(k)
+            else:
+                raise Exception(f"Falha ao receber resultado do shard {i+1} em todos os servidores")
+        
+        return shard_times
+    
+    def _run_with_failover(self, servers, num_shards, run, show_details):
+        """
+        Executa num_shards shards em paralelo (o shard i começa no servidor i)
+        com tolerância a falhas e a servidores lentos:
+          - um shard que falha é reexecutado em outro servidor saudável; o
+            servidor que falhou não recebe mais trabalho nesta chamada
+          - um shard que passa de speculation_factor x a mediana das latências
+            já observadas ganha uma cópia especulativa em um servidor ocioso;
+            vale o primeiro resultado e a outra tentativa é cancelada
+        run(i, k, attempt) executa o shard i no servidor k e retorna True se ok.
+        As tentativas canceladas terminam antes do retorno, então nenhuma
+        continua escrevendo no resultado depois dele.
+        Retorna o tempo de cada shard, do início da primeira tentativa ao
+        resultado (incluindo as que falharam).
+        """
+        shard_times = [0.0] * num_shards
+        # Latência da tentativa vencedora de cada shard (base da especulação)
+        latencies = [0.0] * num_shards
+        first_started = [None] * num_shards
+        healthy = set(range(len(servers)))
+        running = {}
+        done = set()
+        retry = deque()
+        executor = ThreadPoolExecutor(max_workers=2 * len(servers))
+        
+        def execute(i, k, attempt):
+            # A latência conta do início da execução, não do tempo na fila
+            attempt.started = time.monotonic()
+            if first_started[i] is None:
+                first_started[i] = attempt.started
+            return run(i, k, attempt)
+        
+        def launch(i, k, speculative=False):
+            attempt = ShardAttempt(i, k, speculative)
+            running[executor.submit(execute, i, k, attempt)] = attempt
+        
+        def idle_servers():
+            busy = {attempt.server for attempt in running.values()}
+            return [k for k in sorted(healthy) if k not in busy]
+        
+        try:
+            for i in range(num_shards):
+                launch(i, i % len(servers))
+            
+            while len(done) < num_shards:
+                finished, _ = wait(list(running), timeout=0.05, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    attempt = running.pop(future)
+                    i = attempt.index
+                    ok = future.result()
+                    if i in done:
+                        continue
+                    if ok:
+                        done.add(i)
+                        now = time.monotonic()
+                        latencies[i] = now - attempt.started
+                        shard_times[i] = now - first_started[i]
+                        for other in running.values():
+                            if other.index == i:
+                                other.cancel()
+                        if show_details:
+                            kind = " (cópia especulativa)" if attempt.speculative else ""
+                            print(f"[CLIENTE] Resultado do shard {i+1} recebido do servidor "
+                                  f"{attempt.server+1}{kind} ({shard_times[i]:.4f}s)")
+                    elif not attempt.cancelled:
+                        healthy.discard(attempt.server)
+                        print(f"[CLIENTE] Servidor {attempt.server+1} falhou; "
+                              f"shard {i+1} será reexecutado")
+                        if not any(other.index == i for other in running.values()):
+                            retry.append(i)
+                
+                idle = idle_servers()
+                while retry and idle:
+                    launch(retry.popleft(), idle.pop(0))
+                if retry and not running:
+                    raise Exception("Nenhum servidor saudável para reexecutar os shards restantes")
+                
+                # Cópias especulativas para shards muito acima da mediana
+                if self.speculation_factor and idle and done:
+                    threshold = self.speculation_factor * float(np.median([latencies[j] for j in done]))
+                    now = time.monotonic()
+                    for attempt in list(running.values()):
+                        if attempt.index in done:
+                            continue
+                        copies = sum(1 for other in running.values() if other.index == attempt.index)
+                        started = attempt.started
+                        if idle and copies == 1 and started is not None and now - started > threshold:
+                            k = idle.pop(0)
+                            launch(attempt.index, k, speculative=True)
+                            if show_details:
+                                print(f"[CLIENTE] Shard {attempt.index+1} lento no servidor "
+                                      f"{attempt.server+1}; cópia especulativa no servidor {k+1}")
+        finally:
+            # Cancelar interrompe a conexão; a espera garante que as tentativas
+            # perdedoras pararam de escrever no destino do shard
+            for attempt in running.values():
+                attempt.cancel()
+            executor.shutdown(wait=True)
+        
+        return shard_times
+    
+    def _distribute_sparse(self, servers, A, B, timeout, show_details):
+        """
+        Multiplicação com operandos esparsos: A é dividida em faixas de linhas
+        com o mesmo número de não-zeros (ou de linhas, se A for densa) e cada
+        servidor recebe B inteira. O resultado é denso, ou CSR se A e B forem
+        esparsas. Retorna (resultado, tempos dos shards)
+        """
+        split_started = time.perf_counter_ns()
+        dtype = np.result_type(A.dtype, B.dtype)
+        if is_sparse(A):
+            A = A.tocsr()
+            ranges = self.split_by_nnz(A, len(servers))
+        else:
+            ranges = self.split_ranges(A.shape[0], len(servers))
+        ranges = [(r0, r1) for r0, r1 in ranges if r1 > r0] or [(0, A.shape[0])]
+        self.last_timings['split_ns'] = time.perf_counter_ns() - split_started
+        
+        if show_details:
+            density = [m.nnz / max(1, m.shape[0] * m.shape[1]) for m in (A, B) if is_sparse(m)]
+            print(f"[CLIENTE] Operandos esparsos (densidade {', '.join(f'{d:.2%}' for d in density)}); "
+                  f"A dividida em {len(ranges)} faixas de linhas")
+            for i, (r0, r1) in enumerate(ranges):
+                nnz = A[r0:r1].nnz if is_sparse(A) else (r1 - r0) * A.shape[1]
+                print(f"  - Bloco {i+1}: A[{r0}:{r1}] ({nnz} não-zeros)")
+        
+        blocks = [None] * len(ranges)
+        
+        def run(i, k, attempt):
+            r0, r1 = ranges[i]
+            with self._shard_span(i, servers[k], attempt, rows=r1 - r0) as span:
+                block = self.send_sparse(servers[k], A[r0:r1], B, dtype, timeout, attempt, span)
+                span.finish(ok=block is not None)
+            if block is None:
+                return False
+            blocks[i] = block
+            return True
+        
+        shard_times = self._run_with_failover(servers, len(ranges), run, show_details)
+        assemble_started = time.perf_counter_ns()
+        if all(is_sparse(block) for block in blocks):
+            from scipy import sparse
+            result = sparse.vstack(blocks, format='csr')
+        else:
+            result = np.vstack([block.toarray() if is_sparse(block) else block for block in blocks])
+        self.last_timings['assemble_ns'] = time.perf_counter_ns() - assemble_started
+        return result, shard_times
+    
+    def _run_workers(self, servers, worker, pending):
+        """
+        Roda worker(k, servidor) para cada servidor até a fila esvaziar.
+        worker retorna False quando seu servidor falha (depois de devolver o
+        trabalho à fila); enquanto sobrar trabalho, os servidores saudáveis
+        rodam de novo.
+        """
+        healthy = list(range(len(servers)))
+        while True:
+            with ThreadPoolExecutor(max_workers=len(healthy)) as executor:
+                futures = {executor.submit(worker, k, servers[k]): k for k in healthy}
+                for future in as_completed(futures):
+                    if not future.result():
+                        healthy.remove(futures[future])
+            if not pending():
+                return
+            if not healthy:
+                raise Exception("Todos os servidores falharam antes de concluir a multiplicação")
+    
+    def _distribute_dynamic(self, servers, A, B, result, timeout, engine, cache, show_details):
+        """
+        Blocos de linhas de A distribuídos sob demanda (GuidedScheduler).
+        Cada servidor recebe B inteira, que fica no cache dele após o primeiro
+        bloco. Retorna o tempo ocupado de cada servidor.
+        """
+        split_started = time.perf_counter_ns()
+        scheduler = GuidedScheduler(A.shape[0], len(servers), min_chunk=self.min_chunk_rows)
+        dtype = np.result_type(A, B)
+        B_wire = self.prepare_operand(B)
+        b_hash = array_digest(B_wire) if cache else None
+        self.last_timings['split_ns'] = time.perf_counter_ns() - split_started
+        shard_times = [0.0] * len(servers)
+        chunk_counts = [0] * len(servers)
+        
+        def worker(k, server_addr):
+            while True:
+                chunk = scheduler.next_chunk(k)
+                if chunk is None:
+                    return True
+                r0, r1 = chunk
+                _, block, elapsed = self._run_shard(k, server_addr, A[r0:r1], B_wire, timeout, engine,
+                                                    b_hash, dtype, result[r0:r1])
+                if block is None:
+                    # Devolve o bloco à fila para os demais servidores e sai
+                    print(f"[CLIENTE] Servidor {k+1} falhou; linhas {r0}:{r1} voltam para a fila")
+                    scheduler.requeue(chunk)
+                    return False
+                scheduler.record(k, r1 - r0, elapsed)
+                shard_times[k] += elapsed
+                chunk_counts[k] += 1
+        
+        if show_details:
+            print(f"\n[CLIENTE] Distribuindo blocos de linhas sob demanda...")
+        self._run_workers(servers, worker, scheduler.pending)
+        
+        if show_details:
+            for k in range(len(servers)):
+                print(f"[CLIENTE] Servidor {k+1}: {chunk_counts[k]} blocos ({shard_times[k]:.4f}s)")
+        
+        return shard_times
+    
+    def plan_tiles(self, A, B, tile_bytes):
+        """
+        Divide C em blocos (linhas de A x colunas de B) tais que o bloco de A,
+        o bloco de B e o bloco de C somem no máximo tile_bytes.
+        Retorna lista de (linha_inicio, linha_fim, coluna_inicio, coluna_fim),
+        percorrendo as colunas por fora para que cada bloco de B seja
+        reaproveitado (e fique no cache dos servidores) por vários blocos de A.
+        """
+        rows, inner = A.shape
+        cols = B.shape[1]
+        itemsize = max(A.itemsize, B.itemsize)
+        out_itemsize = np.result_type(A, B).itemsize
+        
+        # Até um terço do orçamento para o bloco de B; o restante para A e C.
+        # Os passos são pelo menos 1 (com 0 linhas ou colunas não há blocos)
+        block_cols = max(1, min(cols, (tile_bytes // 3) // max(1, inner * itemsize)))
+        left = max(0, tile_bytes - inner * block_cols * itemsize)
+        block_rows = max(1, min(rows, left // max(1, inner * itemsize + block_cols * out_itemsize)))
+        
+        return [(r0, min(r0 + block_rows, rows), c0, min(c0 + block_cols, cols))
+                for c0 in range(0, cols, block_cols)
+                for r0 in range(0, rows, block_rows)]
+    
+    def _distribute_tiled(self, servers, A, B, result, tile_bytes, timeout, engine, cache,
+                          show_details):
+        """
+        Modo fora do núcleo: A, B e C podem ser np.memmap. Os blocos de
+        plan_tiles são entregues sob demanda e cada thread só materializa um
+        bloco de A, um de B e um de C por vez, limitando a memória residente
+        no cliente e nos servidores. Retorna o tempo ocupado de cada servidor.
+        """
+        tiles = self.plan_tiles(A, B, tile_bytes)
+        pending = queue.Queue()
+        for tile in tiles:
+            pending.put(tile)
+        
+        dtype = np.result_type(A, B)
+        shard_times = [0.0] * len(servers)
+        tile_counts = [0] * len(servers)
+        
+        if show_details:
+            print(f"[CLIENTE] Modo fora do núcleo: {len(tiles)} blocos de até "
+                  f"{tile_bytes / 1024 ** 2:.1f} MB")
+        
+        def worker(k, server_addr):
+            # Bloco de B atual: reaproveitado enquanto as colunas não mudam
+            current_cols, b_block, b_hash = None, None, None
+            while True:
+                try:
+                    r0, r1, c0, c1 = pending.get_nowait()
+                except queue.Empty:
+                    return True
+                if (c0, c1) != current_cols:
+                    current_cols = (c0, c1)
+                    b_block = self.prepare_operand(np.ascontiguousarray(B[:, c0:c1]))
+                    b_hash = array_digest(b_block) if cache else None
+                
+                a_block = np.ascontiguousarray(A[r0:r1])
+                out = result[r0:r1, c0:c1]
+                # Recebe em memória só quando o destino não é contíguo
+                target = out if out.flags.c_contiguous else None
+                _, block, elapsed = self._run_shard(k, server_addr, a_block, b_block, timeout, engine,
+                                                    b_hash, dtype, target)
+                if block is None:
+                    # Devolve o bloco à fila para os demais servidores e sai
+                    print(f"[CLIENTE] Servidor {k+1} falhou; bloco devolvido à fila")
+                    pending.put((r0, r1, c0, c1))
+                    return False
+                if target is None:
+                    out[...] = block
+                shard_times[k] += elapsed
+                tile_counts[k] += 1
+        
+        self._run_workers(servers, worker, lambda: not pending.empty())
+        
+        if isinstance(result, np.memmap):
+            assemble_started = time.perf_counter_ns()
+            result.flush()
+            self.last_timings['assemble_ns'] = time.perf_counter_ns() - assemble_started
+        if show_details:
+            for k in range(len(servers)):
+                print(f"[CLIENTE] Servidor {k+1}: {tile_counts[k]} blocos ({shard_times[k]:.4f}s)")
+        
+        return shard_times
+    
+    def distribute_multiplication(self, A, B, show_details=True, concurrent=True, timeout=None,
+                                  engine=None, cache=True, partition='grid', schedule='static',
+                                  servers=None, out=None, tile_bytes=None):
         """
         Distribui multiplicação de matrizes entre servidores.
+        concurrent: envia todos os blocos ao mesmo tempo (um thread por servidor);
+                    se False, envia um servidor por vez
+        timeout: limite (s) por servidor; padrão é o timeout do cliente
+        engine: motor de cálculo pedido aos servidores (None = padrão do servidor)
+        cache: envia B apenas aos servidores que não a têm em cache
+        partition: 'rows' divide só A por linhas (todos recebem B inteira);
+                   'grid' escolhe a grade 2D que minimiza os bytes enviados
+                   (com cache, B não conta na grade cujos blocos já estão
+                   nos servidores; ver static_grid)
+        schedule: 'static' (um bloco por servidor), 'dynamic' (blocos menores
+                  entregues sob demanda, equilibrando servidores heterogêneos) ou
+                  'tiled' (fora do núcleo, com memória limitada por tile_bytes)
+        servers: subconjunto dos servidores a usar (padrão: todos)
+        out: array de saída pré-alocado (shape linhas de A x colunas de B); os
+             blocos recebidos são escritos direto nele, sem cópia final.
+             Pode ser um caminho .npy, criado como np.memmap.
+        tile_bytes: memória máxima por bloco no modo 'tiled' (padrão 64 MB)
+        A e B podem ser caminhos de arquivos .npy (abertos como np.memmap);
+        nesse caso, ou com out em arquivo, o modo 'tiled' é usado.
+        A e B também podem ser matrizes esparsas CSR/CSC (SciPy): só os
+        não-zeros são enviados, A é dividida por número de não-zeros e o
+        resultado é CSR se as duas forem esparsas.
+        Os tempos por fase ficam em self.last_timings (ver phase_timings) e,
+        com trace=True no cliente, a linha do tempo dos shards em
+        self.last_trace (tracing.Tracer; salvar com
+        self.last_trace.save('trace.json') e abrir em chrome://tracing).
         Retorna (resultado, tempo_execucao)
         """
-        start_time = time.time()
+        start_time = time.perf_counter_ns()
+        totals_before = self.connections.totals()
+        self.last_timings = {'split_ns': 0, 'assemble_ns': 0}
+        self.last_trace = None
+        if timeout is None:
+            timeout = self.timeout
+        servers = servers or self.servers
+        
+        if any(isinstance(operand, (str, os.PathLike)) for operand in (A, B, out)):
+            schedule = 'tiled'
+        A = load_matrix(A)
+        B = load_matrix(B)
         
         if show_details:
             print(f"\n{'='*60}")
             print(f"[CLIENTE] Iniciando multiplicação distribuída")
             print(f"[CLIENTE] Matriz A: {A.shape}, Matriz B: {B.shape}")
-            print(f"[CLIENTE] Número de servidores: {self.num_servers}")
-        
-        # Divide matriz A em submatrizes
-        submatrices = self.split_matrix(A, self.num_servers)
+            print(f"[CLIENTE] Número de servidores: {len(servers)}")
         
-        if show_details:
-            print(f"[CLIENTE] Matriz A dividida em {len(submatrices)} partes")
-            for i, sub in enumerate(submatrices):
-                print(f"  - Submatriz {i+1}: {sub.shape}")
+        if is_sparse(A) or is_sparse(B):
+            if out is not None:
+                raise ValueError("out não é suportado com operandos esparsos")
+            schedule = 'sparse'
+            result = None
+        elif out is None:
+            result = np.empty((A.shape[0], B.shape[1]), dtype=np.result_type(A, B))
+        elif isinstance(out, (str, os.PathLike)):
+            result = np.lib.format.open_memmap(out, mode='w+', dtype=np.result_type(A, B),
+                                               shape=(A.shape[0], B.shape[1]))
+        elif out.shape != (A.shape[0], B.shape[1]):
+            raise ValueError(f"out deve ter shape {(A.shape[0], B.shape[1])}, recebido {out.shape}")
+        else:
+            result = out
         
-        # Envia para servidores e coleta resultados
-        results = []
-        for i, (server_addr, submatrix) in enumerate(zip(self.servers, submatrices)):
-            if show_details:
-                print(f"\n[CLIENTE] Enviando para servidor {i+1} ({server_addr[0]}:{server_addr[1]})...")
-            
-            result = self.send_to_server(server_addr, submatrix, B)
-            
-            if result is not None:
-                results.append(result)
-                if show_details:
-                    print(f"[CLIENTE] Resultado recebido do servidor {i+1}: {result.shape}")
+        if self.trace:
+            self.last_trace = Tracer()
+            self._trace_root = self.last_trace.start('distribute_multiplication',
+                                                     shape_a=list(A.shape), shape_b=list(B.shape),
+                                                     schedule=schedule, servers=len(servers))
+        try:
+            if schedule == 'sparse':
+                result, shard_times = self._distribute_sparse(servers, A, B, timeout, show_details)
+            elif schedule == 'dynamic':
+                shard_times = self._distribute_dynamic(servers, A, B, result, timeout, engine, cache,
+                                                       show_details)
+            elif schedule == 'static':
+                shard_times = self._distribute_static(servers, A, B, result, partition, concurrent,
+                                                      timeout, engine, cache, show_details)
+            elif schedule == 'tiled':
+                shard_times = self._distribute_tiled(servers, A, B, result,
+                                                     tile_bytes or 64 * 1024 ** 2, timeout, engine,
+                                                     cache, show_details)
             else:
-                raise Exception(f"Falha ao receber resultado do servidor {i+1}")
+                raise ValueError(f"Escalonamento desconhecido: {schedule}")
+        finally:
+            # Uma chamada que falhou não pode deixar a raiz para os shards da próxima
+            if self._trace_root is not None:
+                self._trace_root.finish()
+                self._trace_root = None
         
-        # Concatena resultados
-        final_result = np.vstack(results)
-        end_time = time.time()
-        execution_time = end_time - start_time
+        self.last_shard_times = shard_times
+        end_time = time.perf_counter_ns()
+        execution_time = (end_time - start_time) / 1e9
+        self.last_timings = self.phase_timings(self.last_timings, totals_before,
+                                               end_time - start_time)
         
         if show_details:
+            slowest = int(np.argmax(shard_times))
+            # Nos modos sob demanda os tempos são por servidor; nos demais, por shard
+            unit = 'servidor' if schedule in ('dynamic', 'tiled') else 'shard'
             print(f"\n[CLIENTE] Multiplicação concluída!")
-            print(f"[CLIENTE] Matriz resultado C: {final_result.shape}")
+            print(f"[CLIENTE] Matriz resultado C: {result.shape}")
+            print(f"[CLIENTE] Mais lento: {unit} {slowest+1} ({shard_times[slowest]:.4f}s)")
             print(f"[CLIENTE] Tempo de execução: {execution_time:.4f} segundos")
             print(f"{'='*60}\n")
         
-        return final_result, execution_time
+        return result, execution_time
+    
+    def batch_multiply(self, A, B, show_details=False, timeout=None, servers=None):
+        """
+        Multiplica muitos pares pequenos independentes (A_i @ B_i).
+        A, B: arrays 3D empilhados, shapes (n, m, k) e (n, k, p), ou listas de
+              matrizes 2D (pares com o mesmo formato são empilhados juntos)
+        Os pares são divididos entre os servidores em poucos lotes de até
+        batch_frame_bytes, cada um calculado no servidor com um único np.matmul.
+        Retorna (resultado, tempo_execucao): array 3D empilhado, ou lista de
+        matrizes quando os pares têm formatos diferentes.
+        """
+        start_time = time.time()
+        if timeout is None:
+            timeout = self.timeout
+        servers = servers or self.servers
+        if len(A) != len(B):
+            raise ValueError(f"Listas de tamanhos diferentes: {len(A)} e {len(B)}")
+        
+        # Grupos de pares com o mesmo formato: (índices, A empilhadas, B empilhadas)
+        if isinstance(A, np.ndarray) and isinstance(B, np.ndarray) and A.ndim == B.ndim == 3:
+            groups = [(range(len(A)), A, B)]
+        else:
+            by_shape = {}
+            for i, (a, b) in enumerate(zip(A, B)):
+                a, b = np.asarray(a), np.asarray(b)
+                by_shape.setdefault((a.shape, b.shape, a.dtype, b.dtype), []).append(i)
+            groups = [(indices, np.stack([A[i] for i in indices]), np.stack([B[i] for i in indices]))
+                      for indices in by_shape.values()]
+        
+        shards, results = [], []
+        for _, batch_a, batch_b in groups:
+            if batch_a.ndim != 3 or batch_b.ndim != 3 or batch_a.shape[2] != batch_b.shape[1]:
+                raise ValueError(f"Dimensões incompatíveis: {batch_a.shape[1:]} x {batch_b.shape[1:]}")
+            result = np.empty((len(batch_a), batch_a.shape[1], batch_b.shape[2]),
+                              dtype=np.result_type(batch_a, batch_b))
+            results.append(result)
+            pair_bytes = (batch_a[0].nbytes + batch_b[0].nbytes + result[0].nbytes) if len(result) else 1
+            num_frames = max(len(servers), -(-len(result) * pair_bytes // self.batch_frame_bytes))
+            for b0, b1 in self.split_ranges(len(result), min(num_frames, max(1, len(result)))):
+                if b1 > b0:
+                    shards.append((batch_a[b0:b1], batch_b[b0:b1], result[b0:b1]))
+        
+        if show_details:
+            print(f"\n[CLIENTE] Lote de {len(A)} produtos em {len(shards)} mensagens "
+                  f"para {len(servers)} servidores")
+        
+        def run(i, k, attempt):
+            batch_a, batch_b, out = shards[i]
+            target = np.empty_like(out) if attempt.speculative else out
+            if self.send_batch(servers[k], batch_a, batch_b, target, timeout, attempt) is None:
+                return False
+            if target is not out:
+                out[...] = target
+            return True
+        
+        if shards:
+            self.last_shard_times = self._run_with_failover(servers, len(shards), run, show_details)
+        execution_time = time.time() - start_time
+        if show_details:
+            print(f"[CLIENTE] {len(A)} produtos em {execution_time:.4f} segundos "
+                  f"({len(A) / max(execution_time, 1e-9):.0f} produtos/s)")
+        
+        if len(groups) == 1:
+            return results[0], execution_time
+        ordered = [None] * len(A)
+        for (indices, _, _), result in zip(groups, results):
+            for position, i in enumerate(indices):
+                ordered[i] = result[position]
+        return ordered, execution_time
+    
+    def upload(self, matrix, name=None, servers=None, timeout=None):
+        """
+        Envia uma matriz aos servidores (só aos que ainda não a têm) e a fixa
+        no cache deles. Retorna um MatrixHandle, que pode ser combinado com
+        '@' em expressões avaliadas por evaluate sem reenviar a matriz.
+        """
+        matrix = load_matrix(matrix)
+        if is_sparse(matrix) or np.ndim(matrix) != 2:
+            raise ValueError("Handles aceitam apenas matrizes densas 2D")
+        wire = self.prepare_operand(np.ascontiguousarray(matrix))
+        handle = MatrixHandle(self, array_digest(wire), wire, np.asarray(matrix).dtype, name)
+        if timeout is None:
+            timeout = self.timeout
+        
+        def pin(server_addr):
+            try:
+                self._pin_handle(server_addr, handle, timeout)
+                return server_addr
+            except Exception as e:
+                # O servidor recebe a matriz sob demanda na avaliação
+                print(f"[ERRO] Falha ao enviar {handle.name} ao servidor {server_addr}: {e}")
+                return None
+        
+        servers = servers or self.servers
+        with ThreadPoolExecutor(max_workers=len(servers)) as executor:
+            handle.servers = [server for server in executor.map(pin, servers) if server is not None]
+        self._handles.append(handle)
+        return handle
+    
+    def release(self, handle, timeout=None):
+        """Libera o handle nos servidores (a matriz volta a poder sair do cache)"""
+        if handle in self._handles:
+            self._handles.remove(handle)
+        for server_addr in handle.servers:
+            try:
+                meta, _ = self.connections.request(server_addr, {'op': 'release',
+                                                                 'digests': [handle.digest]},
+                                                   timeout=timeout or self.timeout)
+                check_reply(meta)
+            except Exception as e:
+                print(f"[ERRO] Falha ao liberar {handle.name} no servidor {server_addr}: {e}")
+        handle.servers = []
+    
+    def evaluate(self, expression, show_details=False, timeout=None, servers=None, engine=None):
+        """
+        Calcula uma expressão de handles (ex.: h1 @ h2 @ h3) nos servidores,
+        na ordem que minimiza as operações (chain_order).
+        Os produtos à direita do ramo esquerdo dessa ordem (ver left_spine)
+        não dependem das linhas do primeiro operando: cada um é calculado uma
+        vez (distribuído da mesma forma) e enviado aos servidores como handle
+        temporário. Depois o primeiro operando é dividido em faixas de linhas,
+        uma por servidor; cada servidor multiplica sua faixa pela cadeia
+        restante e só as linhas do resultado final voltam ao cliente.
+        A ordem escolhida para a cadeia completa fica em self.last_chain_order.
+        Retorna (resultado, tempo_execucao)
+        """
+        start_time = time.time()
+        if timeout is None:
+            timeout = self.timeout
+        servers = servers or self.servers
+        handles = expression.operands()
+        dims = [handles[0].shape[0]] + [handle.shape[1] for handle in handles]
+        cost, order = chain_order(dims)
+        self.last_chain_order = order
+        dtype = np.result_type(*[handle.dtype for handle in handles])
+        result = np.empty(expression.shape, dtype=dtype)
+        
+        if show_details:
+            names = [handle.name for handle in handles]
+            print(f"\n[CLIENTE] Expressão com {len(handles)} matrizes: {' @ '.join(names)}")
+            print(f"[CLIENTE] Ordem escolhida: {format_order(order, names)} "
+                  f"({cost} multiplicações; da esquerda para a direita seriam "
+                  f"{left_to_right_cost(dims)})")
+        
+        if len(handles) == 1:
+            result[...] = handles[0].wire
+            return result, time.time() - start_time
+        
+        chain, temporary = [handles[0]], []
+        try:
+            for subtree in left_spine(order):
+                indices = tree_leaves(subtree)
+                if len(indices) == 1:
+                    chain.append(handles[indices[0]])
+                    continue
+                product = handles[indices[0]]
+                for handle in handles[indices[1]:indices[-1] + 1]:
+                    product = product @ handle
+                value, _ = self.evaluate(product, timeout=timeout, servers=servers, engine=engine)
+                name = format_order(subtree, [handle.name for handle in handles])
+                temporary.append(self.upload(value, name=name, servers=servers, timeout=timeout))
+                chain.append(temporary[-1])
+                if show_details:
+                    print(f"[CLIENTE] {name} calculado uma vez e enviado aos servidores")
+            self.last_chain_order = order
+            
+            ranges = [(r0, r1) for r0, r1 in self.split_ranges(dims[0], len(servers)) if r1 > r0]
+            
+            def run(i, k, attempt):
+                r0, r1 = ranges[i]
+                out = result[r0:r1]
+                target = np.empty_like(out) if attempt.speculative else out
+                if self.send_chain(servers[k], chain, (r0, r1), dtype, target, timeout, engine,
+                                   attempt) is None:
+                    return False
+                if target is not out:
+                    out[...] = target
+                return True
+            
+            if ranges:
+                self.last_shard_times = self._run_with_failover(servers, len(ranges), run,
+                                                                show_details)
+        finally:
+            for handle in temporary:
+                self.release(handle, timeout)
+        execution_time = time.time() - start_time
+        if show_details:
+            print(f"[CLIENTE] Expressão {result.shape} calculada em {execution_time:.4f} segundos")
+        return result, execution_time
+    
+    def phase_timings(self, local, totals_before, total_ns):
+        """
+        Junta os tempos locais (divisão e montagem) aos contadores das conexões
+        desde totals_before. Fases de comunicação e do servidor são somadas
+        entre os threads, então podem passar do tempo total.
+        """
+        totals = self.connections.totals()
+        delta = {key: totals[key] - totals_before[key] for key in STAT_KEYS}
+        return {
+            'total_ns': total_ns,
+            'split_ns': local.get('split_ns', 0),
+            'serialize_ns': delta['serialize_ns'],
+            'send_ns': delta['send_ns'],
+            'server_compute_ns': delta['server_compute_ns'],
+            'server_serialize_ns': delta['server_serialize_ns'],
+            'receive_ns': delta['receive_ns'],
+            'assemble_ns': local.get('assemble_ns', 0),
+            'bytes_sent': delta['bytes_sent'],
+            'bytes_received': delta['bytes_received'],
+        }
+    
+    def calibrate(self, size=256, payload_bytes=4 * 1024 * 1024, repeats=3, dtype=np.int64):
+        """
+        Mede latência, largura de banda e taxa de cálculo (local e de cada
+        servidor) e guarda o modelo em self.cost_model.
+        size/dtype: matrizes de teste, no tipo da carga real
+        """
+        def median_time(function):
+            """Mediana dos tempos de function(); None se alguma chamada falhar (None)"""
+            times = []
+            for _ in range(repeats):
+                start = time.perf_counter()
+                if function() is None:
+                    return None
+                times.append(time.perf_counter() - start)
+            return float(np.median(times))
+        
+        A = np.random.randint(-10, 10, size=(size, size)).astype(dtype)
+        B = np.random.randint(-10, 10, size=(size, size)).astype(dtype)
+        flops = CostModel.flops(A, B)
+        payload = np.zeros(payload_bytes, dtype=np.uint8)
+        
+        local_flops = flops / median_time(lambda: np.dot(A, B))
+        # Bytes de A e de C como trafegam (no menor tipo, se compact_dtypes)
+        wire_bytes = self.prepare_operand(A).nbytes + self.prepare_operand(np.dot(A, B)).nbytes
+        b_hash = array_digest(B)
+        
+        latencies, bandwidths, server_flops = [], [], []
+        for server_addr in self.servers:
+            # Servidor que não responde fica com taxa 0 (nunca é escolhido)
+            # e não entra nas medianas de latência e largura de banda
+            try:
+                latency = median_time(lambda: self.connections.request(server_addr, {'op': 'ping'},
+                                                                       timeout=self.timeout))
+                transfer = median_time(lambda: self.connections.request(server_addr, {'op': 'ping'},
+                                                                        [payload], timeout=self.timeout))
+            except (OSError, ProtocolError) as e:
+                print(f"[CLIENTE] Calibração: servidor {server_addr} indisponível ({e})")
+                server_flops.append(0.0)
+                continue
+            bandwidth = payload_bytes / max(transfer - latency, 1e-9)
+            
+            # B fica em cache após a primeira chamada: o tempo medido é A + cálculo + C
+            self.send_to_server(server_addr, A, B, timeout=self.timeout, b_hash=b_hash)
+            elapsed = median_time(lambda: self.send_to_server(server_addr, A, B, timeout=self.timeout,
+                                                              b_hash=b_hash))
+            if elapsed is None:
+                print(f"[CLIENTE] Calibração: servidor {server_addr} falhou na multiplicação")
+                server_flops.append(0.0)
+                continue
+            latencies.append(latency)
+            bandwidths.append(bandwidth)
+            server_flops.append(flops / max(elapsed - latency - wire_bytes / bandwidth, 1e-9))
+        
+        if not latencies:
+            # Nenhum servidor respondeu: só a execução local é viável
+            latencies, bandwidths = [float('inf')], [1.0]
+        self.cost_model = CostModel(float(np.median(latencies)), float(np.median(bandwidths)),
+                                    local_flops, server_flops)
+        return self.cost_model
+    
+    def plan(self, A, B, cache=True, partition='grid', schedule='static'):
+        """
+        Usa o modelo de custo para escolher onde executar A @ B, com a mesma
+        grade que distribute_multiplication usaria com essas opções.
+        Retorna (servidores, tempo_estimado); lista vazia = execução local.
+        """
+        if self.cost_model is None:
+            self.calibrate()
+        model = self.cost_model
+        itemsizes = model.wire_itemsizes(A, B, self.compact_dtypes)
+        
+        # Servidores ordenados do mais rápido para o mais lento
+        ranked = [self.servers[i] for i in np.argsort(model.server_flops)[::-1]]
+        options = [([], model.estimate(A, B, 0))]
+        for k in range(1, self.num_servers + 1):
+            servers = ranked[:k]
+            b_cached = False
+            if schedule == 'static':
+                p, q, known = self.static_grid(A, B, servers, partition, cache)
+                # Blocos de B iguais aos da última distribuição nesses servidores
+                b_cached = known is not None and known[1] == self._placed_b[tuple(servers)][1]
+            else:
+                p, q = k, 1
+            options.append((servers, model.estimate(A, B, k, (p, q), itemsizes, b_cached)))
+        return min(options, key=lambda option: option[1])
+    
+    def multiply(self, A, B, show_details=False, **options):
+        """
+        Modo automático: executa localmente, em parte dos servidores ou em
+        todos, conforme o modelo de custo (calibrado na primeira chamada).
+        options: repassadas a distribute_multiplication
+        Retorna (resultado, tempo_execucao)
+        """
+        plan_options = {key: options[key] for key in ('cache', 'partition', 'schedule') if key in options}
+        servers, estimate = self.plan(A, B, **plan_options)
+        self.last_plan = {'servers': servers, 'estimated_time': estimate}
+        if show_details:
+            where = f"{len(servers)} servidor(es)" if servers else "localmente"
+            print(f"[CLIENTE] Modelo de custo: executando {where} (estimativa {estimate:.4f}s)")
+        
+        if not servers:
+            return multiplicacao_serial(A, B)
+        return self.distribute_multiplication(A, B, show_details=show_details, servers=servers,
+                                              **options)
     
     def verify_result(self, A, B, C_distributed):
         """Verifica se o resultado distribuído está correto"""
-        C_numpy = np.dot(A, B)
-        return np.allclose(C_distributed, C_numpy)
+        C_numpy = A @ B
+        dense = [C.toarray() if is_sparse(C) else np.asarray(C) for C in (C_distributed, C_numpy)]
+        return np.allclose(*dense)
+
+
+def load_servers(path):
+    """
+    Lê a lista de servidores gravada pelo run_system
+    ({"servers": [{"host": ..., "port": ...}, ...]}) e retorna [(host, porta), ...]
+    """
+    with open(path) as f:
+        data = json.load(f)
+    return [(entry['host'], int(entry['port'])) for entry in data['servers']]
 
 
 def modo_apresentacao():
@@ -156,14 +1654,21 @@ def modo_apresentacao():
     
     # Configuração dos servidores
     print("\n[CONFIG] Configurando servidores...")
-    num_servers = int(input("Quantos servidores deseja utilizar? (recomendado: 2-4): "))
-    
-    servers = []
-    for i in range(num_servers):
-        print(f"\nServidor {i+1}:")
-        host = input(f"  Host (deixe vazio para 'localhost'): ").strip() or 'localhost'
-        port = int(input(f"  Porta (ex: {5000+i}): "))
-        servers.append((host, port))
+    servers_file = os.environ.get('MATRIX_SERVERS_FILE')
+    if servers_file:
+        # Servidores iniciados pelo run_system
+        servers = load_servers(servers_file)
+        for i, (host, port) in enumerate(servers):
+            print(f"  Servidor {i+1}: {host}:{port}")
+    else:
+        num_servers = int(input("Quantos servidores deseja utilizar? (recomendado: 2-4): "))
+        
+        servers = []
+        for i in range(num_servers):
+            print(f"\nServidor {i+1}:")
+            host = input(f"  Host (deixe vazio para 'localhost'): ").strip() or 'localhost'
+            port = int(input(f"  Porta (ex: {5000+i}): "))
+            servers.append((host, port))
     
     # Dimensões das matrizes
     print("\n[CONFIG] Dimensões das matrizes:")
@@ -227,9 +1732,20 @@ def modo_apresentacao():
         print(f"     pode ser maior que o ganho de paralelização.")
         print(f"     Teste com matrizes maiores (ex: 200×200 ou mais)!")
     
+    client.close()
     print("\n" + "="*70)
 
 
+def load_matrix(matrix):
+    """
+    Abre um caminho .npy como np.memmap somente leitura (sem carregar na
+    memória); arrays são retornados sem alteração.
+    """
+    if isinstance(matrix, (str, os.PathLike)):
+        return np.load(matrix, mmap_mode='r')
+    return matrix
+
+
 def multiplicacao_serial(A, B):
     """Multiplicação serial usando NumPy para comparação"""
     start_time = time.time()
@@ -244,9 +1760,14 @@ def modo_benchmark():
     print("  MODO BENCHMARK - COMPARAÇÃO SERIAL VS DISTRIBUÍDO")
     print("="*70)
     
-    # Configuração
-    num_servers = int(input("\nNúmero de servidores: "))
-    servers = [('localhost', 5000 + i) for i in range(num_servers)]
+    # Configuração (servidores iniciados pelo run_system, se houver a lista)
+    servers_file = os.environ.get('MATRIX_SERVERS_FILE')
+    if servers_file:
+        servers = load_servers(servers_file)
+        num_servers = len(servers)
+    else:
+        num_servers = int(input("\nNúmero de servidores: "))
+        servers = [('localhost', 5000 + i) for i in range(num_servers)]
     
     print("\nServidores configurados:")
     for i, srv in enumerate(servers):
@@ -315,6 +1836,8 @@ def modo_benchmark():
         print(f"  → Distribuído: {tempo_medio_dist:.4f}s (±{tempo_std_dist:.4f}s)")
         print(f"  → Speedup: {speedup:.2f}x")
     
+    client.close()
+    
     # Salva resultados
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
     filename = f"benchmark_results_{timestamp}.json"
@@ -336,6 +1859,8 @@ def modo_benchmark():
 
 def gerar_graficos_comparacao(resultados, num_servers, timestamp):
     """Gera gráficos individuais comparando serial vs distribuído"""
+    # Importado só aqui: o matplotlib atrasa o início do cliente
+    import matplotlib.pyplot as plt
     
     tamanhos = [r['tamanho'] for r in resultados]
     tempos_dist = [r['tempo_medio_distribuido'] for r in resultados]
@@ -0,0 +1,160 @@
+"""
+Expressões preguiçosas de produtos de matrizes residentes nos servidores.
+
+MatrixClient.upload(matriz) envia a matriz uma única vez a cada servidor e
+retorna um MatrixHandle: o hash do conteúdo, fixado no cache dos servidores
+(não é descartado pelo LRU até MatrixClient.release). Produtos de handles
+(h1 @ h2 @ h3) não calculam nada: montam uma expressão, avaliada por
+MatrixClient.evaluate. Cada servidor recebe uma faixa de linhas do operando
+mais à esquerda (os demais já estão lá) e calcula a cadeia para ela; os
+produtos intermediários ficam no servidor e só as linhas do resultado final
+voltam ao cliente. Produtos que não envolvem o operando mais à esquerda são
+iguais em todas as faixas: são calculados antes, uma única vez, e viram
+handles temporários (ver left_spine).
+
+A ordem das multiplicações é a da programação dinâmica clássica da cadeia
+de matrizes (chain_order), que minimiza o número de operações escalares.
+"""
+from abc import ABC, abstractmethod
+
+
+def chain_order(dims):
+    """
+    Ordem ótima para multiplicar a cadeia M1 ... Mn, em que Mi tem shape
+    (dims[i-1], dims[i]).
+    Retorna (custo, árvore): custo em multiplicações escalares e árvore em
+    que cada folha é o índice de um operando e cada nó interno um par
+    [esquerda, direita].
+    """
+    n = len(dims) - 1
+    if n < 1:
+        raise ValueError("A cadeia precisa de pelo menos um operando")
+    cost = [[0] * n for _ in range(n)]
+    split = [[0] * n for _ in range(n)]
+    for length in range(2, n + 1):
+        for i in range(n - length + 1):
+            j = i + length - 1
+            cost[i][j] = None
+            for k in range(i, j):
+                candidate = cost[i][k] + cost[k + 1][j] + dims[i] * dims[k + 1] * dims[j + 1]
+                if cost[i][j] is None or candidate < cost[i][j]:
+                    cost[i][j], split[i][j] = candidate, k
+    
+    def tree(i, j):
+        if i == j:
+            return i
+        return [tree(i, split[i][j]), tree(split[i][j] + 1, j)]
+    
+    return cost[0][n - 1], tree(0, n - 1)
+
+
+def left_to_right_cost(dims):
+    """Custo (multiplicações escalares) de multiplicar a cadeia da esquerda para a direita"""
+    return sum(dims[0] * dims[k] * dims[k + 1] for k in range(1, len(dims) - 1))
+
+
+def left_to_right_order(count):
+    """Árvore (como a de chain_order) que multiplica count operandos da esquerda para a direita"""
+    order = 0
+    for index in range(1, count):
+        order = [order, index]
+    return order
+
+
+def left_spine(order):
+    """
+    Subárvores à direita ao longo do ramo esquerdo de order, de baixo para
+    cima: order = ((0 @ R1) @ R2) ... @ Rn retorna [R1, ..., Rn]. Só o ramo
+    esquerdo depende das linhas do primeiro operando.
+    """
+    spine = []
+    while not isinstance(order, int):
+        order, right = order
+        spine.append(right)
+    return spine[::-1]
+
+
+def tree_leaves(order):
+    """Índices dos operandos de uma (sub)árvore de chain_order, em ordem"""
+    if isinstance(order, int):
+        return [order]
+    left, right = order
+    return tree_leaves(left) + tree_leaves(right)
+
+
+def evaluate_order(order, operands, multiply):
+    """Calcula a árvore de chain_order com multiply(a, b) sobre os operandos"""
+    if isinstance(order, int):
+        return operands[order]
+    left, right = order
+    return multiply(evaluate_order(left, operands, multiply),
+                    evaluate_order(right, operands, multiply))
+
+
+def format_order(order, names):
+    """Árvore de chain_order como texto, ex.: '(A @ (B @ C))'"""
+    if isinstance(order, int):
+        return names[order]
+    left, right = order
+    return f"({format_order(left, names)} @ {format_order(right, names)})"
+
+
+class Expression(ABC):
+    """Nó de uma expressão preguiçosa; '@' entre expressões monta um produto"""
+    def __matmul__(self, other):
+        if not isinstance(other, Expression):
+            return NotImplemented
+        return MatMul(self, other)
+    
+    @abstractmethod
+    def operands(self):
+        """Handles da cadeia, da esquerda para a direita (o produto é associativo)"""
+    
+    def evaluate(self, **kwargs):
+        """Calcula a expressão nos servidores; ver MatrixClient.evaluate"""
+        return self.client.evaluate(self, **kwargs)
+
+
+class MatrixHandle(Expression):
+    """
+    Matriz residente nos servidores, identificada pelo hash do conteúdo.
+    Mantém a matriz como foi enviada (wire) para reenviá-la a um servidor
+    que a tenha perdido (ex.: reiniciado).
+    """
+    def __init__(self, client, digest, wire, dtype, name=None):
+        self.client = client
+        self.digest = digest
+        self.wire = wire
+        self.dtype = dtype
+        self.shape = wire.shape
+        self.name = name or f"M{digest[:6]}"
+        self.servers = []
+    
+    def operands(self):
+        return [self]
+    
+    def release(self):
+        """Libera a matriz nos servidores (volta a poder ser descartada do cache)"""
+        self.client.release(self)
+    
+    def __repr__(self):
+        return f"MatrixHandle({self.name}, shape={self.shape}, dtype={self.dtype})"
+
+
+class MatMul(Expression):
+    """Produto (preguiçoso) de duas expressões"""
+    def __init__(self, left, right):
+        if left.client is not right.client:
+            raise ValueError("Operandos de clientes diferentes")
+        if left.shape[1] != right.shape[0]:
+            raise ValueError(f"Dimensões incompatíveis: {left.shape} x {right.shape}")
+        self.client = left.client
+        self.left = left
+        self.right = right
+        self.shape = (left.shape[0], right.shape[1])
+    
+    def operands(self):
+        return self.left.operands() + self.right.operands()
+    
+    def __repr__(self):
+        return f"({self.left!r} @ {self.right!r})"
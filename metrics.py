@@ -0,0 +1,195 @@
+"""
+Métricas do servidor: contadores, medidores e histogramas de latência.
+
+Os valores ficam em memória e são expostos de duas formas:
+  - snapshot(): dict serializável em JSON, devolvido pela operação 'stats'
+  - render_prometheus(): formato texto do Prometheus, servido por
+    start_http_server em uma porta separada (GET /metrics)
+"""
+import bisect
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Limites (s) dos histogramas de latência: de 100 us a 60 s
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class Histogram:
+    """Histograma com limites fixos (acumulados no formato do Prometheus)"""
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+    
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+    
+    def quantile(self, q):
+        """Estimativa do quantil q pelo limite superior do bucket que o contém"""
+        if not self.count:
+            return 0.0
+        target = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= target:
+                return bound
+        return float('inf')
+    
+    def snapshot(self):
+        cumulative, seen = [], 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            cumulative.append([bound, seen])
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'p50': self.quantile(0.5),
+            'p90': self.quantile(0.9),
+            'p99': self.quantile(0.99),
+            'buckets': cumulative,
+        }
+
+
+class Metrics:
+    """
+    Registro de métricas seguro entre threads. Cada métrica tem um nome e,
+    opcionalmente, rótulos (ex.: op='multiply'). Funções em collectors são
+    chamadas com o registro antes de cada leitura, para atualizar valores
+    mantidos em outro lugar.
+    """
+    def __init__(self, prefix='matrix_server'):
+        self.prefix = prefix
+        self.started = time.time()
+        self._counters = {}
+        self._gauges = {}
+        self._histograms = {}
+        self._help = {}
+        self.collectors = []
+        self._lock = threading.Lock()
+    
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted(labels.items()))
+    
+    def describe(self, name, text):
+        """Texto de ajuda da métrica (linha # HELP do Prometheus)"""
+        self._help[name] = text
+    
+    def inc(self, name, amount=1, **labels):
+        """Soma amount a um contador"""
+        key = self._key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+    
+    def set_counter(self, name, value, **labels):
+        """Define o total de um contador mantido em outro lugar (ver collectors)"""
+        with self._lock:
+            self._counters[self._key(name, labels)] = value
+    
+    def set(self, name, value, **labels):
+        """Define o valor de um medidor"""
+        with self._lock:
+            self._gauges[self._key(name, labels)] = value
+    
+    def add(self, name, amount, **labels):
+        """Soma amount (pode ser negativo) a um medidor"""
+        key = self._key(name, labels)
+        with self._lock:
+            self._gauges[key] = self._gauges.get(key, 0) + amount
+    
+    def observe(self, name, value, **labels):
+        """Registra um valor (ex.: latência em segundos) em um histograma"""
+        key = self._key(name, labels)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(value)
+    
+    def snapshot(self):
+        """Todas as métricas em um dict serializável em JSON"""
+        def label(key):
+            name, labels = key
+            return name + ''.join(f"[{k}={v}]" for k, v in labels)
+        
+        for collect in self.collectors:
+            collect(self)
+        with self._lock:
+            return {
+                'uptime_seconds': time.time() - self.started,
+                'counters': {label(key): value for key, value in sorted(self._counters.items())},
+                'gauges': {label(key): value for key, value in sorted(self._gauges.items())},
+                'histograms': {label(key): histogram.snapshot()
+                               for key, histogram in sorted(self._histograms.items())},
+            }
+    
+    def render_prometheus(self):
+        """Todas as métricas no formato texto do Prometheus"""
+        def series(name, labels, extra=()):
+            pairs = ','.join(f'{k}="{v}"' for k, v in list(labels) + list(extra))
+            return f"{self.prefix}_{name}{{{pairs}}}" if pairs else f"{self.prefix}_{name}"
+        
+        lines = []
+        described = set()
+        
+        def header(name, kind):
+            if name not in described:
+                described.add(name)
+                if name in self._help:
+                    lines.append(f"# HELP {self.prefix}_{name} {self._help[name]}")
+                lines.append(f"# TYPE {self.prefix}_{name} {kind}")
+        
+        for collect in self.collectors:
+            collect(self)
+        with self._lock:
+            header('uptime_seconds', 'gauge')
+            lines.append(f"{self.prefix}_uptime_seconds {time.time() - self.started:.3f}")
+            for (name, labels), value in sorted(self._counters.items()):
+                header(name, 'counter')
+                lines.append(f"{series(name, labels)} {value}")
+            for (name, labels), value in sorted(self._gauges.items()):
+                header(name, 'gauge')
+                lines.append(f"{series(name, labels)} {value}")
+            for (name, labels), histogram in sorted(self._histograms.items()):
+                header(name, 'histogram')
+                seen = 0
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    seen += count
+                    lines.append(f"{series(name + '_bucket', labels, [('le', bound)])} {seen}")
+                lines.append(f"{series(name + '_bucket', labels, [('le', '+Inf')])} {histogram.count}")
+                lines.append(f"{series(name + '_sum', labels)} {histogram.sum}")
+                lines.append(f"{series(name + '_count', labels)} {histogram.count}")
+        return '\n'.join(lines) + '\n'
+
+
+def start_http_server(metrics, host='localhost', port=9100):
+    """
+    Serve metrics.render_prometheus() em http://host:port/metrics em um
+    thread próprio. Retorna o servidor HTTP (shutdown() para encerrar).
+    """
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] not in ('/', '/metrics'):
+                self.send_error(404)
+                return
+            body = metrics.render_prometheus().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        
+        def log_message(self, format, *args):
+            # Coletas periódicas não poluem o log do servidor
+            pass
+    
+    http_server = ThreadingHTTPServer((host, port), MetricsHandler)
+    http_server.daemon_threads = True
+    threading.Thread(target=http_server.serve_forever, daemon=True).start()
+    return http_server
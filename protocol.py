@@ -0,0 +1,711 @@
+"""
+Protocolo binário de mensagens entre cliente e servidor.
+
+Cada mensagem é formada por:
+  - cabeçalho fixo: magic (4 bytes), versão (1), flags (1), reservado (2)
+    e tamanho dos metadados (4), em big-endian
+  - metadados JSON: operação, parâmetros e a descrição de cada array
+    (dtype, shape e order)
+  - os buffers crus dos arrays, na ordem descrita nos metadados
+
+Os arrays são enviados direto da memória do NumPy (memoryview + sendmsg) e
+recebidos com recv_into em arrays pré-alocados, sem cópias intermediárias.
+Nenhum pickle é usado, então quem recebe nunca executa dados do outro lado.
+
+Opcionalmente (por conexão) os buffers são comprimidos com zlib ou lzma; nesse
+caso os metadados trazem 'compression' e o tamanho comprimido de cada array.
+
+Matrizes esparsas (CSR/CSC do SciPy, opcional) viajam como três arrays
+(indptr, indices, data), descritas em 'operands' nos metadados. O SciPy só
+é importado quando chega uma matriz esparsa (a importação é lenta).
+
+Entre processos da mesma máquina (socket Unix), arrays grandes não passam
+pelo socket: vão no segmento de memória compartilhada de quem envia
+('shm' e 'shm_seq' nos metadados, 'shm_offset' em cada array), reutilizado
+entre as mensagens da conexão, e quem recebe os lê sem cópia (ver
+SharedMemoryChannel).
+"""
+import hashlib
+import json
+import lzma
+import re
+import socket
+import struct
+import sys
+import threading
+import time
+import weakref
+import zlib
+from collections import deque
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+import numpy as np
+
+MAGIC = b'MXMP'
+VERSION = 1
+HEADER = struct.Struct('!4sBBHI')
+
+# Limites de sanidade para mensagens recebidas
+MAX_META_BYTES = 1024 * 1024
+MAX_ARRAY_BYTES = 16 * 1024 ** 3
+
+# Tipos aceitos: bool, inteiros, inteiros sem sinal, float e complexo
+ALLOWED_KINDS = 'biufc'
+
+# Número máximo de buffers por chamada a sendmsg
+MAX_IOV = 64
+
+# Arrays a partir deste tamanho vão por memória compartilhada em conexões locais
+SHM_MIN_BYTES = 64 * 1024
+
+# Cabeçalho do segmento de cada lado (última mensagem liberada por quem recebe)
+# e alinhamento dos arrays dentro dele
+SHM_HEADER_BYTES = 64
+SHM_RELEASED = struct.Struct('q')
+
+# Contadores de cada conexão (tempos em ns, tamanhos em bytes no fio)
+STAT_KEYS = ('serialize_ns', 'send_ns', 'receive_ns', 'bytes_sent', 'bytes_received',
+             'compute_ns', 'server_compute_ns', 'server_serialize_ns')
+
+
+# Compressores disponíveis: nome -> (comprimir, criar descompressor)
+CODECS = {
+    'zlib': (lambda data: zlib.compress(data, 1), zlib.decompressobj),
+    'lzma': (lambda data: lzma.compress(data, preset=0), lzma.LZMADecompressor),
+}
+
+# Inteiros do mais estreito para o mais largo, usados na redução de dtype
+_INT_DTYPES = [np.dtype(t) for t in (np.int8, np.uint8, np.int16, np.uint16,
+                                     np.int32, np.uint32, np.int64)]
+
+
+class ProtocolError(Exception):
+    """Mensagem malformada ou resposta de erro do outro lado"""
+
+
+def _byte_view(array):
+    """Visão em bytes (sem cópia) de um array contíguo em C ou Fortran"""
+    return memoryview(array.ravel(order='A')).cast('B')
+
+
+def _wire_array(array):
+    """Garante um array contíguo; só copia se a entrada não for contígua"""
+    array = np.asarray(array)
+    if array.dtype.kind not in ALLOWED_KINDS:
+        raise ProtocolError(f"Tipo não suportado no protocolo: {array.dtype}")
+    if array.flags.c_contiguous or array.flags.f_contiguous:
+        return array
+    return np.ascontiguousarray(array)
+
+
+def array_spec(array):
+    """Descrição de um array nos metadados"""
+    order = 'F' if array.flags.f_contiguous and not array.flags.c_contiguous else 'C'
+    return {'dtype': array.dtype.str, 'shape': list(array.shape), 'order': order}
+
+
+def _checked_spec(spec):
+    """Valida a descrição recebida e retorna (dtype, shape, order)"""
+    try:
+        dtype = np.dtype(spec['dtype'])
+        shape = tuple(int(n) for n in spec['shape'])
+        order = spec.get('order', 'C')
+    except (KeyError, TypeError, ValueError) as e:
+        raise ProtocolError(f"Descrição de array inválida: {spec}") from e
+    if dtype.kind not in ALLOWED_KINDS or order not in ('C', 'F') or any(n < 0 for n in shape):
+        raise ProtocolError(f"Descrição de array inválida: {spec}")
+    if int(np.prod(shape, dtype=np.int64)) * dtype.itemsize > MAX_ARRAY_BYTES:
+        raise ProtocolError(f"Array grande demais: {shape} {dtype}")
+    return dtype, shape, order
+
+
+def _untracked_segment(name=None, size=0):
+    """
+    Abre (name) ou cria um segmento de memória compartilhada sem deixá-lo
+    com o resource_tracker deste processo, que o apagaria quando o processo
+    terminasse: o segmento é de quem o criou.
+    """
+    if sys.version_info >= (3, 13):
+        return SharedMemory(name=name, create=name is None, size=size, track=False)
+    shm = SharedMemory(name=name, create=name is None, size=size)
+    resource_tracker.unregister(shm._name, 'shared_memory')
+    return shm
+
+
+def attach_shared_memory(name):
+    """Abre um segmento de memória compartilhada criado por outro processo"""
+    return _untracked_segment(name)
+
+
+def _close_segment(shm):
+    """Fecha um segmento; False se ainda há visões dos seus dados em uso"""
+    try:
+        shm.close()
+        return True
+    except BufferError:
+        return False
+
+
+class SharedMemoryChannel:
+    """
+    Memória compartilhada de uma conexão local (socket Unix).
+    Cada lado tem um segmento próprio, usado como anel pelas mensagens que
+    envia e recriado maior quando um array não cabe nele. Quem recebe lê os
+    arrays sem cópia (visões do segmento do outro lado) e, quando não resta
+    visão de uma mensagem, escreve no cabeçalho do segmento o número da
+    última mensagem liberada, devolvendo a área a quem envia. Sem espaço
+    livre no anel, os arrays passam pelo socket.
+    Os nomes dos segmentos usam o prefixo da conexão (definido pelo servidor
+    na operação 'hello'); segmentos com outro prefixo não são abertos.
+    """
+    def __init__(self):
+        self.prefix = None
+        self.side = None
+        self._peer_name = None
+        self._own = None
+        self._generation = 0
+        self._sent = 0
+        # Mensagens enviadas ainda não liberadas: (número, início, fim)
+        self._spans = deque()
+        self._peer = None
+        self._retired = []
+        self._received = 0
+        self._released = 0
+        self._finished = set()
+        self._lock = threading.Lock()
+    
+    def bind(self, prefix, side):
+        """Ativa o canal: prefixo da conexão e lado ('c' cliente, 's' servidor)"""
+        if not re.fullmatch(r'[0-9a-z]{4,24}', str(prefix)) or side not in ('c', 's'):
+            raise ProtocolError(f"Prefixo de memória compartilhada inválido: {prefix}")
+        self.prefix = prefix
+        self.side = side
+        self._peer_name = re.compile(re.escape(prefix + ('s' if side == 'c' else 'c')) + r'\d{1,9}')
+    
+    def place(self, buffers):
+        """
+        Copia os buffers para o segmento próprio.
+        Retorna (nome, número da mensagem, deslocamentos) ou None se não há
+        espaço livre (os buffers devem então ir pelo socket).
+        """
+        if self.prefix is None:
+            return None
+        slots = [-(-len(buffer) // SHM_HEADER_BYTES) * SHM_HEADER_BYTES for buffer in buffers]
+        with self._lock:
+            start = self._allocate(sum(slots))
+            if start is None:
+                return None
+            self._sent += 1
+            self._spans.append((self._sent, start, start + sum(slots)))
+            shm, seq = self._own, self._sent
+        
+        offsets, position = [], start
+        for buffer, slot in zip(buffers, slots):
+            shm.buf[position:position + len(buffer)] = buffer
+            offsets.append(position)
+            position += slot
+        return shm.name, seq, offsets
+    
+    def _allocate(self, size):
+        """Início de uma área livre de size bytes no anel, ou None"""
+        if self._own is not None:
+            released, = SHM_RELEASED.unpack_from(self._own.buf, 0)
+            while self._spans and self._spans[0][0] <= released:
+                self._spans.popleft()
+        if not self._spans:
+            if self._own is None or SHM_HEADER_BYTES + size > self._own.size:
+                self._replace(size)
+            return SHM_HEADER_BYTES
+        
+        oldest, newest = self._spans[0][1], self._spans[-1][2]
+        if newest > oldest:
+            # Área ocupada contínua: cabe depois dela ou no começo do anel
+            if newest + size <= self._own.size:
+                return newest
+            if SHM_HEADER_BYTES + size <= oldest:
+                return SHM_HEADER_BYTES
+            return None
+        return newest if newest + size <= oldest else None
+    
+    def _replace(self, size):
+        """Troca o segmento próprio por um maior (sem mensagens pendentes nele)"""
+        if self._own is not None:
+            self._own.close()
+            self._own.unlink()
+        self._generation += 1
+        # Espaço para duas mensagens deste tamanho, para que a próxima não
+        # precise esperar a liberação desta
+        self._own = SharedMemory(name=f"{self.prefix}{self.side}{self._generation}", create=True,
+                                 size=SHM_HEADER_BYTES + 2 * size)
+        SHM_RELEASED.pack_into(self._own.buf, 0, self._sent)
+    
+    def open(self, name, seq):
+        """Segmento do outro lado onde está a mensagem seq (aberto uma vez por nome)"""
+        if self.prefix is None or not isinstance(name, str) or not self._peer_name.fullmatch(name):
+            raise ProtocolError(f"Segmento compartilhado não pertence a esta conexão: {name}")
+        if seq != self._received + 1:
+            raise ProtocolError(f"Mensagem compartilhada fora de ordem: {seq}")
+        with self._lock:
+            if self._peer is None or self._peer.name != name:
+                try:
+                    segment = _untracked_segment(name)
+                except (FileNotFoundError, ValueError) as e:
+                    raise ProtocolError(f"Segmento compartilhado indisponível: {name}") from e
+                if self._peer is not None:
+                    self._retired.append(self._peer)
+                self._peer = segment
+            self._retired = [shm for shm in self._retired if not _close_segment(shm)]
+            self._received = seq
+            return self._peer
+    
+    def release(self, seq):
+        """Libera a área da mensagem seq recebida (chamado quando não há mais visões dela)"""
+        with self._lock:
+            self._finished.add(seq)
+            while self._released + 1 in self._finished:
+                self._released += 1
+                self._finished.discard(self._released)
+            if self._peer is not None and self._peer.buf is not None:
+                SHM_RELEASED.pack_into(self._peer.buf, 0, self._released)
+    
+    def close(self):
+        """Apaga o segmento próprio e fecha os do outro lado"""
+        with self._lock:
+            if self._own is not None:
+                self._own.close()
+                self._own.unlink()
+                self._own = None
+            for shm in [self._peer] + self._retired:
+                if shm is not None:
+                    _close_segment(shm)
+            self._peer, self._retired = None, []
+
+
+class _SharedMessage:
+    """
+    Arrays de uma mensagem recebida no segmento do outro lado. A área da
+    mensagem é liberada quando não resta nenhuma visão desses arrays.
+    """
+    def __init__(self, channel, segment, seq):
+        self.channel = channel
+        self.segment = segment
+        self.seq = seq
+        self._raw = None
+    
+    def view(self, offset, dtype, shape, order):
+        """Visão (sem cópia) de um array da mensagem"""
+        size = int(np.prod(shape, dtype=np.int64)) * dtype.itemsize
+        if offset < SHM_HEADER_BYTES or offset + size > self.segment.size:
+            raise ProtocolError("Array fora do segmento compartilhado")
+        if self._raw is None:
+            # As visões têm este array como base: o finalize roda quando a última some
+            self._raw = np.frombuffer(self.segment.buf, dtype=np.uint8)
+            weakref.finalize(self._raw, self.channel.release, self.seq)
+        return self._raw[offset:offset + size].view(dtype).reshape(shape, order=order)
+    
+    def done(self):
+        """Fim da recepção: sem visões em uso, a área é liberada agora"""
+        raw, self._raw = self._raw, None
+        if raw is None:
+            self.channel.release(self.seq)
+
+
+def send_buffers(sock, buffers):
+    """
+    Envia uma sequência de buffers com sendmsg (scatter-gather), tratando
+    envios parciais. Em plataformas sem sendmsg usa sendall em cada buffer.
+    """
+    views = [memoryview(b).cast('B') for b in buffers]
+    views = [v for v in views if len(v)]
+
+    if not hasattr(sock, 'sendmsg'):
+        for view in views:
+            sock.sendall(view)
+        return
+
+    while views:
+        sent = sock.sendmsg(views[:MAX_IOV])
+        while sent:
+            if sent >= len(views[0]):
+                sent -= len(views[0])
+                views.pop(0)
+            else:
+                views[0] = views[0][sent:]
+                sent = 0
+
+
+def recv_exact_into(sock, view):
+    """Preenche view inteira com dados do socket"""
+    view = memoryview(view).cast('B')
+    while len(view):
+        received = sock.recv_into(view)
+        if received == 0:
+            raise ConnectionError("Conexão encerrada no meio de uma mensagem")
+        view = view[received:]
+
+
+def narrowest_int_dtype(low, high):
+    """Menor tipo inteiro que representa o intervalo [low, high]"""
+    for dtype in _INT_DTYPES:
+        info = np.iinfo(dtype)
+        if info.min <= low and high <= info.max:
+            return dtype
+    return np.dtype(np.uint64) if low >= 0 else np.dtype(np.int64)
+
+
+def is_sparse(matrix):
+    """True se matrix é uma matriz esparsa do SciPy"""
+    # Sem o scipy.sparse importado não pode existir uma matriz esparsa
+    sparse = sys.modules.get('scipy.sparse')
+    return sparse is not None and sparse.issparse(matrix)
+
+
+def wire_dtype(array):
+    """
+    Tipo em que narrow_array enviaria o array (sem convertê-lo): o inteiro
+    mais estreito que comporta seus valores, ou o próprio tipo do array
+    """
+    if is_sparse(array):
+        return wire_dtype(array.data)
+    array = np.asarray(array)
+    if array.dtype.kind not in 'iu' or array.size == 0:
+        return array.dtype
+    dtype = narrowest_int_dtype(int(array.min()), int(array.max()))
+    return dtype if dtype.itemsize < array.itemsize else array.dtype
+
+
+def narrow_array(array):
+    """
+    Converte um array inteiro para o tipo mais estreito que comporta seus
+    valores (ex.: int64 em [-10, 10) vira int8). Outros tipos não mudam.
+    Em matrizes esparsas, só os valores (data) são reduzidos.
+    """
+    if is_sparse(array):
+        data = narrow_array(array.data)
+        if data is array.data:
+            return array
+        return type(array)((data, array.indices, array.indptr), shape=array.shape)
+    array = np.asarray(array)
+    dtype = wire_dtype(array)
+    return array if dtype == array.dtype else array.astype(dtype)
+
+
+def send_message(sock, meta, arrays=(), compression=None, stats=None, shared_memory=None):
+    """
+    Envia uma mensagem: metadados (dict serializável em JSON) e arrays NumPy.
+    compression: None, 'zlib' ou 'lzma'
+    stats: dict opcional (STAT_KEYS) onde são somados os tempos de
+           serialização e envio e os bytes enviados
+    shared_memory: SharedMemoryChannel da conexão (só em conexões entre
+                   processos da mesma máquina); arrays grandes vão por ele
+    """
+    started = time.perf_counter_ns()
+    arrays = [_wire_array(array) for array in arrays]
+    specs = [array_spec(array) for array in arrays]
+    buffers = [_byte_view(array) for array in arrays]
+    shared_bytes = 0
+    
+    large = [i for i, buffer in enumerate(buffers) if len(buffer) >= SHM_MIN_BYTES]
+    placed = shared_memory.place([buffers[i] for i in large]) if shared_memory and large else None
+    if placed is not None:
+        segment, seq, offsets = placed
+        for i, offset in zip(large, offsets):
+            specs[i]['shm_offset'] = offset
+            shared_bytes += len(buffers[i])
+            buffers[i] = b''
+        meta = dict(meta, shm=segment, shm_seq=seq)
+        compression = None
+    
+    if compression:
+        if compression not in CODECS:
+            raise ProtocolError(f"Compressão desconhecida: {compression}")
+        compress = CODECS[compression][0]
+        buffers = [compress(buffer) for buffer in buffers]
+        for spec, buffer in zip(specs, buffers):
+            spec['wire_bytes'] = len(buffer)
+        meta = dict(meta, compression=compression)
+    
+    meta = dict(meta, arrays=specs)
+    meta_bytes = json.dumps(meta, separators=(',', ':')).encode('utf-8')
+    header = HEADER.pack(MAGIC, VERSION, 0, 0, len(meta_bytes))
+    serialized = time.perf_counter_ns()
+    send_buffers(sock, [header, meta_bytes] + buffers)
+    
+    if stats is not None:
+        stats['serialize_ns'] += serialized - started
+        stats['send_ns'] += time.perf_counter_ns() - serialized
+        stats['bytes_sent'] += (len(header) + len(meta_bytes) + sum(len(b) for b in buffers)
+                                + shared_bytes)
+
+
+def _recv_compressed_into(sock, array, wire_bytes, compression):
+    """Recebe um buffer comprimido e o descomprime dentro de array"""
+    if compression not in CODECS:
+        raise ProtocolError(f"Compressão desconhecida: {compression}")
+    if not 0 <= wire_bytes <= MAX_ARRAY_BYTES:
+        raise ProtocolError(f"Tamanho comprimido inválido: {wire_bytes}")
+    data = bytearray(wire_bytes)
+    recv_exact_into(sock, data)
+    
+    # max_length evita que um buffer malicioso se expanda além do array
+    target = _byte_view(array)
+    decompressed = CODECS[compression][1]().decompress(bytes(data), len(target) + 1)
+    if len(decompressed) != len(target):
+        raise ProtocolError("Tamanho descomprimido não confere com o array")
+    target[:] = decompressed
+
+
+def recv_message(sock, into=None, stats=None, shared_memory=None):
+    """
+    Recebe uma mensagem.
+    into: função opcional into(meta, índice, dtype, shape) que retorna o array
+          de destino de cada buffer (ou None). Se o destino for contíguo e do
+          mesmo tipo, os dados são recebidos direto nele; senão são recebidos
+          em um array temporário e copiados (convertendo o tipo).
+    stats: dict opcional (STAT_KEYS) onde são somados o tempo de recepção
+           (do primeiro byte ao fim da mensagem) e os bytes recebidos
+    shared_memory: SharedMemoryChannel da conexão, que aceita arrays em
+                   memória compartilhada (só em conexões locais; um par remoto
+                   não pode abrir segmentos desta máquina). Arrays sem destino
+                   são visões do segmento do outro lado: quem precisar guardá-los
+                   além da requisição deve copiá-los (detach_array).
+    Retorna (meta, arrays), ou None se a conexão foi encerrada entre mensagens.
+    """
+    header = bytearray(HEADER.size)
+    view = memoryview(header)
+    received = sock.recv_into(view)
+    if received == 0:
+        return None
+    started = time.perf_counter_ns()
+    recv_exact_into(sock, view[received:])
+
+    magic, version, flags, _, meta_size = HEADER.unpack(header)
+    if magic != MAGIC:
+        raise ProtocolError("Mensagem não pertence ao protocolo")
+    if version != VERSION:
+        raise ProtocolError(f"Versão de protocolo não suportada: {version}")
+    if meta_size > MAX_META_BYTES:
+        raise ProtocolError(f"Metadados grandes demais: {meta_size} bytes")
+
+    meta_bytes = bytearray(meta_size)
+    recv_exact_into(sock, meta_bytes)
+    try:
+        meta = json.loads(meta_bytes.decode('utf-8'))
+    except ValueError as e:
+        raise ProtocolError("Metadados inválidos") from e
+
+    arrays = []
+    wire_bytes = HEADER.size + meta_size
+    compression = meta.get('compression')
+    shared = None
+    if meta.get('shm') is not None:
+        if shared_memory is None:
+            raise ProtocolError("Memória compartilhada só é aceita em conexões locais")
+        seq = meta.get('shm_seq')
+        shared = _SharedMessage(shared_memory, shared_memory.open(meta['shm'], seq), seq)
+    try:
+        for index, spec in enumerate(meta.get('arrays', [])):
+            arrays.append(_recv_array(sock, meta, index, spec, into, compression, shared))
+            # Bytes no tipo em que o array veio, não no do destino (que pode ser mais largo)
+            if compression:
+                wire_bytes += int(spec.get('wire_bytes', 0))
+            else:
+                dtype, shape, _ = _checked_spec(spec)
+                wire_bytes += int(np.prod(shape, dtype=np.int64)) * dtype.itemsize
+    finally:
+        if shared is not None:
+            shared.done()
+
+    if stats is not None:
+        stats['receive_ns'] += time.perf_counter_ns() - started
+        stats['bytes_received'] += wire_bytes
+    return meta, arrays
+
+
+def _recv_array(sock, meta, index, spec, into, compression, shared):
+    """Recebe um array da mensagem (do socket ou do segmento compartilhado)"""
+    dtype, shape, order = _checked_spec(spec)
+    target = into(meta, index, dtype, shape) if into else None
+    if target is not None and target.shape != shape:
+        raise ProtocolError(f"Array recebido {shape} não cabe no destino {target.shape}")
+    if 'shm_offset' in spec:
+        if shared is None:
+            raise ProtocolError("Array em memória compartilhada sem segmento")
+        array = shared.view(int(spec['shm_offset']), dtype, shape, order)
+        if target is None:
+            return array
+        np.copyto(target, array)
+        return target
+    
+    contiguous = target is not None and (target.flags.c_contiguous if order == 'C'
+                                         else target.flags.f_contiguous)
+    direct = contiguous and target.dtype == dtype
+    array = target if direct else np.empty(shape, dtype=dtype, order=order)
+    if compression:
+        _recv_compressed_into(sock, array, int(spec.get('wire_bytes', -1)), compression)
+    else:
+        recv_exact_into(sock, _byte_view(array))
+    if target is not None and not direct:
+        np.copyto(target, array)
+        array = target
+    return array
+
+
+def detach_array(array):
+    """
+    Array próprio a partir de um array recebido: visões da memória
+    compartilhada da conexão são copiadas (para guardá-las além da
+    requisição, ex.: no cache); arrays recebidos pelo socket já são donos
+    da própria memória e voltam sem cópia.
+    """
+    return array.copy() if array.base is not None else array
+
+
+def pack_operands(operands):
+    """
+    Prepara operandos densos ou esparsos para envio.
+    Retorna (descrições, arrays): cada descrição tem 'format' ('dense', 'csr'
+    ou 'csc') e, nas esparsas, 'shape'; as esparsas ocupam três arrays
+    (indptr, indices, data) e as densas um.
+    """
+    specs, arrays = [], []
+    for operand in operands:
+        if is_sparse(operand):
+            if operand.format not in ('csr', 'csc'):
+                operand = operand.tocsr()
+            specs.append({'format': operand.format, 'shape': list(operand.shape)})
+            arrays += [operand.indptr, operand.indices, operand.data]
+        else:
+            specs.append({'format': 'dense'})
+            arrays.append(operand)
+    return specs, arrays
+
+
+def unpack_operands(specs, arrays):
+    """Reconstrói os operandos descritos por pack_operands, validando a estrutura"""
+    if not isinstance(specs, list):
+        raise ProtocolError("Descrição de operandos ausente")
+    operands, position = [], 0
+    for spec in specs:
+        kind = spec.get('format') if isinstance(spec, dict) else None
+        if kind == 'dense':
+            operands.append(arrays[position] if position < len(arrays) else None)
+            position += 1
+            continue
+        if kind not in ('csr', 'csc'):
+            raise ProtocolError(f"Formato de operando desconhecido: {kind}")
+        try:
+            from scipy import sparse
+        except ImportError:
+            raise ValueError("Matrizes esparsas exigem o SciPy instalado")
+        if position + 3 > len(arrays):
+            raise ProtocolError("Operando esparso incompleto")
+        indptr, indices, data = arrays[position:position + 3]
+        position += 3
+        try:
+            shape = tuple(int(n) for n in spec['shape'])
+            matrix = getattr(sparse, f"{kind}_matrix")((data, indices, indptr), shape=shape)
+            # Confere índices e ponteiros: quem envia não é confiável
+            matrix.check_format(full_check=True)
+        except (KeyError, TypeError, ValueError) as e:
+            raise ProtocolError(f"Operando esparso inválido: {e}") from e
+        operands.append(matrix)
+    if position != len(arrays) or any(operand is None for operand in operands):
+        raise ProtocolError("Número de arrays não confere com os operandos")
+    return operands
+
+
+class Connection:
+    """
+    Canal de mensagens sobre um socket, com contadores de tempo e bytes
+    (stats). Tempos do servidor informados nas respostas ('timings') são
+    somados em server_compute_ns e server_serialize_ns.
+    compression: compressão usada nas mensagens enviadas; com mirror=True
+    (lado do servidor) passa a usar a mesma compressão da última mensagem
+    recebida, de modo que o cliente escolhe a compressão da conexão.
+    shared_memory: conexão local (socket Unix); arrays grandes vão por
+    memória compartilhada (SharedMemoryChannel, ativado com o prefixo
+    combinado na operação 'hello') em vez de passar pelo socket.
+    """
+    def __init__(self, sock, compression=None, mirror=False, shared_memory=False):
+        self.sock = sock
+        self.compression = compression
+        self.mirror = mirror
+        self.shared_memory = SharedMemoryChannel() if shared_memory else None
+        self.stats = dict.fromkeys(STAT_KEYS, 0)
+    
+    def fileno(self):
+        return self.sock.fileno()
+    
+    def settimeout(self, timeout):
+        self.sock.settimeout(timeout)
+    
+    def close(self):
+        self.sock.close()
+        if self.shared_memory is not None:
+            self.shared_memory.close()
+    
+    def abort(self):
+        """Interrompe (a partir de outro thread) envios e recebimentos em andamento"""
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+    
+    def send(self, meta, arrays=()):
+        send_message(self.sock, meta, arrays, self.compression, self.stats, self.shared_memory)
+    
+    def recv(self, into=None):
+        """Recebe (meta, arrays), ou None se o outro lado encerrou a conexão"""
+        message = recv_message(self.sock, into, self.stats, self.shared_memory)
+        if message is None:
+            return None
+        if self.mirror:
+            self.compression = message[0].get('compression')
+        timings = message[0].get('timings')
+        if isinstance(timings, dict):
+            self.stats['server_compute_ns'] += int(timings.get('compute_ns', 0))
+            self.stats['server_serialize_ns'] += int(timings.get('serialize_ns', 0))
+        return message
+    
+    def send_error(self, error):
+        """Envia uma resposta de erro"""
+        self.send({'status': 'error', 'error': str(error)})
+    
+    def exchange(self, meta, arrays=()):
+        """Envia uma requisição e aguarda a resposta; retorna (meta, arrays)"""
+        self.send(meta, arrays)
+        message = self.recv()
+        if message is None:
+            raise ConnectionError("Servidor encerrou a conexão sem responder")
+        return message
+
+
+def local_host_id():
+    """
+    Identificador desta máquina (boot_id do Linux ou, na falta, o nome do
+    host), usado para descobrir se cliente e servidor estão no mesmo host
+    """
+    try:
+        with open('/proc/sys/kernel/random/boot_id') as f:
+            return f.read().strip()
+    except OSError:
+        return socket.gethostname()
+
+
+def array_digest(array):
+    """
+    Hash do conteúdo de um array (dtype, shape, ordem e bytes), usado para
+    endereçar matrizes no cache do servidor.
+    """
+    array = _wire_array(array)
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(json.dumps(array_spec(array)).encode('utf-8'))
+    digest.update(_byte_view(array))
+    return digest.hexdigest()
+
+
+def check_reply(meta):
+    """Lança ProtocolError se a resposta indicar erro"""
+    if meta.get('status') != 'ok':
+        raise ProtocolError(meta.get('error', 'Resposta inválida do servidor'))
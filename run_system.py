@@ -1,37 +1,333 @@
+"""
+Inicialização automatizada do sistema: servidores, cliente e supervisão.
+
+Cada servidor recebe um conjunto próprio de núcleos (afinidade de CPU,
+dentro de um mesmo nó NUMA quando possível) e, com ele, o orçamento de
+trabalhadores e de threads do BLAS (MATRIX_SERVER_CORES). A lista dos
+servidores iniciados é gravada em um arquivo JSON lido pelo cliente
+(MATRIX_SERVERS_FILE, ver client.load_servers). Servidores que terminarem
+inesperadamente são reiniciados com a mesma porta e os mesmos núcleos.
+
+Exemplos:
+    python run_system.py --servers 4 --cores-per-server 2
+    python run_system.py --config cluster.json --no-client
+
+O arquivo de configuração é um JSON com as mesmas chaves das opções
+(ex.: {"servers": 4, "base_port": 6000, "cores_per_server": 2});
+opções da linha de comando têm prioridade sobre ele.
+"""
+import argparse
+import json
 import subprocess
 import sys
 import time
 import os
+import shutil
 import signal
+import socket
+import threading
+import queue
 
-def iniciar_servidores(num_servers=2):
-    """Inicia múltiplos servidores em processos separados"""
-    processos = []
+# Linha impressa pelo servidor quando já aceita conexões (server.READY_LINE)
+READY_LINE = "[SERVIDOR] PRONTO"
+
+# Prazo (s) para um servidor ficar pronto
+STARTUP_TIMEOUT = 30.0
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+DEFAULTS = {
+    'servers': 2,
+    'host': 'localhost',
+    'base_port': 5000,
+    'cores_per_server': None,
+    'workers': None,
+    'engine': 'auto',
+    'metrics_base_port': None,
+    'servers_file': 'servers.json',
+    'client': True,
+    'max_restarts': 5,
+    'show_output': False,
+}
+
+
+def ler_topologia():
+    """
+    Núcleos disponíveis para este processo e o nó NUMA de cada um
+    (lidos de /sys; sem essa informação, todos ficam no nó 0).
+    Retorna a lista [(nó, núcleo), ...] ordenada por nó e núcleo.
+    """
+    if hasattr(os, 'sched_getaffinity'):
+        disponiveis = sorted(os.sched_getaffinity(0))
+    else:
+        disponiveis = list(range(os.cpu_count() or 1))
     
-    print(f"\n[SETUP] Iniciando {num_servers} servidores...")
+    no_do_nucleo = {}
+    base = '/sys/devices/system/node'
+    try:
+        nos = sorted(int(nome[4:]) for nome in os.listdir(base)
+                     if nome.startswith('node') and nome[4:].isdigit())
+    except OSError:
+        nos = []
+    for no in nos:
+        try:
+            with open(f'{base}/node{no}/cpulist') as f:
+                for nucleo in _ler_lista_cpus(f.read()):
+                    no_do_nucleo[nucleo] = no
+        except (OSError, ValueError):
+            continue
+    return sorted((no_do_nucleo.get(nucleo, 0), nucleo) for nucleo in disponiveis)
+
+
+def _ler_lista_cpus(texto):
+    """Converte uma lista de CPUs do Linux ('0-3,8,10-11') em números"""
+    nucleos = []
+    for parte in texto.strip().split(','):
+        if not parte:
+            continue
+        inicio, _, fim = parte.partition('-')
+        nucleos.extend(range(int(inicio), int(fim or inicio) + 1))
+    return nucleos
+
+
+def distribuir_nucleos(num_servers, cores_per_server=None, topologia=None):
+    """
+    Divide os núcleos entre os servidores em conjuntos disjuntos e contíguos
+    (percorridos por nó NUMA, para que cada conjunto fique em um só nó
+    sempre que o tamanho permitir). Sem núcleos suficientes, os conjuntos
+    passam a se repetir e um aviso é impresso.
+    Retorna [{'cores': [...], 'numa_node': nó ou None}, ...].
+    """
+    topologia = topologia or ler_topologia()
+    por_servidor = cores_per_server or max(1, len(topologia) // num_servers)
+    if num_servers * por_servidor > len(topologia):
+        print(f"[AVISO] {num_servers} servidores x {por_servidor} núcleo(s) excedem os "
+              f"{len(topologia)} núcleo(s) disponíveis: alguns núcleos serão compartilhados")
     
+    grupos = []
     for i in range(num_servers):
-        port = 5000 + i
-        print(f"  → Servidor {i+1} na porta {port}")
+        inicio = (i * por_servidor) % len(topologia)
+        escolhidos = [topologia[(inicio + k) % len(topologia)] for k in range(por_servidor)]
+        nos = {no for no, _ in escolhidos}
+        grupos.append({
+            'cores': sorted({nucleo for _, nucleo in escolhidos}),
+            'numa_node': nos.pop() if len(nos) == 1 else None,
+        })
+    return grupos
+
+
+def _numa_multiplos():
+    """True se a máquina tem mais de um nó NUMA"""
+    return len({no for no, _ in ler_topologia()}) > 1
+
+
+def iniciar_servidor(port, cores=None, workers=None, engine='auto', metrics_port=None,
+                     numa_node=None, host=None):
+    """
+    Inicia um servidor em um processo separado (sem esperar que fique pronto).
+    cores: núcleos aos quais o servidor fica restrito; também definem seu
+           orçamento de threads do BLAS e de trabalhadores
+    workers: trabalhadores dos pools (padrão: um por núcleo do orçamento)
+    numa_node: nó NUMA cuja memória o servidor deve usar (com o numactl)
+    host: endereço em que o servidor escuta (padrão do servidor: localhost)
+    """
+    comando = [sys.executable, '-u', os.path.join(BASE_DIR, 'server.py'), str(port), engine]
+    if metrics_port:
+        comando.append(str(metrics_port))
+    env = dict(os.environ)
+    if cores:
+        env['MATRIX_SERVER_CORES'] = str(len(cores))
+    if workers:
+        env['MATRIX_SERVER_WORKERS'] = str(workers)
+    if host:
+        env['MATRIX_SERVER_HOST'] = host
+    
+    if sys.platform == 'win32':
+        return subprocess.Popen(comando, env=env, creationflags=subprocess.CREATE_NEW_CONSOLE)
+    
+    if numa_node is not None and shutil.which('numactl') and _numa_multiplos():
+        comando = ['numactl', f'--membind={numa_node}'] + comando
+    processo = subprocess.Popen(comando, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                text=True, env=env)
+    if cores and hasattr(os, 'sched_setaffinity'):
+        # Aplicada logo após o exec, enquanto o interpretador ainda inicia: o
+        # BLAS e o pool, criados depois, herdam a afinidade. (preexec_fn não
+        # é seguro aqui: o supervisor reinicia servidores a partir de um thread)
+        try:
+            os.sched_setaffinity(processo.pid, cores)
+        except OSError as e:
+            print(f"[AVISO] Não foi possível fixar a porta {port} nos núcleos {cores}: {e}")
+    return processo
+
+
+def _acompanhar_saida(processo, avisos, mostrar_saida):
+    """
+    Lê a saída do servidor até ele terminar: avisa True na linha de pronto e
+    False no fim da saída. Ler sempre evita que o pipe encha e trave o servidor.
+    """
+    for linha in processo.stdout:
+        if linha.startswith(READY_LINE):
+            avisos.put(True)
+        elif mostrar_saida:
+            print(linha, end='')
+    avisos.put(False)
+
+
+def _aguardar_porta(host, port, timeout):
+    """Tenta conectar à porta até o servidor aceitar (sem acesso à sua saída)"""
+    limite = time.monotonic() + timeout
+    while time.monotonic() < limite:
+        try:
+            socket.create_connection((host, port), timeout=1).close()
+            return True
+        except OSError:
+            time.sleep(0.01)
+    return False
+
+
+def aguardar_servidor(processo, port, timeout=STARTUP_TIMEOUT, mostrar_saida=False,
+                      host='localhost'):
+    """
+    Espera o servidor imprimir a linha de pronto (ou, sem acesso à sua saída,
+    aceitar conexões). Retorna False se ele terminar ou o prazo acabar.
+    mostrar_saida: repassa o log do servidor para a saída deste processo
+    """
+    if processo.stdout is None:
+        return _aguardar_porta(host, port, timeout)
+    avisos = queue.Queue()
+    threading.Thread(target=_acompanhar_saida, args=(processo, avisos, mostrar_saida),
+                     daemon=True).start()
+    try:
+        return avisos.get(timeout=timeout)
+    except queue.Empty:
+        return False
+
+
+class Cluster:
+    """
+    Servidores iniciados pelo run_system: posicionamento (porta, núcleos,
+    orçamentos), arquivo com a lista para o cliente e supervisão.
+    """
+    def __init__(self, config):
+        self.config = config
+        self.servidores = []
+        self._parar = threading.Event()
+        self._lock = threading.Lock()
+        self._supervisor = None
         
-        # Inicia servidor em processo separado
-        if sys.platform == 'win32':
-            processo = subprocess.Popen(
-                [sys.executable, 'Server.py', str(port)],
-                creationflags=subprocess.CREATE_NEW_CONSOLE
-            )
-        else:
-            processo = subprocess.Popen(
-                [sys.executable, 'Server.py', str(port)],
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE
-            )
+        grupos = distribuir_nucleos(config['servers'], config['cores_per_server'])
+        for i, grupo in enumerate(grupos):
+            metrics_base = config['metrics_base_port']
+            self.servidores.append({
+                'host': config['host'],
+                'port': config['base_port'] + i,
+                'cores': grupo['cores'],
+                'numa_node': grupo['numa_node'],
+                'workers': config['workers'] or len(grupo['cores']),
+                'metrics_port': metrics_base + i if metrics_base else None,
+                'restarts': 0,
+                'processo': None,
+            })
+    
+    def _iniciar(self, servidor):
+        servidor['processo'] = iniciar_servidor(
+            servidor['port'], servidor['cores'], servidor['workers'], self.config['engine'],
+            servidor['metrics_port'], servidor['numa_node'], servidor['host'])
+    
+    def _aguardar(self, servidor):
+        return aguardar_servidor(servidor['processo'], servidor['port'],
+                                 mostrar_saida=self.config['show_output'], host=servidor['host'])
+    
+    def iniciar(self):
+        """Inicia todos os servidores e espera que fiquem prontos"""
+        print(f"\n[SETUP] Iniciando {len(self.servidores)} servidores...")
+        inicio = time.perf_counter()
+        
+        for i, servidor in enumerate(self.servidores):
+            no = servidor['numa_node']
+            print(f"  → Servidor {i+1} na porta {servidor['port']}: núcleos {servidor['cores']}"
+                  f"{f' (nó NUMA {no})' if no is not None else ''}, "
+                  f"{servidor['workers']} trabalhador(es)")
+            # Inicia todos antes de esperar: as inicializações se sobrepõem
+            self._iniciar(servidor)
         
-        processos.append(processo)
-        time.sleep(0.5)
+        for i, servidor in enumerate(self.servidores):
+            if not self._aguardar(servidor):
+                raise RuntimeError(f"Servidor {i+1} (porta {servidor['port']}) não ficou pronto")
+        
+        print(f"[SETUP] {len(self.servidores)} servidores prontos em "
+              f"{(time.perf_counter() - inicio) * 1000:.0f} ms")
+        self.gravar_lista()
+    
+    def gravar_lista(self):
+        """Grava o arquivo com a lista de servidores usado pelo cliente"""
+        caminho = self.config['servers_file']
+        dados = {'servers': [{key: servidor[key] for key in
+                              ('host', 'port', 'cores', 'numa_node', 'workers', 'metrics_port')}
+                             for servidor in self.servidores]}
+        with open(caminho, 'w') as f:
+            json.dump(dados, f, indent=2)
+        print(f"[SETUP] Lista de servidores gravada em {caminho}")
+    
+    def supervisionar(self, intervalo=0.5):
+        """Reinicia, em um thread, servidores que terminarem inesperadamente"""
+        def vigiar():
+            while not self._parar.wait(intervalo):
+                for i, servidor in enumerate(self.servidores):
+                    # O reinício é feito sob o lock, para não competir com
+                    # encerrar(); a espera pelo servidor pronto, fora dele
+                    with self._lock:
+                        if self._parar.is_set():
+                            return
+                        codigo = servidor['processo'].poll()
+                        reiniciado = codigo is not None and self._reiniciar(i, servidor, codigo)
+                    if reiniciado:
+                        if self._aguardar(servidor):
+                            print(f"[SUPERVISOR] Servidor {i+1} pronto novamente")
+                        else:
+                            print(f"[SUPERVISOR] Servidor {i+1} não ficou pronto após o reinício")
+        
+        self._supervisor = threading.Thread(target=vigiar, daemon=True)
+        self._supervisor.start()
+    
+    def _reiniciar(self, i, servidor, codigo):
+        """Reinicia um servidor que terminou; retorna False se o limite foi atingido"""
+        if servidor['restarts'] >= self.config['max_restarts']:
+            if servidor['restarts'] == self.config['max_restarts']:
+                print(f"[SUPERVISOR] Servidor {i+1} (porta {servidor['port']}) terminou "
+                      f"(código {codigo}) e atingiu o limite de reinícios")
+                servidor['restarts'] += 1
+            return False
+        servidor['restarts'] += 1
+        print(f"[SUPERVISOR] Servidor {i+1} (porta {servidor['port']}) terminou "
+              f"(código {codigo}); reiniciando ({servidor['restarts']}/"
+              f"{self.config['max_restarts']})")
+        self._iniciar(servidor)
+        return True
     
-    print(f"[SETUP] {num_servers} servidores iniciados com sucesso!")
-    return processos
+    def encerrar(self):
+        """Interrompe a supervisão e encerra todos os servidores"""
+        self._parar.set()
+        with self._lock:
+            encerrar_servidores([servidor['processo'] for servidor in self.servidores
+                                 if servidor['processo'] is not None])
+    
+    def aguardar(self):
+        """Bloqueia até Ctrl+C ou SIGTERM (servidores seguem supervisionados)"""
+        print("\n[EXEC] Servidores em execução; Ctrl+C para encerrar")
+        while not self._parar.wait(1.0):
+            pass
+
+
+def iniciar_servidores(num_servers=2):
+    """Inicia múltiplos servidores em processos separados e espera todos ficarem prontos"""
+    cluster = Cluster(dict(DEFAULTS, servers=num_servers))
+    try:
+        cluster.iniciar()
+    except RuntimeError:
+        cluster.encerrar()
+        raise
+    return [servidor['processo'] for servidor in cluster.servidores]
 
 
 def encerrar_servidores(processos):
@@ -50,36 +346,67 @@ def encerrar_servidores(processos):
     print("[CLEANUP] Todos os servidores encerrados")
 
 
-def main():
+def load_config(args, defaults=DEFAULTS):
+    """
+    Padrões, depois o arquivo de configuração (args.config), depois as
+    opções dadas. Compartilhado com o benchmark.py, que passa os seus padrões.
+    """
+    config = dict(defaults)
+    if args.config:
+        with open(args.config) as f:
+            config.update(json.load(f))
+    for key, value in vars(args).items():
+        if key != 'config' and value is not None:
+            config[key] = value
+    return config
+
+
+def main(argv=None):
     """Função principal"""
+    parser = argparse.ArgumentParser(description="Inicia os servidores (e o cliente) do sistema")
+    parser.add_argument('--config', help="arquivo JSON com as opções")
+    parser.add_argument('--servers', type=int, help="número de servidores")
+    parser.add_argument('--host', help="host em que os servidores escutam (e anunciado na lista)")
+    parser.add_argument('--base-port', type=int, help="porta do primeiro servidor")
+    parser.add_argument('--cores-per-server', type=int,
+                        help="núcleos de cada servidor (padrão: divide os disponíveis)")
+    parser.add_argument('--workers', type=int, help="trabalhadores de cada servidor")
+    parser.add_argument('--engine', choices=['auto', 'blas', 'tiles', 'threads'])
+    parser.add_argument('--metrics-base-port', type=int,
+                        help="porta de métricas do primeiro servidor")
+    parser.add_argument('--servers-file', help="arquivo JSON gravado com a lista de servidores")
+    parser.add_argument('--no-client', dest='client', action='store_const', const=False,
+                        help="só inicia e supervisiona os servidores")
+    parser.add_argument('--max-restarts', type=int, help="reinícios permitidos por servidor")
+    parser.add_argument('--show-output', action='store_const', const=True,
+                        help="mostra o log dos servidores")
+    config = load_config(parser.parse_args(argv))
+    
     print("="*70)
     print("  SISTEMA AUTOMATIZADO DE EXECUÇÃO")
     print("  Multiplicação Distribuída de Matrizes")
     print("="*70)
     
-    print("\nEste script irá:")
-    print("1. Iniciar automaticamente os servidores")
-    print("2. Executar o cliente")
-    print("3. Encerrar os servidores ao final")
-    
-    num_servers = int(input("\nQuantos servidores deseja iniciar? (2-4 recomendado): "))
+    # SIGTERM também passa pelo encerramento dos servidores
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
     
-    processos = []
+    cluster = None
     
     try:
-        # Inicia servidores
-        processos = iniciar_servidores(num_servers)
-        
-        # Aguarda servidores iniciarem completamente
-        print("\n[SETUP] Aguardando servidores iniciarem...")
-        time.sleep(2)
-        
-        # Executa cliente
-        print("\n[EXEC] Iniciando cliente...\n")
-        print("="*70)
-        
-        subprocess.run([sys.executable, 'Client.py'])
+        # Inicia servidores (retorna quando todos aceitam conexões)
+        cluster = Cluster(config)
+        cluster.iniciar()
+        cluster.supervisionar()
         
+        if config['client']:
+            # Executa cliente, que lê a lista de servidores do arquivo
+            print("\n[EXEC] Iniciando cliente...\n")
+            print("="*70)
+            env = dict(os.environ, MATRIX_SERVERS_FILE=os.path.abspath(config['servers_file']))
+            subprocess.run([sys.executable, os.path.join(BASE_DIR, 'client.py')], env=env)
+        else:
+            cluster.aguardar()
+    
     except KeyboardInterrupt:
         print("\n\n[INTERROMPIDO] Execução cancelada pelo usuário")
     
@@ -88,12 +415,12 @@ def main():
     
     finally:
         # Sempre encerra os servidores
-        if processos:
-            encerrar_servidores(processos)
+        if cluster is not None:
+            cluster.encerrar()
     
     print("\n[FIM] Execução concluída")
     print("="*70)
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
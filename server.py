@@ -1,107 +1,1063 @@
-
+import os
 import socket
-import pickle
+import signal
+import tempfile
+from multiprocessing import cpu_count
+
+# Variáveis lidas pelas bibliotecas BLAS (OpenBLAS, MKL, BLIS, OpenMP) ao carregar
+BLAS_THREAD_VARS = ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS',
+                    'BLIS_NUM_THREADS', 'VECLIB_MAXIMUM_THREADS', 'NUMEXPR_NUM_THREADS')
+
+
+def _core_budget():
+    """
+    Núcleos que este servidor pode usar: MATRIX_SERVER_CORES ou, sem ela,
+    os núcleos em que o processo pode executar (afinidade) ou cpu_count()
+    """
+    value = os.environ.get('MATRIX_SERVER_CORES')
+    if value:
+        return max(1, int(value))
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return cpu_count()
+
+
+# O orçamento limita juntos os threads do BLAS e os pools de trabalhadores.
+# Precisa ser aplicado antes de importar o NumPy, pois o BLAS lê as variáveis
+# de ambiente ao carregar; com MATRIX_SERVER_CORES ele prevalece sobre elas.
+# Os processos do pool (POOL_WORKER_VAR) usam um thread de BLAS cada, pois o
+# paralelismo deles já vem do pool.
+POOL_WORKER_VAR = 'MATRIX_SERVER_POOL_WORKER'
+CORE_BUDGET = _core_budget()
+for _name in BLAS_THREAD_VARS:
+    if os.environ.get(POOL_WORKER_VAR):
+        os.environ[_name] = '1'
+    elif 'MATRIX_SERVER_CORES' in os.environ:
+        os.environ[_name] = str(CORE_BUDGET)
+    else:
+        os.environ.setdefault(_name, str(CORE_BUDGET))
+
 import numpy as np
-from multiprocessing import Pool, cpu_count
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import get_context, resource_tracker
+from multiprocessing.shared_memory import SharedMemory
 import sys
+import threading
+import time
+import queue
+from collections import OrderedDict
+from contextlib import contextmanager
+from metrics import Metrics, start_http_server
+from tracing import record_span
+from expression import evaluate_order, left_to_right_cost, left_to_right_order
+from protocol import (ProtocolError, Connection, array_digest, narrow_array, is_sparse,
+                      pack_operands, unpack_operands, local_host_id, detach_array, ALLOWED_KINDS)
+
+try:
+    # Opcional: ajusta os threads do BLAS já carregado (por trabalhador)
+    from threadpoolctl import threadpool_info, threadpool_limits
+except ImportError:
+    threadpool_info = threadpool_limits = None
+
+# Motores de cálculo disponíveis (ver MatrixServer.compute)
+ENGINES = ('auto', 'blas', 'tiles', 'threads')
+
+# Linha impressa quando o servidor já aceita conexões (aguardada pelo run_system)
+READY_LINE = "[SERVIDOR] PRONTO"
+
+# Abaixo deste número de operações, uma única chamada ao BLAS é sempre melhor
+SMALL_PRODUCT_FLOPS = 2_000_000
+
+# Segmentos de memória compartilhada abertos em cada processo do pool,
+# mantidos entre tarefas da mesma requisição para não reabri-los por bloco
+_worker_segments = {}
+
+
+def _detect_cache_bytes(default=1024 * 1024):
+    """Tamanho do cache L2 por núcleo (Linux); usa default se indisponível"""
+    try:
+        with open('/sys/devices/system/cpu/cpu0/cache/index2/size') as f:
+            size = f.read().strip().upper()
+        multiplier = {'K': 1024, 'M': 1024 * 1024}.get(size[-1], 1)
+        return int(size.rstrip('KM')) * multiplier
+    except (OSError, ValueError, IndexError):
+        return default
+
+
+CACHE_BYTES = _detect_cache_bytes()
+
+
+def _attach_shared_array(spec):
+    """
+    Abre (ou reaproveita) um segmento compartilhado no processo trabalhador
+    e retorna uma visão NumPy sem cópia.
+    spec: (nome, shape, dtype)
+    """
+    name, shape, dtype = spec
+    shm = _worker_segments.get(name)
+    if shm is None:
+        shm = SharedMemory(name=name)
+        _worker_segments[name] = shm
+    return np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+
+
+def blas_threads():
+    """Threads que o BLAS carregado usa de fato (ou o valor pedido pelo ambiente)"""
+    if threadpool_info is not None:
+        counts = [pool['num_threads'] for pool in threadpool_info() if pool['user_api'] == 'blas']
+        if counts:
+            return max(counts)
+    return int(os.environ.get('OPENBLAS_NUM_THREADS', CORE_BUDGET))
+
+
+def _release_worker_segments(keep):
+    """Fecha segmentos de requisições anteriores que não estão em keep"""
+    for name in list(_worker_segments):
+        if name not in keep:
+            _worker_segments.pop(name).close()
+
+
+def multiply_block(args):
+    """
+    Multiplica um bloco de linhas [start, end) da submatriz A pela matriz B.
+    A, B e C ficam em memória compartilhada; só os descritores trafegam.
+    """
+    spec_a, spec_b, spec_c, start, end = args
+    _release_worker_segments({spec_a[0], spec_b[0], spec_c[0]})
+    submatrix_a = _attach_shared_array(spec_a)
+    matrix_b = _attach_shared_array(spec_b)
+    result = _attach_shared_array(spec_c)
+    np.dot(submatrix_a[start:end], matrix_b, out=result[start:end])
+    return end - start
+
+
+def block_ranges(rows, cols_a, cols_b, itemsize, workers):
+    """
+    Divide as linhas em blocos: cada bloco de A e de C cabe no cache L2 e
+    há pelo menos um bloco por trabalhador.
+    Retorna lista de (start, end).
+    """
+    by_cache = max(1, CACHE_BYTES // max(1, (cols_a + cols_b) * itemsize))
+    by_cores = max(1, -(-rows // max(1, workers)))
+    block = min(by_cache, by_cores)
+    return [(start, min(start + block, rows)) for start in range(0, rows, block)]
+
+
+class MatrixCache:
+    """
+    Cache LRU de matrizes endereçadas pelo hash do conteúdo, limitado por
+    um orçamento de memória em bytes. Matrizes fixadas (handles dos
+    clientes) não são descartadas até serem liberadas, mesmo que passem
+    do orçamento.
+    """
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._pins = {}
+        self._lock = threading.Lock()
+    
+    def get(self, digest):
+        """Retorna a matriz em cache (ou None) e contabiliza acerto/falha"""
+        with self._lock:
+            matrix = self._entries.get(digest)
+            if matrix is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(digest)
+            self.hits += 1
+            return matrix
+    
+    def put(self, digest, matrix, pin=False):
+        """
+        Guarda a matriz, descartando as menos usadas (e não fixadas) até
+        caber no orçamento. pin: fixa a matriz (ver pin)
+        """
+        if matrix.nbytes > self.max_bytes and not pin:
+            return
+        matrix.flags.writeable = False
+        with self._lock:
+            if pin:
+                self._pins[digest] = self._pins.get(digest, 0) + 1
+            if digest in self._entries:
+                self._entries.move_to_end(digest)
+                return
+            for candidate in list(self._entries):
+                if self.current_bytes + matrix.nbytes <= self.max_bytes:
+                    break
+                if candidate not in self._pins:
+                    self.current_bytes -= self._entries.pop(candidate).nbytes
+            self._entries[digest] = matrix
+            self.current_bytes += matrix.nbytes
+    
+    def pin(self, digest):
+        """
+        Fixa uma matriz já em cache (contagem de referências: cada pin pede
+        um unpin). Retorna a matriz, ou None se ela não está no cache; não
+        conta como acerto nem falha (não é um uso da matriz como B).
+        """
+        with self._lock:
+            matrix = self._entries.get(digest)
+            if matrix is not None:
+                self._pins[digest] = self._pins.get(digest, 0) + 1
+            return matrix
+    
+    def unpin(self, digest):
+        """Desfaz um pin; sem pins, a matriz volta a poder ser descartada"""
+        with self._lock:
+            count = self._pins.get(digest, 0) - 1
+            if count > 0:
+                self._pins[digest] = count
+            else:
+                self._pins.pop(digest, None)
+    
+    def stats(self):
+        """Contadores do cache"""
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'entries': len(self._entries),
+                'pinned': len(self._pins),
+                'bytes': self.current_bytes,
+                'max_bytes': self.max_bytes,
+            }
+
+
+class JobSlots:
+    """
+    Limita os cálculos simultâneos (como um semáforo) e registra nas
+    métricas quantos estão rodando, quantos aguardam e o tempo de espera.
+    Uso: with job_slots(conn): ... (a espera vira um span se a requisição
+    da conexão estiver sendo rastreada)
+    """
+    def __init__(self, max_jobs, metrics):
+        self._semaphore = threading.BoundedSemaphore(max_jobs)
+        self.metrics = metrics
+    
+    @contextmanager
+    def __call__(self, conn=None):
+        self.metrics.add('jobs_waiting', 1)
+        started, started_ns = time.perf_counter(), time.time_ns()
+        self._semaphore.acquire()
+        self.metrics.add('jobs_waiting', -1)
+        self.metrics.add('jobs_running', 1)
+        self.metrics.observe('job_wait_seconds', time.perf_counter() - started)
+        if conn is not None:
+            record_span(conn.spans, 'queue_wait', started_ns)
+        try:
+            yield
+        finally:
+            self.metrics.add('jobs_running', -1)
+            self._semaphore.release()
+
+
+class BlasThreadLimit:
+    """
+    Limita o BLAS a um thread enquanto houver multiplicações em blocos
+    rodando em threads. O limite do threadpoolctl vale para o processo todo,
+    então as requisições simultâneas compartilham um único limite contado
+    por referência: a primeira o aplica e a última restaura o original.
+    Uso: with blas_thread_limit(): ... (sem threadpoolctl não faz nada)
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._users = 0
+        self._limit = None
+    
+    @contextmanager
+    def __call__(self):
+        if threadpool_limits is None:
+            yield
+            return
+        with self._lock:
+            if self._users == 0:
+                self._limit = threadpool_limits(1)
+            self._users += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._users -= 1
+                if self._users == 0:
+                    self._limit.restore_original_limits()
+                    self._limit = None
+
+
+# Um por processo, como o próprio limite do BLAS
+blas_thread_limit = BlasThreadLimit()
+
 
 class MatrixServer:
-    def __init__(self, host='localhost', port=5000):
+    def __init__(self, host='localhost', port=5000, num_workers=None, engine='auto',
+                 backlog=16, max_jobs=2, cache_bytes=512 * 1024 * 1024, metrics_port=None,
+                 unix_socket=True):
+        """
+        backlog: conexões pendentes aceitas pelo listen
+        max_jobs: multiplicações calculadas ao mesmo tempo; as demais conexões
+                  continuam recebendo/enviando dados enquanto aguardam
+        cache_bytes: orçamento de memória do cache de matrizes B
+        metrics_port: se dado, serve as métricas no formato do Prometheus em
+                      http://host:metrics_port/metrics
+        unix_socket: também aceita conexões de clientes da mesma máquina por um
+                     socket Unix, com as matrizes em memória compartilhada
+        """
+        if engine not in ENGINES:
+            raise ValueError(f"Motor desconhecido: {engine} (opções: {', '.join(ENGINES)})")
         self.host = host
         self.port = port
         self.server_socket = None
+        self.num_workers = num_workers or CORE_BUDGET
+        self.engine = engine
+        self.backlog = backlog
+        self.max_jobs = max_jobs
+        self.metrics_port = metrics_port
+        self.unix_path = (os.path.join(tempfile.gettempdir(), f"matrix_server_{port}.sock")
+                          if unix_socket and hasattr(socket, 'AF_UNIX') else None)
+        self.unix_socket = None
+        self.probe = None
+        self.metrics = self._create_metrics()
+        self.job_slots = JobSlots(max_jobs, self.metrics)
+        self.cache = MatrixCache(cache_bytes)
+        self.pool = None
+        self.thread_pool = None
+    
+    def _create_metrics(self):
+        """Registro de métricas do servidor, com as descrições de cada uma"""
+        metrics = Metrics()
+        for name, text in (
+            ('requests_total', 'Requisições atendidas, por operação'),
+            ('request_errors_total', 'Requisições com erro, por operação'),
+            ('request_seconds', 'Duração das requisições, por operação'),
+            ('compute_seconds', 'Tempo de cálculo por requisição'),
+            ('job_wait_seconds', 'Espera por uma vaga de cálculo'),
+            ('jobs_running', 'Cálculos em andamento'),
+            ('jobs_waiting', 'Cálculos aguardando vaga (fila)'),
+            ('workers_busy', 'Trabalhadores ocupados, por pool'),
+            ('workers', 'Trabalhadores disponíveis, por pool'),
+            ('connections_total', 'Conexões aceitas'),
+            ('connections_active', 'Conexões abertas'),
+            ('bytes_received_total', 'Bytes recebidos (no fio)'),
+            ('bytes_sent_total', 'Bytes enviados (no fio)'),
+            ('cache_hits_total', 'Acertos do cache de matrizes'),
+            ('cache_misses_total', 'Falhas do cache de matrizes'),
+            ('cache_bytes', 'Memória usada pelo cache de matrizes'),
+            ('core_budget', 'Núcleos reservados ao servidor (MATRIX_SERVER_CORES)'),
+            ('blas_threads', 'Threads do BLAS em uma chamada direta'),
+        ):
+            metrics.describe(name, text)
+        metrics.set('jobs_running', 0)
+        metrics.set('jobs_waiting', 0)
+        metrics.set('connections_active', 0)
+        metrics.set('workers', self.num_workers, pool='processes')
+        metrics.set('workers', self.num_workers, pool='threads')
+        metrics.set('core_budget', CORE_BUDGET)
+        metrics.set('blas_threads', blas_threads())
+        metrics.collectors.append(self._collect_cache_metrics)
+        return metrics
+    
+    def _collect_cache_metrics(self, metrics):
+        """Copia os contadores do cache para as métricas (antes de cada leitura)"""
+        stats = self.cache.stats()
+        metrics.set_counter('cache_hits_total', stats['hits'])
+        metrics.set_counter('cache_misses_total', stats['misses'])
+        metrics.set('cache_bytes', stats['bytes'])
+    
+    def start_pool(self):
+        """Cria os pools persistentes (reutilizados entre requisições)"""
+        if self.pool is None:
+            # O rastreador de recursos precisa existir antes de criar os
+            # trabalhadores para que eles o compartilhem em vez de iniciar um
+            # próprio
+            resource_tracker.ensure_running()
+            # Processos novos (spawn), e não cópias deste: o BLAS de cada um
+            # carrega com um thread (POOL_WORKER_VAR), mesmo sem threadpoolctl.
+            # A variável fica no ambiente para os trabalhadores recriados.
+            os.environ[POOL_WORKER_VAR] = '1'
+            self.pool = get_context('spawn').Pool(processes=self.num_workers)
+            print(f"[SERVIDOR] Pool com {self.num_workers} processos iniciado")
+        if self.thread_pool is None:
+            self.thread_pool = ThreadPoolExecutor(max_workers=self.num_workers)
+    
+    def parallelism(self):
+        """
+        Paralelismo efetivo: orçamento de núcleos, threads do BLAS em uma
+        chamada direta e trabalhadores dos pools. Os processos do pool sempre
+        usam um thread de BLAS; os threads, só com o threadpoolctl.
+        """
+        thread_blas = 1 if threadpool_limits is not None else blas_threads()
+        return {
+            'cores': CORE_BUDGET,
+            'blas_threads': blas_threads(),
+            'workers': self.num_workers,
+            'worker_blas_threads': 1,
+            'thread_blas_threads': thread_blas,
+            'max_threads': max(blas_threads(), self.num_workers * thread_blas),
+        }
+    
+    def shutdown(self):
+        """Encerra os pools e o socket do servidor"""
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+        if self.thread_pool is not None:
+            self.thread_pool.shutdown(wait=True)
+            self.thread_pool = None
+        if self.server_socket:
+            self.server_socket.close()
+            self.server_socket = None
+        if self.unix_socket:
+            self.unix_socket.close()
+            self.unix_socket = None
+            if os.path.exists(self.unix_path):
+                os.unlink(self.unix_path)
+        if self.probe is not None:
+            self.probe.close()
+            self.probe.unlink()
+            self.probe = None
+    
+    def _share_array(self, array, segments, shape=None, dtype=None):
+        """
+        Cria um segmento compartilhado e, se array for dado, copia-o para lá.
+        Retorna o spec (nome, shape, dtype) e registra o segmento em segments.
+        """
+        shape = array.shape if array is not None else shape
+        dtype = array.dtype if array is not None else np.dtype(dtype)
+        shm = SharedMemory(create=True, size=max(int(np.prod(shape)) * dtype.itemsize, 1))
+        segments.append(shm)
+        if array is not None:
+            np.ndarray(shape, dtype=dtype, buffer=shm.buf)[...] = array
+        return shm.name, shape, dtype.str
+    
+    def choose_engine(self, submatrix_a, matrix_b):
+        """
+        Escolhe o motor pelo formato e tipo das matrizes:
+        produtos pequenos ou de ponto flutuante vão direto ao BLAS (que já é
+        multithread); produtos inteiros grandes, que o NumPy calcula sem BLAS,
+        são divididos em blocos entre threads.
+        """
+        rows, cols_a = submatrix_a.shape
+        flops = 2 * rows * cols_a * matrix_b.shape[1]
+        if flops < SMALL_PRODUCT_FLOPS or self.num_workers == 1:
+            return 'blas'
+        if np.result_type(submatrix_a, matrix_b).kind in 'fc':
+            return 'blas'
+        return 'threads'
+    
+    def compute(self, submatrix_a, matrix_b, engine=None, spec_b=None):
+        """
+        Calcula submatrix_a @ matrix_b com o motor pedido
+        (None usa o padrão do servidor; 'auto' escolhe pelo formato).
+        spec_b: B já em memória compartilhada (shared_operand), reutilizada
+                pelo motor 'tiles' em vez de copiá-la de novo
+        Retorna (resultado, motor_utilizado)
+        """
+        engine = engine or self.engine
+        if engine not in ENGINES:
+            raise ValueError(f"Motor desconhecido: {engine}")
+        if engine == 'auto':
+            engine = self.choose_engine(submatrix_a, matrix_b)
         
-    def multiply_row(self, args):
+        if engine == 'blas':
+            result = np.dot(submatrix_a, matrix_b)
+        elif engine == 'threads':
+            result = self.threaded_multiplication(submatrix_a, matrix_b)
+        else:
+            result = self.parallel_multiplication(submatrix_a, matrix_b, spec_b)
+        return result, engine
+    
+    @contextmanager
+    def shared_operand(self, matrix_b, engine=None):
         """
-        Multiplica uma linha da submatriz A pela matriz B.
-        Utilizado para paralelização com multiprocessing.
+        B de uma requisição calculada em vários blocos de A: com o motor
+        'tiles', é colocada em memória compartilhada uma única vez e o spec
+        retornado vale para todos os blocos (compute(..., spec_b=spec)).
+        Nos demais motores retorna None.
         """
-        row, matrix_b = args
-        return np.dot(row, matrix_b)
+        if (engine or self.engine) != 'tiles':
+            yield None
+            return
+        segments = []
+        try:
+            yield self._share_array(matrix_b, segments)
+        finally:
+            for shm in segments:
+                shm.close()
+                shm.unlink()
     
-    def parallel_multiplication(self, submatrix_a, matrix_b):
+    def threaded_multiplication(self, submatrix_a, matrix_b):
         """
-        Realiza multiplicação paralela usando multiprocessing.
-        Cada linha da submatriz A é processada em paralelo.
+        Divide A em blocos de linhas calculados por threads.
+        O np.dot libera o GIL, então os blocos rodam em paralelo sem cópias.
         """
-        num_processes = min(cpu_count(), len(submatrix_a))
+        self.start_pool()
+        result = np.empty((submatrix_a.shape[0], matrix_b.shape[1]),
+                          dtype=np.result_type(submatrix_a, matrix_b))
+        blocks = block_ranges(submatrix_a.shape[0], submatrix_a.shape[1], matrix_b.shape[1],
+                              result.itemsize, self.num_workers)
         
-        # Prepara argumentos para cada processo
-        args = [(row, matrix_b) for row in submatrix_a]
+        def multiply(block):
+            start, end = block
+            np.dot(submatrix_a[start:end], matrix_b, out=result[start:end])
         
-        # Cria pool de processos e executa multiplicação
-        with Pool(processes=num_processes) as pool:
-            result = pool.map(self.multiply_row, args)
+        busy = min(len(blocks), self.num_workers)
+        self.metrics.add('workers_busy', busy, pool='threads')
+        try:
+            if busy > 1:
+                # Um thread de BLAS por bloco enquanto os blocos rodam
+                with blas_thread_limit():
+                    list(self.thread_pool.map(multiply, blocks))
+            else:
+                list(self.thread_pool.map(multiply, blocks))
+        finally:
+            self.metrics.add('workers_busy', -busy, pool='threads')
+        return result
+    
+    def parallel_multiplication(self, submatrix_a, matrix_b, spec_b=None):
+        """
+        Realiza multiplicação paralela usando o pool persistente.
+        A e B são colocadas uma única vez em memória compartilhada e cada
+        bloco de linhas da submatriz A é processado em paralelo.
+        spec_b: B já compartilhada por shared_operand (não é copiada de novo)
+        """
+        self.start_pool()
+        result_shape = (submatrix_a.shape[0], matrix_b.shape[1])
+        result_dtype = np.result_type(submatrix_a, matrix_b)
+        segments = []
         
-        return np.array(result)
+        try:
+            spec_a = self._share_array(submatrix_a, segments)
+            spec_b = spec_b or self._share_array(matrix_b, segments)
+            spec_c = self._share_array(None, segments, result_shape, result_dtype)
+            result_segment = segments[-1]
+            
+            # Cada tarefa carrega apenas os nomes dos segmentos e o intervalo
+            blocks = block_ranges(result_shape[0], submatrix_a.shape[1], result_shape[1],
+                                  result_dtype.itemsize, self.num_workers)
+            args = [(spec_a, spec_b, spec_c, start, end) for start, end in blocks]
+            busy = min(len(args), self.num_workers)
+            self.metrics.add('workers_busy', busy, pool='processes')
+            try:
+                self.pool.map(multiply_block, args)
+            finally:
+                self.metrics.add('workers_busy', -busy, pool='processes')
+            
+            # Copia o resultado antes de liberar o segmento
+            return np.ndarray(result_shape, dtype=result_dtype, buffer=result_segment.buf).copy()
+        finally:
+            for shm in segments:
+                shm.close()
+                shm.unlink()
+    
+    def _check_operands(self, arrays):
+        """Valida os operandos de uma multiplicação e retorna (A, B)"""
+        if len(arrays) != 2:
+            raise ProtocolError("Requisição de multiplicação deve conter A e B")
+        submatrix_a, matrix_b = arrays
+        if submatrix_a.ndim != 2 or matrix_b.ndim != 2 or submatrix_a.shape[1] != matrix_b.shape[0]:
+            raise ValueError(f"Dimensões incompatíveis: {submatrix_a.shape} x {matrix_b.shape}")
+        return submatrix_a, matrix_b
+    
+    def _timed(self, conn, key, function, *args):
+        """
+        Executa function(*args) somando o tempo gasto em conn.stats[key]
+        (e registrando um span, se a requisição estiver sendo rastreada)
+        """
+        started, started_ns = time.perf_counter_ns(), time.time_ns()
+        try:
+            return function(*args)
+        finally:
+            conn.stats[key] += time.perf_counter_ns() - started
+            record_span(conn.spans, key[:-len('_ns')], started_ns)
+    
+    def _send_block(self, conn, row, block):
+        """Envia um bloco de linhas do resultado ({'status': 'block'})"""
+        started_ns = time.time_ns()
+        conn.send({'status': 'block', 'row': row}, [block])
+        record_span(conn.spans, 'reply', started_ns, rows=block.shape[0])
+    
+    def _reply(self, conn, meta, arrays=()):
+        """
+        Envia a resposta final de uma requisição com os tempos gastos pelo
+        servidor nela ('timings': cálculo e preparo do resultado para envio)
+        e, se a requisição estiver sendo rastreada, os spans do servidor
+        """
+        mark = conn.request_mark
+        timings = {key: conn.stats[key] - mark[key] for key in ('compute_ns', 'serialize_ns')}
+        meta = dict(meta, timings=timings)
+        if conn.spans is not None:
+            record_span(conn.spans, 'request', conn.request_started_ns)
+            meta['spans'] = conn.spans
+        conn.send(meta, arrays)
+    
+    def handle_ping(self, conn, meta, arrays):
+        """Responde à verificação de saúde da conexão"""
+        conn.send({'status': 'ok'})
+    
+    def handle_hello(self, conn, meta, arrays):
+        """
+        Informa ao cliente como chegar ao transporte local: identificador do
+        host, caminho do socket Unix e um segmento de teste com um token que
+        só um processo desta máquina consegue ler. Em uma conexão local,
+        define também o prefixo dos segmentos de memória compartilhada dela.
+        """
+        reply = {'status': 'ok', 'host_id': None}
+        if self.unix_socket is not None:
+            reply.update(host_id=local_host_id(), unix_path=self.unix_path, probe=self.probe.name,
+                         token=bytes(self.probe.buf[:16]).hex())
+        if conn.shared_memory is not None:
+            if conn.shared_memory.prefix is None:
+                conn.shared_memory.bind(f"mx{os.urandom(6).hex()}", 's')
+            reply['shm_prefix'] = conn.shared_memory.prefix
+        conn.send(reply)
+    
+    def handle_stats(self, conn, meta, arrays):
+        """Envia os contadores do cache e as métricas do servidor"""
+        conn.send({'status': 'ok', 'cache': self.cache.stats(), 'metrics': self.metrics.snapshot(),
+                   'parallelism': self.parallelism()})
+    
+    def _resolve_cached(self, conn, digest):
+        """
+        Busca a matriz pelo hash no cache. Em caso de falha, pede o envio ao
+        cliente (na mesma conexão), confere o hash e guarda no cache.
+        """
+        matrix = self.cache.get(digest)
+        if matrix is not None:
+            return matrix
+        matrix = self._request_upload(conn, digest)
+        self.cache.put(digest, matrix)
+        return matrix
+    
+    def _request_upload(self, conn, digest):
+        """Pede ao cliente a matriz ausente do cache e confere seu hash"""
+        conn.send({'status': 'cache_miss', 'digest': digest})
+        message = conn.recv()
+        if message is None:
+            raise ConnectionError("Cliente encerrou a conexão durante o envio de B")
+        meta, arrays = message
+        if meta.get('op') != 'upload' or len(arrays) != 1:
+            raise ProtocolError("Esperado envio da matriz ausente do cache")
+        # Vai para o cache: não pode continuar apontando para a memória do cliente
+        matrix = detach_array(arrays[0])
+        if array_digest(matrix) != digest:
+            raise ValueError("Hash da matriz recebida não confere")
+        return matrix
+    
+    def handle_pin(self, conn, meta, arrays):
+        """
+        Fixa no cache a matriz de um handle (pedindo o envio se ela não
+        estiver lá) e responde com seu formato
+        """
+        digest = meta.get('digest')
+        if not isinstance(digest, str):
+            raise ProtocolError("Handle sem hash")
+        matrix = self.cache.pin(digest)
+        if matrix is None:
+            matrix = self._request_upload(conn, digest)
+            self.cache.put(digest, matrix, pin=True)
+        conn.send({'status': 'ok', 'shape': list(matrix.shape), 'dtype': matrix.dtype.str})
+    
+    def handle_release(self, conn, meta, arrays):
+        """Libera handles fixados (as matrizes voltam a poder ser descartadas)"""
+        digests = meta.get('digests')
+        if not isinstance(digests, list):
+            raise ProtocolError("Lista de handles inválida")
+        for digest in digests:
+            self.cache.unpin(str(digest))
+        conn.send({'status': 'ok'})
+    
+    def handle_evaluate_chain(self, conn, meta, arrays):
+        """
+        Calcula a cadeia de produtos de handles meta['operands'] para as
+        linhas meta['rows'] = [início, fim) do primeiro operando, da
+        esquerda para a direita: o cliente já calculou, uma única vez, os
+        produtos que não dependem dessas linhas (MatrixClient.evaluate).
+        Os produtos intermediários ficam aqui; o resultado volta em blocos de
+        stream_rows linhas ({'status': 'block'}) e a resposta final traz
+        a ordem usada.
+        """
+        digests = meta.get('operands')
+        rows = meta.get('rows')
+        if not isinstance(digests, list) or not digests or not isinstance(rows, list) or len(rows) != 2:
+            raise ProtocolError("Cadeia de handles inválida")
+        operands = [self._resolve_cached(conn, str(digest)) for digest in digests]
+        for left, right in zip(operands, operands[1:]):
+            if left.ndim != 2 or right.ndim != 2 or left.shape[1] != right.shape[0]:
+                raise ValueError(f"Dimensões incompatíveis: {left.shape} x {right.shape}")
+        start, end = int(rows[0]), int(rows[1])
+        if not 0 <= start <= end <= operands[0].shape[0]:
+            raise ValueError(f"Linhas fora do primeiro operando: {rows}")
+        operands[0] = operands[0][start:end]
+        dims = [operands[0].shape[0]] + [operand.shape[1] for operand in operands]
+        cost, order = left_to_right_cost(dims), left_to_right_order(len(operands))
+        
+        def multiply(a, b):
+            return self.compute(a, b, meta.get('engine'))[0]
+        
+        with self.job_slots(conn):
+            operands = [self._widen(operand, meta.get('dtype')) for operand in operands]
+            result = self._timed(conn, 'compute_ns', evaluate_order, order, operands, multiply)
+        if meta.get('narrow_result'):
+            result = self._timed(conn, 'serialize_ns', narrow_array, result)
+        print(f"[SERVIDOR] Cadeia de {len(operands)} matrizes (linhas {start}:{end}) calculada "
+              f"na ordem {order} ({cost} multiplicações). Resultado: {result.shape}")
+        
+        step = max(1, int(meta.get('stream_rows') or result.shape[0] or 1))
+        for row in range(0, result.shape[0], step):
+            self._send_block(conn, row, result[row:row + step])
+        self._reply(conn, {'status': 'ok', 'order': order, 'cost': cost})
+    
+    def _widen(self, array, dtype):
+        """
+        Converte um operando recebido em tipo estreito para o tipo de cálculo
+        pedido pelo cliente (evita overflow ao acumular, ex.: int8 -> int64).
+        """
+        if dtype is None:
+            return array
+        dtype = np.dtype(dtype)
+        if dtype.kind not in ALLOWED_KINDS:
+            raise ValueError(f"Tipo de cálculo não suportado: {dtype}")
+        return array.astype(dtype, copy=False)
+    
+    def handle_multiply(self, conn, meta, arrays):
+        """
+        Multiplica A por B e envia o resultado.
+        B pode vir na mensagem ou ser referenciada pelo hash (b_hash).
+        dtype: tipo de cálculo (os operandos podem chegar em tipos mais estreitos)
+        narrow_result: devolve C no menor tipo inteiro que comporta seus valores
+        stream_rows: C é calculada e enviada em blocos desse número de linhas,
+                     à medida que cada bloco fica pronto (padrão: um só bloco)
+        """
+        if meta.get('b_hash') and len(arrays) == 1:
+            arrays = [arrays[0], self._resolve_cached(conn, meta['b_hash'])]
+        submatrix_a, matrix_b = self._check_operands(arrays)
+        print(f"[SERVIDOR] Recebido: submatriz A {submatrix_a.shape} {submatrix_a.dtype}, "
+              f"matriz B {matrix_b.shape} {matrix_b.dtype}")
+        
+        self._stream_multiply(conn, meta, submatrix_a, matrix_b)
+    
+    def _stream_multiply(self, conn, meta, submatrix_a, matrix_b):
+        """
+        Calcula C em blocos de linhas em um thread produtor e envia cada bloco
+        ({'status': 'block', 'row': início}) assim que fica pronto, sobrepondo
+        o envio de um bloco ao cálculo do próximo. Termina com {'status': 'ok'}.
+        """
+        rows = submatrix_a.shape[0]
+        step = max(1, int(meta.get('stream_rows') or rows or 1))
+        blocks = queue.Queue()
+        cancelled = threading.Event()
+        
+        def produce():
+            try:
+                with self.job_slots(conn):
+                    a = self._widen(submatrix_a, meta.get('dtype'))
+                    b = self._widen(matrix_b, meta.get('dtype'))
+                    with self.shared_operand(b, meta.get('engine')) as spec_b:
+                        for start in range(0, rows, step):
+                            if cancelled.is_set():
+                                return
+                            block, engine = self._timed(conn, 'compute_ns', self.compute,
+                                                        a[start:start + step], b, meta.get('engine'),
+                                                        spec_b)
+                            if meta.get('narrow_result'):
+                                block = self._timed(conn, 'serialize_ns', narrow_array, block)
+                            blocks.put((start, block, engine))
+                blocks.put(None)
+            except Exception as e:
+                blocks.put(e)
+        
+        threading.Thread(target=produce, daemon=True).start()
+        engine = meta.get('engine') or self.engine
+        try:
+            while True:
+                item = blocks.get()
+                if item is None:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                start, block, engine = item
+                self._send_block(conn, start, block)
+        finally:
+            cancelled.set()
+        
+        print(f"[SERVIDOR] Multiplicação concluída ({engine}). "
+              f"Resultado: ({rows}, {matrix_b.shape[1]}) em blocos de {step} linhas")
+        self._reply(conn, {'status': 'ok', 'engine': engine, 'rows': rows})
+    
+    def handle_multiply_sparse(self, conn, meta, arrays):
+        """
+        Multiplica operandos em que A e/ou B são esparsas (CSR/CSC), descritas
+        em meta['operands']. Usa os kernels do SciPy: esparsa x densa e
+        densa x esparsa dão um resultado denso; esparsa x esparsa, CSR.
+        """
+        submatrix_a, matrix_b = unpack_operands(meta.get('operands'), arrays)
+        self._check_operands([submatrix_a, matrix_b])
+        print(f"[SERVIDOR] Recebido (esparso): A {submatrix_a.shape} "
+              f"{'nnz=%d' % submatrix_a.nnz if is_sparse(submatrix_a) else 'densa'}, "
+              f"B {matrix_b.shape} {'nnz=%d' % matrix_b.nnz if is_sparse(matrix_b) else 'densa'}")
+        
+        with self.job_slots(conn):
+            submatrix_a = self._widen(submatrix_a, meta.get('dtype'))
+            matrix_b = self._widen(matrix_b, meta.get('dtype'))
+            result = self._timed(conn, 'compute_ns', lambda: submatrix_a @ matrix_b)
+        result = result.tocsr() if is_sparse(result) else np.asarray(result)
+        if meta.get('narrow_result'):
+            result = self._timed(conn, 'serialize_ns', narrow_array, result)
+        
+        specs, result_arrays = pack_operands([result])
+        print(f"[SERVIDOR] Multiplicação esparsa concluída. Resultado: {result.shape} ({specs[0]['format']})")
+        self._reply(conn, {'status': 'ok', 'engine': 'sparse', 'operands': specs}, result_arrays)
+    
+    def handle_batch_multiply(self, conn, meta, arrays):
+        """
+        Multiplica um lote de pares pequenos (A_i @ B_i) com um único np.matmul.
+        A e B chegam empilhadas em arrays 3D (n, m, k) e (n, k, p).
+        """
+        if len(arrays) != 2:
+            raise ProtocolError("Requisição em lote deve conter A e B empilhadas")
+        batch_a, batch_b = arrays
+        if (batch_a.ndim != 3 or batch_b.ndim != 3 or batch_a.shape[0] != batch_b.shape[0]
+                or batch_a.shape[2] != batch_b.shape[1]):
+            raise ValueError(f"Dimensões incompatíveis: {batch_a.shape} x {batch_b.shape}")
+        
+        with self.job_slots(conn):
+            result = self._timed(conn, 'compute_ns', np.matmul, self._widen(batch_a, meta.get('dtype')),
+                                 self._widen(batch_b, meta.get('dtype')))
+        if meta.get('narrow_result'):
+            result = self._timed(conn, 'serialize_ns', narrow_array, result)
+        print(f"[SERVIDOR] Lote concluído: {batch_a.shape[0]} produtos "
+              f"{batch_a.shape[1:]} x {batch_b.shape[1:]}")
+        self._reply(conn, {'status': 'ok', 'count': batch_a.shape[0]}, [result])
+    
+    def handle_multiply_pipelined(self, conn, meta, arrays):
+        """
+        Multiplicação em pipeline: B chega primeiro (na mensagem ou pelo hash
+        b_hash) e o servidor responde {'status': 'ready'}. Depois A chega em
+        blocos de linhas ({'op': 'a_block', 'row': início}) terminados por
+        {'op': 'a_end'}. Cada bloco é multiplicado assim que chega e o
+        resultado volta como {'status': 'block'}, sobrepondo recepção, cálculo
+        e envio. Termina com {'status': 'ok'}.
+        """
+        if meta.get('b_hash'):
+            matrix_b = self._resolve_cached(conn, meta['b_hash'])
+        elif len(arrays) == 1:
+            matrix_b = arrays[0]
+        else:
+            raise ProtocolError("Requisição em pipeline deve conter B ou b_hash")
+        if matrix_b.ndim != 2:
+            raise ValueError(f"Matriz B deve ser 2D: {matrix_b.shape}")
+        matrix_b = self._widen(matrix_b, meta.get('dtype'))
+        conn.send({'status': 'ready'})
+        
+        # Fila limitada: se o cálculo atrasar, o TCP segura o cliente
+        blocks = queue.Queue(maxsize=8)
+        failures = []
+        summary = {'engine': meta.get('engine') or self.engine, 'rows': 0}
+        
+        def consume(spec_b):
+            while True:
+                item = blocks.get()
+                if item is None:
+                    return
+                if failures:
+                    # Após uma falha só esvazia a fila até o fim da requisição
+                    continue
+                start, submatrix_a = item
+                try:
+                    with self.job_slots(conn):
+                        submatrix_a = self._widen(submatrix_a, meta.get('dtype'))
+                        block, summary['engine'] = self._timed(conn, 'compute_ns', self.compute,
+                                                               submatrix_a, matrix_b,
+                                                               meta.get('engine'), spec_b)
+                    if meta.get('narrow_result'):
+                        block = self._timed(conn, 'serialize_ns', narrow_array, block)
+                    self._send_block(conn, start, block)
+                    summary['rows'] += block.shape[0]
+                except Exception as e:
+                    failures.append(e)
+        
+        with self.shared_operand(matrix_b, meta.get('engine')) as spec_b:
+            worker = threading.Thread(target=consume, args=(spec_b,), daemon=True)
+            worker.start()
+            try:
+                while True:
+                    message = conn.recv()
+                    if message is None:
+                        raise ConnectionError("Cliente encerrou a conexão durante o envio de A")
+                    block_meta, block_arrays = message
+                    if block_meta.get('op') == 'a_end':
+                        break
+                    if (block_meta.get('op') != 'a_block' or len(block_arrays) != 1
+                            or block_arrays[0].ndim != 2 or block_arrays[0].shape[1] != matrix_b.shape[0]):
+                        # Continua lendo até a_end para manter a sessão sincronizada
+                        failures.append(ProtocolError("Bloco de A inválido na requisição em pipeline"))
+                        continue
+                    blocks.put((int(block_meta.get('row', 0)), block_arrays[0]))
+            finally:
+                blocks.put(None)
+                worker.join()
+        
+        if failures:
+            raise failures[0]
+        print(f"[SERVIDOR] Multiplicação em pipeline concluída ({summary['engine']}). "
+              f"Resultado: ({summary['rows']}, {matrix_b.shape[1]})")
+        self._reply(conn, {'status': 'ok', 'engine': summary['engine'], 'rows': summary['rows']})
+    
+    def handle_connection(self, client_socket, address):
+        """
+        Atende uma sessão (executado em um thread próprio): a conexão
+        permanece aberta para várias requisições até o cliente encerrá-la.
+        """
+        print(f"[SERVIDOR] Conexão estabelecida com {address}")
+        handlers = {
+            'ping': self.handle_ping,
+            'hello': self.handle_hello,
+            'pin': self.handle_pin,
+            'release': self.handle_release,
+            'evaluate_chain': self.handle_evaluate_chain,
+            'multiply': self.handle_multiply,
+            'multiply_pipelined': self.handle_multiply_pipelined,
+            'batch_multiply': self.handle_batch_multiply,
+            'multiply_sparse': self.handle_multiply_sparse,
+            'stats': self.handle_stats,
+        }
+        
+        local = client_socket.family == getattr(socket, 'AF_UNIX', None)
+        if not local:
+            # Aumenta buffer para transferências grandes
+            client_socket.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 1024 * 1024)
+            client_socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1024 * 1024)
+            # Blocos e a mensagem final seguem sem esperar o ACK (algoritmo de Nagle)
+            client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        
+        # Respostas usam a mesma compressão escolhida pelo cliente; conexões
+        # locais trocam as matrizes por memória compartilhada
+        conn = Connection(client_socket, mirror=True, shared_memory=local)
+        self.metrics.inc('connections_total')
+        self.metrics.add('connections_active', 1)
+        accounted = dict(conn.stats)
+        
+        try:
+            while True:
+                message = conn.recv()
+                if message is None:
+                    break
+                meta, arrays = message
+                
+                op = meta.get('op')
+                handler = handlers.get(op)
+                op = op if handler is not None else 'unknown'
+                conn.request_mark = dict(conn.stats)
+                started = time.perf_counter()
+                # Requisição rastreada: o tempo de recepção vira o primeiro span
+                conn.spans = [] if isinstance(meta.get('trace'), dict) else None
+                conn.request_started_ns = time.time_ns()
+                received_ns = conn.stats['receive_ns'] - accounted['receive_ns']
+                record_span(conn.spans, 'receive', conn.request_started_ns - received_ns,
+                            conn.request_started_ns)
+                try:
+                    if handler is None:
+                        raise ValueError(f"Operação desconhecida: {meta.get('op')}")
+                    handler(conn, meta, arrays)
+                except (ValueError, ProtocolError) as e:
+                    # Requisição inválida: responde com erro e mantém a sessão
+                    print(f"[SERVIDOR] Requisição inválida de {address}: {e}")
+                    self.metrics.inc('request_errors_total', op=op)
+                    conn.send_error(e)
+                finally:
+                    accounted = self._record_request(conn, op, started, accounted)
+                    # Sem referências aos arrays, a memória compartilhada da
+                    # requisição volta ao cliente antes da próxima mensagem
+                    message = meta = arrays = None
+            
+            print(f"[SERVIDOR] Conexão com {address} encerrada")
+            
+        except Exception as e:
+            print(f"[SERVIDOR] Erro ao processar dados de {address}: {e}")
+        finally:
+            self.metrics.add('connections_active', -1)
+            conn.close()
+    
+    def _record_request(self, conn, op, started, accounted):
+        """Registra nas métricas uma requisição atendida; retorna os contadores atuais"""
+        stats = dict(conn.stats)
+        self.metrics.inc('requests_total', op=op)
+        self.metrics.observe('request_seconds', time.perf_counter() - started, op=op)
+        self.metrics.inc('bytes_received_total', stats['bytes_received'] - accounted['bytes_received'])
+        self.metrics.inc('bytes_sent_total', stats['bytes_sent'] - accounted['bytes_sent'])
+        compute_ns = stats['compute_ns'] - accounted['compute_ns']
+        if compute_ns:
+            self.metrics.observe('compute_seconds', compute_ns / 1e9)
+        return stats
+    
+    def _accept_loop(self, listener):
+        """Aceita conexões e atende cada uma em um thread"""
+        while True:
+            client_socket, address = listener.accept()
+            threading.Thread(target=self.handle_connection,
+                             args=(client_socket, address or f"unix:{self.unix_path}"),
+                             daemon=True).start()
+    
+    def start_unix_listener(self):
+        """
+        Abre o socket Unix do transporte local (aceito em um thread próprio)
+        e o segmento de teste usado pelos clientes para confirmar que estão
+        na mesma máquina
+        """
+        if os.path.exists(self.unix_path):
+            # Socket deixado por uma execução anterior que não encerrou limpo
+            os.unlink(self.unix_path)
+        self.unix_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.unix_socket.bind(self.unix_path)
+        self.unix_socket.listen(self.backlog)
+        self.probe = SharedMemory(create=True, size=16)
+        self.probe.buf[:16] = os.urandom(16)
+        
+        def accept():
+            try:
+                self._accept_loop(self.unix_socket)
+            except OSError:
+                # Socket fechado no encerramento
+                pass
+        
+        threading.Thread(target=accept, daemon=True).start()
+        print(f"[SERVIDOR] Transporte local em {self.unix_path}")
     
     def start(self):
-        """Inicia o servidor e aguarda conexões"""
+        """Inicia o servidor e atende cada conexão em um thread"""
         self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         
         try:
+            self.start_pool()
+            parallelism = self.parallelism()
+            print(f"[SERVIDOR] Orçamento de {parallelism['cores']} núcleo(s): BLAS com "
+                  f"{parallelism['blas_threads']} thread(s), pools com {parallelism['workers']} "
+                  f"trabalhador(es) (processos com {parallelism['worker_blas_threads']} e threads com "
+                  f"{parallelism['thread_blas_threads']} thread(s) de BLAS"
+                  f"{'' if threadpool_limits else ', sem threadpoolctl'})")
             self.server_socket.bind((self.host, self.port))
-            self.server_socket.listen(1)
-            print(f"[SERVIDOR] Aguardando conexão em {self.host}:{self.port}")
+            self.server_socket.listen(self.backlog)
+            if self.unix_path:
+                self.start_unix_listener()
+            if self.metrics_port:
+                start_http_server(self.metrics, self.host, self.metrics_port)
+                print(f"[SERVIDOR] Métricas em http://{self.host}:{self.metrics_port}/metrics")
+            print(f"[SERVIDOR] Aguardando conexões em {self.host}:{self.port} "
+                  f"(até {self.max_jobs} cálculos simultâneos)")
+            print(f"{READY_LINE} {self.host}:{self.port}", flush=True)
             
-            while True:
-                client_socket, address = self.server_socket.accept()
-                print(f"[SERVIDOR] Conexão estabelecida com {address}")
-                
-                # Aumenta buffer para transferências grandes
-                client_socket.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 1024 * 1024)
-                client_socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1024 * 1024)
-                
-                try:
-                    # Recebe tamanho dos dados
-                    size_bytes = client_socket.recv(8)
-                    data_size = int.from_bytes(size_bytes, byteorder='big')
-                    
-                    # Recebe dados em chunks
-                    data = b''
-                    remaining = data_size
-                    while remaining > 0:
-                        chunk = client_socket.recv(min(65536, remaining))
-                        if not chunk:
-                            break
-                        data += chunk
-                        remaining -= len(chunk)
-                    
-                    # Desserializa os dados
-                    submatrix_a, matrix_b = pickle.loads(data)
-                    print(f"[SERVIDOR] Recebido: submatriz A {submatrix_a.shape}, matriz B {matrix_b.shape}")
-                    
-                    # Realiza multiplicação paralela
-                    result = self.parallel_multiplication(submatrix_a, matrix_b)
-                    print(f"[SERVIDOR] Multiplicação concluída. Resultado: {result.shape}")
-                    
-                    # Serializa resultado
-                    result_data = pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL)
-                    result_size = len(result_data)
-                    
-                    # Envia tamanho do resultado
-                    client_socket.sendall(result_size.to_bytes(8, byteorder='big'))
-                    
-                    # Envia resultado em chunks
-                    chunk_size = 65536
-                    for i in range(0, result_size, chunk_size):
-                        client_socket.sendall(result_data[i:i+chunk_size])
-                    
-                    print("[SERVIDOR] Resultado enviado ao cliente")
-                    
-                except Exception as e:
-                    print(f"[SERVIDOR] Erro ao processar dados: {e}")
-                finally:
-                    client_socket.close()
+            self._accept_loop(self.server_socket)
                     
         except KeyboardInterrupt:
             print("\n[SERVIDOR] Encerrando servidor...")
         except Exception as e:
             print(f"[SERVIDOR] Erro: {e}")
         finally:
-            if self.server_socket:
-                self.server_socket.close()
+            self.shutdown()
 
 def main():
     """Função principal para iniciar o servidor"""
@@ -109,8 +1065,18 @@ def main():
     port = 5000
     if len(sys.argv) > 1:
         port = int(sys.argv[1])
+    engine = sys.argv[2] if len(sys.argv) > 2 else 'auto'
+    # Porta opcional das métricas no formato do Prometheus
+    metrics_port = int(sys.argv[3]) if len(sys.argv) > 3 else None
+    # Trabalhadores dos pools e endereço de escuta (definidos pelo run_system)
+    num_workers = int(os.environ.get('MATRIX_SERVER_WORKERS', 0)) or None
+    host = os.environ.get('MATRIX_SERVER_HOST') or 'localhost'
+    
+    # SIGTERM (enviado pelo run_system) também passa pelo encerramento limpo
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
     
-    server = MatrixServer(port=port)
+    server = MatrixServer(host=host, port=port, engine=engine, metrics_port=metrics_port,
+                          num_workers=num_workers)
     server.start()
 
 if __name__ == "__main__":
@@ -1,7 +1,31 @@
-
-import subprocess
 import sys
 import time
+import traceback
+from contextlib import contextmanager
+from run_system import iniciar_servidor, aguardar_servidor, encerrar_servidores
+
+
+def verificar(descricao, condicao):
+    """Mostra o resultado de uma verificação e o retorna"""
+    print(f"  {'✓' if condicao else '✗'} {descricao}")
+    return bool(condicao)
+
+
+@contextmanager
+def servidores_teste(portas, **opcoes):
+    """
+    Inicia um servidor por porta (opcoes vão para iniciar_servidor), espera
+    todos ficarem prontos e os encerra ao sair do bloco
+    """
+    processos = [iniciar_servidor(port, **opcoes) for port in portas]
+    try:
+        for proc, port in zip(processos, portas):
+            if not aguardar_servidor(proc, port):
+                raise RuntimeError(f"Servidor da porta {port} não ficou pronto")
+        yield processos
+    finally:
+        encerrar_servidores(processos)
+
 
 def teste_rapido():
     """Executa teste rápido do sistema"""
@@ -16,23 +40,18 @@ def teste_rapido():
         # Inicia 2 servidores
         print("\n[1/4] Iniciando servidores...")
         
+        inicio = time.perf_counter()
         for i in range(2):
+            processos_servidores.append(iniciar_servidor(5000 + i))
+        
+        # Espera cada servidor avisar que já aceita conexões
+        for i, proc in enumerate(processos_servidores):
             port = 5000 + i
-            if sys.platform == 'win32':
-                proc = subprocess.Popen(
-                    [sys.executable, 'Server.py', str(port)],
-                    creationflags=subprocess.CREATE_NEW_CONSOLE
-                )
+            if aguardar_servidor(proc, port):
+                print(f"  ✓ Servidor {i+1} pronto (porta {port}, "
+                      f"{(time.perf_counter() - inicio) * 1000:.0f} ms)")
             else:
-                proc = subprocess.Popen(
-                    [sys.executable, 'Server.py', str(port)],
-                    stdout=subprocess.DEVNULL,
-                    stderr=subprocess.DEVNULL
-                )
-            processos_servidores.append(proc)
-            print(f"  ✓ Servidor {i+1} iniciado (porta {port})")
-        
-        time.sleep(2)
+                print(f"  ✗ Servidor {i+1} não ficou pronto (porta {port})")
         
         # Testa importações
         print("\n[2/4] Verificando dependências...")
@@ -110,7 +129,7 @@ def teste_rapido():
                 print(f"     (overhead de comunicação > ganho paralelo)")
             
             print("\n  Próximos passos:")
-            print("  1. Execute 'python Client.py' para usar o sistema completo")
+            print("  1. Execute 'python client.py' para usar o sistema completo")
             print("  2. No benchmark, teste tamanhos: 10,50,100,200,400,800")
             print("  3. Compare serial vs distribuído nos gráficos!")
             print("  4. Prepare sua apresentação!")
@@ -120,7 +139,7 @@ def teste_rapido():
             print("="*70)
         
     except FileNotFoundError:
-        print("\n❌ Erro: Arquivos Server.py ou Client.py não encontrados")
+        print("\n❌ Erro: Arquivos server.py ou client.py não encontrados")
         print("   Certifique-se de que todos os arquivos estão no mesmo diretório")
     
     except Exception as e:
@@ -144,5 +163,1108 @@ def teste_rapido():
         print("="*70 + "\n")
 
 
+def teste_distribuicao_concorrente():
+    """Shards enviados a todos os servidores ao mesmo tempo ou um por vez"""
+    print("\n[DISTRIBUIÇÃO] 3 servidores, envio concorrente e sequencial")
+    portas = [5010, 5011, 5012]
+    with servidores_teste(portas):
+        from client import MatrixClient
+        import numpy as np
+        
+        client = MatrixClient([('localhost', port) for port in portas], timeout=30)
+        rng = np.random.default_rng(1)
+        # Linhas que não se dividem igualmente entre os servidores
+        A = rng.integers(-50, 50, (101, 40))
+        B = rng.integers(-50, 50, (40, 30))
+        ok = True
+        for concurrent in (True, False):
+            C, _ = client.distribute_multiplication(A, B, show_details=False, concurrent=concurrent)
+            ok &= verificar(f"concurrent={concurrent}", np.array_equal(C, A @ B))
+        C, _ = client.distribute_multiplication(A[:2], B, show_details=False)
+        ok &= verificar("menos linhas que servidores", np.array_equal(C, A[:2] @ B))
+        client.close()
+        return ok
+
+
+def teste_pool_persistente():
+    """Pool de processos criado uma vez e reutilizado; A, B e C em memória compartilhada"""
+    print("\n[POOL] Pool persistente do servidor (motor 'tiles')")
+    import glob
+    from server import MatrixServer
+    import numpy as np
+    
+    servidor = MatrixServer(port=0, num_workers=2, engine='tiles', unix_socket=False)
+    # Segmentos criados pelo SharedMemory (os semáforos do pool não contam)
+    segmentos_antes = set(glob.glob('/dev/shm/psm_*'))
+    try:
+        rng = np.random.default_rng(2)
+        ok = True
+        pools = []
+        for rodada in range(3):
+            A = rng.integers(-9, 9, (60 + rodada, 50))
+            B = rng.integers(-9, 9, (50, 40))
+            C, motor = servidor.compute(A, B)
+            pools.append(servidor.pool)
+            ok &= verificar(f"rodada {rodada + 1}: motor {motor}", np.array_equal(C, A @ B))
+        ok &= verificar("o mesmo pool atende todas as rodadas",
+                        pools[0] is not None and all(pool is pools[0] for pool in pools))
+        ok &= verificar("nenhum segmento compartilhado esquecido",
+                        not set(glob.glob('/dev/shm/psm_*')) - segmentos_antes)
+        return ok
+    finally:
+        servidor.shutdown()
+
+
+def teste_motores():
+    """Motores de cálculo do servidor comparados com A @ B e a escolha automática"""
+    print("\n[MOTORES] blas, tiles e threads")
+    from server import MatrixServer, block_ranges
+    import numpy as np
+    
+    servidor = MatrixServer(port=0, num_workers=2, unix_socket=False)
+    try:
+        rng = np.random.default_rng(3)
+        operandos = {
+            'int64': (rng.integers(-9, 9, (90, 70)), rng.integers(-9, 9, (70, 50))),
+            'float64': (rng.random((90, 70)), rng.random((70, 50))),
+        }
+        ok = True
+        for engine in ('blas', 'tiles', 'threads'):
+            for tipo, (A, B) in operandos.items():
+                C, usado = servidor.compute(A, B, engine)
+                ok &= verificar(f"{engine} com {tipo}", usado == engine and np.allclose(C, A @ B)
+                                and C.dtype == (A @ B).dtype)
+        
+        A, B = rng.integers(-9, 9, (600, 400)), rng.integers(-9, 9, (400, 300))
+        ok &= verificar("auto: produto pequeno vai ao BLAS",
+                        servidor.choose_engine(*operandos['int64']) == 'blas')
+        ok &= verificar("auto: produto inteiro grande vai aos threads",
+                        servidor.choose_engine(A, B) == 'threads')
+        ok &= verificar("auto: ponto flutuante vai ao BLAS",
+                        servidor.choose_engine(A.astype(float), B.astype(float)) == 'blas')
+        
+        blocos = block_ranges(1000, 300, 200, 8, 4)
+        ok &= verificar(f"block_ranges cobre as linhas em {len(blocos)} blocos",
+                        len(blocos) >= 4 and blocos[0][0] == 0 and blocos[-1][1] == 1000
+                        and all(a[1] == b[0] for a, b in zip(blocos, blocos[1:])))
+        return ok
+    finally:
+        servidor.shutdown()
+
+
+def teste_protocolo():
+    """Ida e volta de mensagens do protocolo binário por um par de sockets"""
+    print("\n[PROTOCOLO] Metadados JSON e buffers crus")
+    import socket
+    from protocol import Connection, ProtocolError
+    import numpy as np
+    
+    rng = np.random.default_rng(4)
+    arrays = [rng.integers(-100, 100, (30, 20)),
+              np.asfortranarray(rng.random((12, 7)).astype(np.float32)),
+              (rng.random((3, 4)) + 1j).astype(np.complex128),
+              rng.random((5, 5)) > 0.5,
+              np.zeros((0, 5))]
+    lado_a, lado_b = socket.socketpair()
+    envio, recebimento = Connection(lado_a), Connection(lado_b)
+    try:
+        ok = True
+        envio.send({'op': 'teste', 'valor': 7}, arrays)
+        meta, recebidos = recebimento.recv()
+        ok &= verificar("metadados", meta['op'] == 'teste' and meta['valor'] == 7)
+        for original, recebido in zip(arrays, recebidos):
+            ok &= verificar(f"{original.dtype} {original.shape}",
+                            recebido.dtype == original.dtype and np.array_equal(recebido, original))
+        ok &= verificar("ordem Fortran preservada", recebidos[1].flags.f_contiguous)
+        
+        destino = np.empty((30, 20), dtype=np.int64)
+        envio.send({'op': 'teste'}, [arrays[0]])
+        _, (recebido,) = recebimento.recv(into=lambda meta, index, dtype, shape: destino)
+        ok &= verificar("recebido direto no array de destino",
+                        recebido is destino and np.array_equal(destino, arrays[0]))
+        
+        try:
+            envio.send({'op': 'teste'}, [np.array([object()])])
+            ok &= verificar("array de objetos recusado no envio", False)
+        except ProtocolError:
+            ok &= verificar("array de objetos recusado no envio", True)
+        lado_a.sendall(b'XXXX' + bytes(8))
+        try:
+            recebimento.recv()
+            ok &= verificar("mensagem de outro protocolo recusada", False)
+        except ProtocolError:
+            ok &= verificar("mensagem de outro protocolo recusada", True)
+        return ok
+    finally:
+        envio.close()
+        recebimento.close()
+
+
+def teste_clientes_simultaneos():
+    """Um servidor atende vários clientes ao mesmo tempo, mesmo com uma conexão parada"""
+    print("\n[CONCORRÊNCIA] 6 clientes em um servidor")
+    import socket
+    import threading
+    porta = 5050
+    with servidores_teste([porta]):
+        from client import MatrixClient
+        import numpy as np
+        
+        # Conexão aberta que nunca envia nada: não pode bloquear as demais
+        parada = socket.create_connection(('localhost', porta))
+        rng = np.random.default_rng(5)
+        pares = [(rng.integers(-9, 9, (80, 60)), rng.integers(-9, 9, (60, 40))) for _ in range(6)]
+        resultados = [None] * len(pares)
+        
+        def cliente(i):
+            client = MatrixClient([('localhost', porta)], timeout=30)
+            A, B = pares[i]
+            C, _ = client.distribute_multiplication(A, B, show_details=False)
+            resultados[i] = np.array_equal(C, A @ B)
+            client.close()
+        
+        threads = [threading.Thread(target=cliente, args=(i,)) for i in range(len(pares))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(timeout=60)
+        parada.close()
+        return verificar(f"{sum(bool(r) for r in resultados)}/{len(pares)} resultados corretos",
+                         all(resultados))
+
+
+def teste_pool_de_conexoes():
+    """Conexões persistentes reutilizadas entre requisições e refeitas após reinício"""
+    print("\n[CONEXÕES] Pool de conexões do cliente")
+    porta = 5060
+    with servidores_teste([porta]) as processos:
+        from client import ConnectionPool
+        
+        endereco = ('localhost', porta)
+        pool = ConnectionPool(health_check_after=0)
+        primeira = pool.call(endereco, lambda conn: conn)
+        segunda = pool.call(endereco, lambda conn: conn)
+        ok = verificar("a mesma conexão atende requisições seguidas", primeira is segunda)
+        meta, _ = pool.request(endereco, {'op': 'ping'})
+        ok &= verificar("várias requisições por conexão", meta.get('status') == 'ok')
+        
+        processos[0].terminate()
+        processos[0].wait(timeout=5)
+        processos[0] = iniciar_servidor(porta)
+        aguardar_servidor(processos[0], porta)
+        meta, _ = pool.request(endereco, {'op': 'ping'})
+        terceira = pool.call(endereco, lambda conn: conn)
+        ok &= verificar("conexão refeita após o servidor reiniciar",
+                        meta.get('status') == 'ok' and terceira is not primeira)
+        pool.close()
+        return ok
+
+
+def teste_cache():
+    """Cache de B no servidor: descarte da menos usada (LRU) e B enviada uma vez"""
+    print("\n[CACHE] Cache de B por hash do conteúdo")
+    from server import MatrixCache
+    import numpy as np
+    
+    matrizes = {nome: np.full((10, 10), i, dtype=np.int64) for i, nome in enumerate('abcd')}
+    cache = MatrixCache(max_bytes=3 * matrizes['a'].nbytes)
+    for nome in 'abc':
+        cache.put(nome, matrizes[nome])
+    cache.get('a')
+    cache.put('d', matrizes['d'])
+    ok = verificar("a menos usada (b) é descartada", cache.get('b') is None
+                   and all(cache.get(nome) is not None for nome in 'acd'))
+    stats = cache.stats()
+    ok &= verificar(f"contadores ({stats['hits']} acertos, {stats['misses']} falhas)",
+                    (stats['hits'], stats['misses'], stats['entries']) == (4, 1, 3)
+                    and stats['bytes'] <= cache.max_bytes)
+    ok &= verificar("matriz maior que o orçamento não entra",
+                    cache.put('e', np.zeros(1000)) is None and cache.get('e') is None)
+    
+    porta = 5070
+    with servidores_teste([porta]):
+        from client import MatrixClient
+        
+        client = MatrixClient([('localhost', porta)], timeout=30)
+        rng = np.random.default_rng(7)
+        B = rng.integers(-9, 9, (200, 200))
+        enviados = []
+        for rodada in range(2):
+            A = rng.integers(-9, 9, (20, 200))
+            antes = client.connections.totals()['bytes_sent']
+            C, _ = client.distribute_multiplication(A, B, show_details=False)
+            enviados.append(client.connections.totals()['bytes_sent'] - antes)
+            ok &= verificar(f"rodada {rodada + 1} correta", np.array_equal(C, A @ B))
+        ok &= verificar(f"B só vai na primeira rodada ({enviados[0]} e {enviados[1]} bytes)",
+                        enviados[1] < enviados[0] - B.size)
+        ok &= verificar("acerto no cache do servidor",
+                        client.server_stats(('localhost', porta))['cache']['hits'] >= 1)
+        client.close()
+    return ok
+
+
+def teste_grade_2d():
+    """Grade p x q: escolhida pelos bytes enviados e comparada com A @ B"""
+    print("\n[GRADE] Particionamento 2D em 4 servidores")
+    portas = [5080, 5081, 5082, 5083]
+    with servidores_teste(portas):
+        from client import MatrixClient
+        import numpy as np
+        
+        servidores = [('localhost', port) for port in portas]
+        client = MatrixClient(servidores, timeout=30)
+        rng = np.random.default_rng(8)
+        # B larga: enviar B inteira a cada servidor custa mais que repetir A
+        A = rng.integers(-9, 9, (40, 300))
+        B = rng.integers(-9, 9, (300, 900))
+        ok = verificar("B larga: grade com q > 1", client.choose_grid(A, B, 4)[1] > 1)
+        ok &= verificar("A alta: só linhas (q = 1)", client.choose_grid(B.T, A.T, 4) == (4, 1))
+        ok &= verificar("B no cache conta zero na grade em que está",
+                        client.choose_grid(A, B, 4, cached_q=1) == (4, 1))
+        
+        p, q, _ = client.static_grid(A, B, servidores)
+        ok &= verificar(f"primeira chamada (B fora do cache): grade {p}x{q}", q > 1)
+        enviados = []
+        for rodada in range(2):
+            antes = client.connections.totals()['bytes_sent']
+            C, _ = client.distribute_multiplication(A, B, show_details=False)
+            enviados.append(client.connections.totals()['bytes_sent'] - antes)
+            ok &= verificar(f"rodada {rodada + 1} correta", np.array_equal(C, A @ B))
+        _, q_cache, blocos = client.static_grid(A, B, servidores)
+        ok &= verificar("segunda chamada mantém a grade com B no cache",
+                        q_cache == q and blocos is not None and enviados[1] < enviados[0] / 2)
+        
+        C, _ = client.distribute_multiplication(A, B, show_details=False, partition='rows')
+        ok &= verificar("partition='rows'", np.array_equal(C, A @ B))
+        client.close()
+        return ok
+
+
+def teste_agendamento_dinamico():
+    """Fila de blocos de linhas (guided self-scheduling) e o agendamento 'dynamic'"""
+    print("\n[DINÂMICO] Blocos sob demanda")
+    from client import GuidedScheduler
+    import numpy as np
+    
+    fila = GuidedScheduler(1000, 2, min_chunk=16)
+    blocos = []
+    while (bloco := fila.next_chunk(len(blocos) % 2)) is not None:
+        blocos.append(bloco)
+        fila.record(len(blocos) % 2, bloco[1] - bloco[0], 0.01 if len(blocos) % 2 else 0.03)
+    ok = verificar(f"{len(blocos)} blocos cobrem as 1000 linhas sem sobreposição",
+                   blocos[0][0] == 0 and blocos[-1][1] == 1000
+                   and all(a[1] == b[0] for a, b in zip(blocos, blocos[1:])))
+    tamanhos = [fim - inicio for inicio, fim in blocos]
+    ok &= verificar("blocos diminuem conforme resta menos trabalho",
+                    tamanhos[0] > tamanhos[-2] and min(tamanhos[:-1]) >= 16)
+    fila = GuidedScheduler(100, 2)
+    primeiro = fila.next_chunk(0)
+    fila.requeue(primeiro)
+    ok &= verificar("bloco devolvido é entregue de novo", fila.next_chunk(1) == primeiro)
+    
+    portas = [5090, 5091]
+    with servidores_teste(portas):
+        from client import MatrixClient
+        
+        client = MatrixClient([('localhost', port) for port in portas], timeout=30)
+        client.min_chunk_rows = 8
+        rng = np.random.default_rng(9)
+        A = rng.integers(-9, 9, (203, 60))
+        B = rng.integers(-9, 9, (60, 50))
+        C, _ = client.distribute_multiplication(A, B, show_details=False, schedule='dynamic')
+        ok &= verificar("dynamic com inteiros", np.array_equal(C, A @ B))
+        F, G = rng.random((64, 48)), rng.random((48, 32))
+        C, _ = client.distribute_multiplication(F, G, show_details=False, schedule='dynamic')
+        ok &= verificar("dynamic com ponto flutuante", np.allclose(C, F @ G))
+        client.close()
+    return ok
+
+
+def teste_modelo_de_custo():
+    """Modelo de custo: bytes no tipo enviado, servidor morto e modo automático"""
+    print("\n[CUSTO] Escolha entre execução local e distribuída")
+    from client import MatrixClient, CostModel
+    import numpy as np
+    
+    rng = np.random.default_rng(10)
+    A = rng.integers(-10, 10, (200, 200))
+    B = rng.integers(-10, 10, (200, 200))
+    modelo = CostModel(latency=1e-3, bandwidth=1e8, local_flops=1e8, server_flops=[1e10, 0.0])
+    estreito = CostModel.wire_itemsizes(A, B)
+    ok = verificar(f"bytes por elemento no tipo enviado {estreito}",
+                   estreito[:2] == (1, 1) and estreito[2] < A.itemsize)
+    ok &= verificar("estimativa conta o tipo estreito",
+                    modelo.estimate(A, B, 1) < modelo.estimate(A, B, 1, itemsizes=(8, 8, 8)))
+    ok &= verificar("B no cache diminui a estimativa",
+                    modelo.estimate(A, B, 1, b_cached=True) < modelo.estimate(A, B, 1))
+    ok &= verificar("servidor que não respondeu nunca é escolhido",
+                    modelo.estimate(A, B, 2) == float('inf'))
+    
+    portas = [5100, 5101]
+    with servidores_teste(portas):
+        servidores = [('localhost', port) for port in portas]
+        client = MatrixClient(servidores, timeout=30)
+        client.cost_model = modelo
+        escolhidos, _ = client.plan(A, B)
+        ok &= verificar("plano usa só o servidor vivo", escolhidos == [servidores[0]])
+        pequena = np.ones((2, 2), dtype=np.int64)
+        ok &= verificar("matriz pequena executa localmente", client.plan(pequena, pequena)[0] == [])
+        
+        client.cost_model = None
+        C, _ = client.multiply(A, B)
+        ok &= verificar(f"modo automático correto ({len(client.last_plan['servers'])} servidor(es))",
+                        np.array_equal(C, A @ B))
+        ok &= verificar("calibração mede os dois servidores",
+                        len(client.cost_model.server_flops) == 2
+                        and min(client.cost_model.server_flops) > 0)
+        client.close()
+    return ok
+
+
+def teste_compressao():
+    """Tipos inteiros compactos e compressão zlib/lzma nas mensagens"""
+    print("\n[COMPRESSÃO] Tipos compactos e compressão")
+    import socket
+    from protocol import Connection, ProtocolError, narrow_array, wire_dtype
+    import numpy as np
+    
+    rng = np.random.default_rng(11)
+    pequenos = rng.integers(-10, 10, (50, 40))
+    ok = verificar("int64 em [-10, 10) vai como int8",
+                   narrow_array(pequenos).dtype == np.int8 and wire_dtype(pequenos) == np.int8
+                   and np.array_equal(narrow_array(pequenos), pequenos))
+    ok &= verificar("ponto flutuante e inteiros largos não mudam",
+                    narrow_array(rng.random(5)).dtype == np.float64
+                    and narrow_array(np.array([2 ** 40])).dtype == np.int64)
+    
+    repetitivo = np.zeros((200, 200))
+    for compression in ('zlib', 'lzma'):
+        lado_a, lado_b = socket.socketpair()
+        envio, recebimento = Connection(lado_a, compression=compression), Connection(lado_b)
+        try:
+            envio.send({'op': 'teste'}, [repetitivo, pequenos])
+            meta, recebidos = recebimento.recv()
+            ok &= verificar(f"{compression}: ida e volta ({envio.stats['bytes_sent']} bytes)",
+                            meta.get('compression') == compression
+                            and np.array_equal(recebidos[0], repetitivo)
+                            and np.array_equal(recebidos[1], pequenos)
+                            and envio.stats['bytes_sent'] < repetitivo.nbytes / 10
+                            and recebimento.stats['bytes_received'] == envio.stats['bytes_sent'])
+        finally:
+            envio.close()
+            recebimento.close()
+    lado_a, lado_b = socket.socketpair()
+    try:
+        Connection(lado_a, compression='rar').send({'op': 'teste'}, [pequenos])
+        ok &= verificar("compressão desconhecida é rejeitada", False)
+    except ProtocolError:
+        ok &= verificar("compressão desconhecida é rejeitada", True)
+    finally:
+        lado_a.close()
+        lado_b.close()
+    
+    portas = [5110, 5111]
+    with servidores_teste(portas):
+        from client import MatrixClient
+        
+        A = rng.integers(-9, 9, (80, 60))
+        B = rng.integers(-9, 9, (60, 70))
+        for compression in ('zlib', 'lzma'):
+            client = MatrixClient([('localhost', port) for port in portas], timeout=30,
+                                  compression=compression)
+            C, _ = client.distribute_multiplication(A, B, show_details=False)
+            ok &= verificar(f"cliente com {compression}", np.array_equal(C, A @ B)
+                            and C.dtype == (A @ B).dtype)
+            client.close()
+        client = MatrixClient([('localhost', port) for port in portas], timeout=30,
+                              compact_dtypes=False)
+        C, _ = client.distribute_multiplication(A, B, show_details=False)
+        ok &= verificar("sem tipos compactos", np.array_equal(C, A @ B))
+        client.close()
+    return ok
+
+
+def teste_resultado_em_blocos():
+    """Resultado recebido em blocos, escrito direto no array de saída"""
+    print("\n[STREAMING] Resultado em blocos em out pré-alocado")
+    portas = [5120, 5121]
+    with servidores_teste(portas):
+        from client import MatrixClient
+        import numpy as np
+        
+        client = MatrixClient([('localhost', port) for port in portas], timeout=30)
+        client.stream_block_bytes = 1024
+        rng = np.random.default_rng(12)
+        A = rng.integers(-9, 9, (150, 80))
+        B = rng.integers(-9, 9, (80, 60))
+        ok = True
+        for schedule in ('static', 'dynamic'):
+            out = np.empty((150, 60), dtype=np.int64)
+            C, _ = client.distribute_multiplication(A, B, show_details=False, schedule=schedule,
+                                                    out=out)
+            ok &= verificar(f"{schedule}: blocos de 1 KB escritos em out",
+                            C is out and np.array_equal(out, A @ B))
+        out = np.zeros((150, 60))
+        C, _ = client.distribute_multiplication(A, B, show_details=False, out=out)
+        ok &= verificar("out de outro tipo recebe os blocos convertidos",
+                        C is out and np.array_equal(out, A @ B))
+        try:
+            client.distribute_multiplication(A, B, show_details=False, out=np.empty((60, 150)))
+            ok &= verificar("out com shape errado é rejeitado", False)
+        except ValueError:
+            ok &= verificar("out com shape errado é rejeitado", True)
+        client.close()
+        return ok
+
+
+def teste_fora_da_memoria():
+    """Modo 'tiled' com matrizes em arquivos .npy (np.memmap)"""
+    print("\n[FORA DA MEMÓRIA] Blocos limitados e arquivos mapeados")
+    import os
+    import tempfile
+    from client import MatrixClient
+    import numpy as np
+    
+    client = MatrixClient([('localhost', 5130)])
+    A, B = np.zeros((100, 50)), np.zeros((50, 80))
+    blocos = client.plan_tiles(A, B, 16 * 1024)
+    cobertura = np.zeros((100, 80), dtype=int)
+    for r0, r1, c0, c1 in blocos:
+        cobertura[r0:r1, c0:c1] += 1
+    ok = verificar(f"{len(blocos)} blocos cobrem C uma vez cada", (cobertura == 1).all())
+    ok &= verificar("cada bloco cabe no orçamento",
+                    all(((r1 - r0) * 50 + 50 * (c1 - c0) + (r1 - r0) * (c1 - c0)) * 8 <= 16 * 1024
+                        for r0, r1, c0, c1 in blocos))
+    ok &= verificar("sem linhas não há blocos", client.plan_tiles(np.zeros((0, 5)), B[:5], 1024) == [])
+    
+    portas = [5130, 5131]
+    with servidores_teste(portas), tempfile.TemporaryDirectory() as pasta:
+        client = MatrixClient([('localhost', port) for port in portas], timeout=30)
+        rng = np.random.default_rng(13)
+        A = rng.integers(-9, 9, (120, 70))
+        B = rng.integers(-9, 9, (70, 90))
+        caminhos = {nome: os.path.join(pasta, f"{nome}.npy") for nome in 'ABC'}
+        np.save(caminhos['A'], A)
+        np.save(caminhos['B'], B)
+        C, _ = client.distribute_multiplication(caminhos['A'], caminhos['B'], show_details=False,
+                                                out=caminhos['C'], tile_bytes=16 * 1024)
+        ok &= verificar("arquivos .npy: resultado gravado em C.npy",
+                        isinstance(C, np.memmap) and np.array_equal(np.load(caminhos['C']), A @ B))
+        del C
+        C, _ = client.distribute_multiplication(A, B, show_details=False, schedule='tiled',
+                                                tile_bytes=8 * 1024)
+        ok &= verificar("arrays na memória com schedule='tiled'", np.array_equal(C, A @ B))
+        C, _ = client.distribute_multiplication(np.zeros((0, 70)), B, show_details=False,
+                                                schedule='tiled')
+        ok &= verificar("A sem linhas", C.shape == (0, 90))
+        client.close()
+    return ok
+
+
+def teste_failover():
+    """Cópias especulativas de shards lentos e shards refeitos após uma falha"""
+    print("\n[FAILOVER] Servidores lentos e servidores que falham")
+    from client import MatrixClient
+    import numpy as np
+    
+    client = MatrixClient([('localhost', 5140), ('localhost', 5141)])
+    tentativas = []
+    
+    def lento(i, k, attempt):
+        # O servidor 1 só responde se a tentativa for cancelada
+        tentativas.append((i, k, attempt.speculative))
+        limite = time.monotonic() + 10
+        while k == 1 and not attempt.cancelled and time.monotonic() < limite:
+            time.sleep(0.01)
+        time.sleep(0.02)
+        return k == 0
+    
+    inicio = time.monotonic()
+    tempos = client._run_with_failover(client.servers, 2, lento, show_details=False)
+    ok = verificar(f"shard lento refeito por cópia especulativa ({tempos[1]:.2f}s)",
+                   (1, 0, True) in tentativas and time.monotonic() - inicio < 5)
+    
+    def falha(i, k, attempt):
+        tentativas.append((i, k, attempt.speculative))
+        return k == 0
+    
+    tentativas.clear()
+    client._run_with_failover(client.servers, 2, falha, show_details=False)
+    ok &= verificar("shard do servidor que falhou é refeito no outro", (1, 0, False) in tentativas)
+    
+    portas = [5140, 5141]
+    with servidores_teste(portas) as processos:
+        client = MatrixClient([('localhost', port) for port in portas], timeout=10)
+        rng = np.random.default_rng(14)
+        A = rng.integers(-50, 50, (100, 60))
+        B = rng.integers(-50, 50, (60, 40))
+        C, _ = client.distribute_multiplication(A, B, show_details=False)
+        ok &= verificar("com os dois servidores", np.array_equal(C, A @ B))
+        
+        processos[1].terminate()
+        processos[1].wait(timeout=5)
+        for schedule in ('static', 'dynamic'):
+            C, _ = client.distribute_multiplication(A, B, show_details=False, schedule=schedule)
+            ok &= verificar(f"{schedule} com um servidor encerrado", np.array_equal(C, A @ B))
+        client.close()
+    return ok
+
+
+def teste_pipeline():
+    """Servidor calcula os blocos de A enquanto os próximos ainda chegam"""
+    print("\n[PIPELINE] Recepção e cálculo sobrepostos")
+    portas = [5150, 5151]
+    with servidores_teste(portas):
+        from client import MatrixClient
+        import numpy as np
+        
+        servidores = [('localhost', port) for port in portas]
+        client = MatrixClient(servidores, timeout=30)
+        client.pipeline_min_bytes = 1
+        client.stream_block_bytes = 2048
+        rng = np.random.default_rng(15)
+        A = rng.integers(-9, 9, (160, 90))
+        B = rng.integers(-9, 9, (90, 50))
+        ok = True
+        for rodada in range(2):
+            C, _ = client.distribute_multiplication(A, B, show_details=False)
+            ok &= verificar(f"inteiros, rodada {rodada + 1} (B {'no cache' if rodada else 'enviada'})",
+                            np.array_equal(C, A @ B))
+        F, G = rng.random((70, 40)), rng.random((40, 30))
+        C, _ = client.distribute_multiplication(F, G, show_details=False, schedule='dynamic')
+        ok &= verificar("ponto flutuante, agendamento dinâmico", np.allclose(C, F @ G))
+        
+        contadores = client.server_stats(servidores[0])['metrics']['counters']
+        ok &= verificar("servidor atendeu em pipeline",
+                        contadores.get('requests_total[op=multiply_pipelined]', 0) >= 3)
+        client.close()
+        return ok
+
+
+def teste_lote():
+    """Muitos produtos pequenos em poucas mensagens"""
+    print("\n[LOTE] Pares pequenos independentes")
+    portas = [5160, 5161]
+    with servidores_teste(portas):
+        from client import MatrixClient
+        import numpy as np
+        
+        client = MatrixClient([('localhost', port) for port in portas], timeout=30)
+        client.batch_frame_bytes = 4096
+        rng = np.random.default_rng(16)
+        A = rng.integers(-9, 9, (200, 4, 5))
+        B = rng.integers(-9, 9, (200, 5, 3))
+        C, _ = client.batch_multiply(A, B)
+        ok = verificar("arrays 3D empilhados", C.shape == (200, 4, 3) and np.array_equal(C, A @ B))
+        
+        listas_a = [rng.random((2, 3)), rng.integers(0, 5, (4, 4)), rng.random((2, 3))]
+        listas_b = [rng.random((3, 2)), rng.integers(0, 5, (4, 1)), rng.random((3, 2))]
+        C, _ = client.batch_multiply(listas_a, listas_b)
+        ok &= verificar("listas com formatos diferentes mantêm a ordem",
+                        all(np.allclose(c, a @ b) for c, a, b in zip(C, listas_a, listas_b)))
+        C, _ = client.batch_multiply(np.zeros((0, 2, 2)), np.zeros((0, 2, 2)))
+        ok &= verificar("lote vazio", C.shape == (0, 2, 2))
+        try:
+            client.batch_multiply(A, B[:10])
+            ok &= verificar("listas de tamanhos diferentes são rejeitadas", False)
+        except ValueError:
+            ok &= verificar("listas de tamanhos diferentes são rejeitadas", True)
+        client.close()
+        return ok
+
+
+def teste_esparsas():
+    """Matrizes esparsas CSR/CSC: só os não-zeros trafegam"""
+    print("\n[ESPARSAS] Formato CSR na rede e kernels esparsos")
+    try:
+        from scipy import sparse
+    except ImportError:
+        print("  - SciPy não instalado; grupo ignorado")
+        return True
+    import socket
+    from protocol import Connection, pack_operands, unpack_operands
+    import numpy as np
+    
+    A = sparse.random(300, 200, density=0.02, format='csr', random_state=17)
+    B = sparse.random(200, 100, density=0.05, format='csc', random_state=18)
+    lado_a, lado_b = socket.socketpair()
+    envio, recebimento = Connection(lado_a), Connection(lado_b)
+    try:
+        specs, arrays = pack_operands([A, B, np.eye(3)])
+        envio.send({'op': 'teste', 'operands': specs}, arrays)
+        meta, recebidos = recebimento.recv()
+        A2, B2, I = unpack_operands(meta['operands'], recebidos)
+        ok = verificar("CSR, CSC e densa na mesma mensagem",
+                       A2.format == 'csr' and B2.format == 'csc' and (A2 != A).nnz == 0
+                       and (B2 != B).nnz == 0 and np.array_equal(I, np.eye(3)))
+        ok &= verificar("só os não-zeros são enviados",
+                        envio.stats['bytes_sent'] < A.shape[0] * A.shape[1] * A.dtype.itemsize / 10)
+    finally:
+        envio.close()
+        recebimento.close()
+    
+    portas = [5170, 5171]
+    with servidores_teste(portas):
+        from client import MatrixClient
+        
+        client = MatrixClient([('localhost', port) for port in portas], timeout=30)
+        ok &= verificar("divisão por não-zeros cobre as linhas",
+                        client.split_by_nnz(A, 2)[0][0] == 0 and client.split_by_nnz(A, 2)[-1][1] == 300)
+        C, _ = client.distribute_multiplication(A, B, show_details=False)
+        ok &= verificar("esparsa @ esparsa dá CSR", sparse.issparse(C) and C.format == 'csr'
+                        and np.allclose(C.toarray(), (A @ B).toarray()))
+        densa = np.random.default_rng(17).random((200, 20))
+        C, _ = client.distribute_multiplication(A, densa, show_details=False)
+        ok &= verificar("esparsa @ densa dá densa", not sparse.issparse(C) and np.allclose(C, A @ densa))
+        inteira = sparse.random(50, 40, density=0.1, format='csr', random_state=19,
+                                data_rvs=lambda n: np.arange(1, n + 1)).astype(np.int64)
+        C, _ = client.distribute_multiplication(inteira, inteira.T.tocsr(), show_details=False)
+        ok &= verificar("inteiros esparsos", np.array_equal(C.toarray(), (inteira @ inteira.T).toarray()))
+        client.close()
+    return ok
+
+
+def teste_benchmark():
+    """Benchmark não interativo: relatório por fase e comparação com referência"""
+    print("\n[BENCHMARK] Relatório e detecção de regressões")
+    import json
+    import os
+    import tempfile
+    import benchmark
+    
+    ok = verificar("resumo com percentis",
+                   benchmark.summarize([1, 2, 3, 4])['p50'] == 2.5 and benchmark.summarize([]) == {})
+    portas = [5180, 5181]
+    with servidores_teste(portas), tempfile.TemporaryDirectory() as pasta:
+        saida = os.path.join(pasta, 'relatorio.json')
+        argumentos = ['--servers'] + [f'localhost:{port}' for port in portas] + [
+            '--sizes', '8,16', '--repeats', '2', '--warmup', '0', '--serial']
+        codigo = benchmark.main(argumentos + ['--output', saida])
+        with open(saida) as f:
+            relatorio = json.load(f)
+        ok &= verificar("relatório com as fases de cada tamanho",
+                        codigo == 0 and [entry['size'] for entry in relatorio['results']] == [8, 16]
+                        and all(set(benchmark.PHASES) <= set(entry['phases'])
+                                and len(entry['runs']) == 2 and 'serial_ns' in entry
+                                for entry in relatorio['results']))
+        
+        # Referência 10x mais rápida: toda medida atual é uma regressão
+        for entry in relatorio['results']:
+            entry['total_ns'] = {key: value / 10 for key, value in entry['total_ns'].items()}
+        referencia = os.path.join(pasta, 'referencia.json')
+        with open(referencia, 'w') as f:
+            json.dump(relatorio, f)
+        codigo = benchmark.main(argumentos + ['--output', saida, '--baseline', referencia])
+        with open(saida) as f:
+            regressoes = json.load(f)['regressions']
+        ok &= verificar("regressão detectada contra referência mais rápida",
+                        codigo == 1 and len(regressoes) == 2)
+    return ok
+
+
+def teste_metricas():
+    """Contadores, histogramas e exposição no formato do Prometheus"""
+    print("\n[MÉTRICAS] Estatísticas do servidor")
+    from urllib.request import urlopen
+    from metrics import Metrics
+    import numpy as np
+    
+    metricas = Metrics(prefix='teste')
+    metricas.inc('requests_total', op='multiply')
+    metricas.inc('requests_total', 2, op='multiply')
+    metricas.set_counter('hits_total', 7)
+    metricas.set('active', 3)
+    for valor in (0.001, 0.002, 0.5):
+        metricas.observe('latency_seconds', valor)
+    foto = metricas.snapshot()
+    ok = verificar("snapshot com contadores, medidores e histogramas",
+                   foto['counters'] == {'hits_total': 7, 'requests_total[op=multiply]': 3}
+                   and foto['gauges'] == {'active': 3}
+                   and foto['histograms']['latency_seconds']['count'] == 3)
+    texto = metricas.render_prometheus()
+    ok &= verificar("texto do Prometheus",
+                    'teste_requests_total{op="multiply"} 3' in texto
+                    and '# TYPE teste_hits_total counter' in texto
+                    and '# TYPE teste_latency_seconds histogram' in texto
+                    and 'teste_latency_seconds_bucket{le="+Inf"} 3' in texto)
+    
+    with servidores_teste([5190], metrics_port=5199):
+        from client import MatrixClient
+        
+        client = MatrixClient([('localhost', 5190)], timeout=30)
+        A = np.arange(20).reshape(4, 5)
+        for _ in range(2):
+            client.distribute_multiplication(A, A.T, show_details=False)
+        stats = client.server_stats(('localhost', 5190))
+        contadores = stats['metrics']['counters']
+        ok &= verificar(f"server_stats: {contadores.get('requests_total[op=multiply]')} multiplicações",
+                        contadores.get('requests_total[op=multiply]', 0) >= 2
+                        and contadores.get('cache_hits_total', 0) >= 1
+                        and stats['cache']['entries'] >= 1)
+        client.close()
+        with urlopen('http://localhost:5199/metrics', timeout=10) as resposta:
+            texto = resposta.read().decode()
+        ok &= verificar("endpoint HTTP /metrics",
+                        '# TYPE matrix_server_cache_hits_total counter' in texto
+                        and 'matrix_server_requests_total{op="multiply"}' in texto)
+    return ok
+
+
+def teste_rastreamento():
+    """Spans do cliente e dos servidores na mesma linha do tempo"""
+    print("\n[TRACING] Rastreamento de requisições")
+    import json
+    import os
+    import tempfile
+    portas = [5200, 5201]
+    with servidores_teste(portas):
+        from client import MatrixClient
+        import numpy as np
+        
+        servidores = [('localhost', port) for port in portas]
+        A = np.arange(60).reshape(6, 10)
+        client = MatrixClient(servidores, timeout=30)
+        client.distribute_multiplication(A, A.T, show_details=False)
+        ok = verificar("desligado por padrão", client.last_trace is None)
+        client.close()
+        
+        client = MatrixClient(servidores, timeout=30, trace=True)
+        C, _ = client.distribute_multiplication(A, A.T, show_details=False)
+        spans = client.last_trace.spans()
+        nomes = {span['name'] for span in spans}
+        processos = {span['process'] for span in spans}
+        raiz = [span for span in spans if span['name'] == 'distribute_multiplication']
+        ok &= verificar(f"{len(spans)} spans de {len(processos)} processos",
+                        np.array_equal(C, A @ A.T) and 'shard' in nomes and len(processos) == 3
+                        and len(raiz) == 1 and all(span['trace_id'] == client.last_trace.trace_id
+                                                   for span in spans))
+        with tempfile.TemporaryDirectory() as pasta:
+            with open(client.last_trace.save(os.path.join(pasta, 'trace.json'))) as f:
+                eventos = json.load(f)['traceEvents']
+        ok &= verificar("exportado no formato do Chrome", any(e['name'] == 'shard' for e in eventos))
+        
+        try:
+            client.distribute_multiplication(A, A.T, show_details=False, schedule='inexistente')
+        except ValueError:
+            pass
+        falhou = client.last_trace
+        client.distribute_multiplication(A, A.T, show_details=False)
+        ok &= verificar("chamada que falhou não deixa a raiz para a próxima",
+                        client._trace_root is None
+                        and [span['name'] for span in falhou.spans()] == ['distribute_multiplication']
+                        and len(client.last_trace.spans()) > 1)
+        client.close()
+        return ok
+
+
+# Outro lado de uma conexão local: devolve cada array multiplicado por 2 e
+# informa o segmento pelo qual a mensagem recebida chegou
+ECO_MEMORIA_COMPARTILHADA = """
+import socket, sys
+from protocol import Connection
+conn = Connection(socket.socket(fileno=int(sys.argv[1])), shared_memory=True)
+conn.shared_memory.bind(sys.argv[2], 's')
+while (message := conn.recv()) is not None:
+    meta, arrays = message
+    conn.send({'status': 'ok', 'shm_recebido': meta.get('shm')}, [array * 2 for array in arrays])
+    del arrays, message
+conn.close()
+"""
+
+
+def teste_transporte_local():
+    """Socket Unix e memória compartilhada com servidores da mesma máquina"""
+    print("\n[TRANSPORTE LOCAL] Memória compartilhada e contagem de bytes")
+    import os
+    import socket
+    import subprocess
+    from protocol import Connection, narrow_array
+    import numpy as np
+    
+    rng = np.random.default_rng(21)
+    pequenos = rng.integers(-10, 10, (300, 200))
+    lado_a, lado_b = socket.socketpair()
+    envio, recebimento = Connection(lado_a), Connection(lado_b)
+    try:
+        envio.send({'op': 'teste'}, [narrow_array(pequenos)])
+        _, recebidos = recebimento.recv(into=lambda meta, index, dtype, shape: np.empty(shape))
+        ok = verificar(f"bytes recebidos = enviados no tipo estreito ({envio.stats['bytes_sent']})",
+                       recebimento.stats['bytes_received'] == envio.stats['bytes_sent']
+                       and envio.stats['bytes_sent'] < pequenos.nbytes / 4
+                       and np.array_equal(recebidos[0], pequenos))
+    finally:
+        envio.close()
+        recebimento.close()
+    
+    # Os arrays grandes vão pelo segmento de quem envia, não pelo socket. O
+    # outro lado roda em outro processo, como o servidor.
+    lado_a, lado_b = socket.socketpair()
+    prefixo = f"tx{os.getpid()}"
+    eco = subprocess.Popen([sys.executable, '-c', ECO_MEMORIA_COMPARTILHADA, str(lado_b.fileno()),
+                            prefixo], pass_fds=[lado_b.fileno()],
+                           cwd=os.path.dirname(os.path.abspath(__file__)))
+    lado_b.close()
+    conn = Connection(lado_a, shared_memory=True)
+    conn.shared_memory.bind(prefixo, 'c')
+    try:
+        grande = rng.random((300, 300))
+        for rodada in range(3):
+            conn.send({'op': 'teste'}, [grande, pequenos])
+            meta, recebidos = conn.recv()
+            ok &= verificar(f"memória compartilhada nos dois sentidos (rodada {rodada + 1})",
+                            str(meta.get('shm_recebido')).startswith(prefixo)
+                            and str(meta.get('shm')).startswith(prefixo)
+                            and np.array_equal(recebidos[0], grande * 2)
+                            and np.array_equal(recebidos[1], pequenos * 2))
+            del recebidos
+    finally:
+        conn.close()
+        eco.wait(timeout=10)
+    
+    portas = [5210, 5211]
+    with servidores_teste(portas):
+        from client import MatrixClient
+        
+        servidores = [('localhost', port) for port in portas]
+        A = rng.integers(-10, 10, (400, 300))
+        B = rng.integers(-10, 10, (300, 200))
+        client = MatrixClient(servidores, timeout=30)
+        C, _ = client.distribute_multiplication(A, B, show_details=False)
+        ok &= verificar("servidores locais detectados por padrão",
+                        np.array_equal(C, A @ B)
+                        and all(client.connections._routes.get(server) for server in servidores))
+        client.close()
+        
+        client = MatrixClient(servidores, timeout=30, local_transport=False)
+        C, _ = client.distribute_multiplication(A, B, show_details=False)
+        recebidos = client.last_timings['bytes_received']
+        ok &= verificar(f"TCP: C chega no tipo estreito ({recebidos} de {C.nbytes} bytes)",
+                        np.array_equal(C, A @ B) and recebidos < C.nbytes / 2)
+        client.close()
+    return ok
+
+
+def teste_inicializacao():
+    """Linha de pronto do servidor e importações pesadas adiadas"""
+    print("\n[INICIALIZAÇÃO] Prontidão e importações tardias")
+    import os
+    import socket
+    import subprocess
+    
+    pesados = ('scipy', 'scipy.sparse', 'matplotlib')
+    importados = subprocess.run(
+        [sys.executable, '-c', 'import sys, server, client, protocol; '
+                               f'print([m for m in {pesados!r} if m in sys.modules])'],
+        capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)), timeout=60)
+    ok = verificar(f"importar server e client não carrega {', '.join(pesados)}",
+                   importados.stdout.strip() == '[]')
+    
+    with servidores_teste([5220]):
+        inicio = time.monotonic()
+        with socket.create_connection(('localhost', 5220), timeout=5):
+            pass
+        ok &= verificar("aceita conexões assim que avisa que está pronto",
+                        time.monotonic() - inicio < 1)
+        duplicado = iniciar_servidor(5220)
+        try:
+            ok &= verificar("porta ocupada: a espera termina sem a linha de pronto",
+                            not aguardar_servidor(duplicado, 5220, timeout=20))
+        finally:
+            encerrar_servidores([duplicado])
+    return ok
+
+
+def teste_threads_blas():
+    """Orçamento de núcleos dividido entre o BLAS e os pools do servidor"""
+    print("\n[BLAS] Threads do BLAS sem excesso de inscrição")
+    import os
+    import subprocess
+    from server import BlasThreadLimit
+    
+    def variaveis(**ambiente):
+        """OMP/OPENBLAS_NUM_THREADS vistos por um servidor importado com o ambiente dado"""
+        env = {k: v for k, v in os.environ.items() if not k.startswith('MATRIX_SERVER_')}
+        env.update(OMP_NUM_THREADS='8', OPENBLAS_NUM_THREADS='8', **ambiente)
+        codigo = ('import os, server; '
+                  'print(os.environ["OMP_NUM_THREADS"], os.environ["OPENBLAS_NUM_THREADS"])')
+        saida = subprocess.run([sys.executable, '-c', codigo], env=env, capture_output=True,
+                               text=True, timeout=60, cwd=os.path.dirname(os.path.abspath(__file__)))
+        return saida.stdout.split()
+    
+    ok = verificar("MATRIX_SERVER_CORES prevalece sobre o ambiente",
+                   variaveis(MATRIX_SERVER_CORES='3') == ['3', '3'])
+    ok &= verificar("sem orçamento, o ambiente é respeitado", variaveis() == ['8', '8'])
+    ok &= verificar("processos do pool usam um thread de BLAS",
+                    variaveis(MATRIX_SERVER_CORES='3', MATRIX_SERVER_POOL_WORKER='1') == ['1', '1'])
+    
+    limite = BlasThreadLimit()
+    with limite():
+        with limite():
+            pass
+    ok &= verificar("limite contado por referência é liberado", limite._users == 0
+                    and limite._limit is None)
+    
+    with servidores_teste([5230], cores=[0], workers=2):
+        from client import MatrixClient
+        
+        client = MatrixClient([('localhost', 5230)], timeout=30)
+        paralelismo = client.server_stats(('localhost', 5230))['parallelism']
+        ok &= verificar(f"servidor com 1 núcleo: {paralelismo}",
+                        paralelismo['cores'] == 1 and paralelismo['blas_threads'] == 1
+                        and paralelismo['workers'] == 2 and paralelismo['worker_blas_threads'] == 1)
+        client.close()
+    return ok
+
+
+def teste_configuracao():
+    """Arquivo de configuração, divisão de núcleos, afinidade e host dos servidores"""
+    print("\n[CONFIGURAÇÃO] Lançador com afinidade e arquivo de opções")
+    import argparse
+    import json
+    import os
+    import socket
+    import tempfile
+    from run_system import load_config, distribuir_nucleos
+    
+    with tempfile.TemporaryDirectory() as pasta:
+        arquivo = os.path.join(pasta, 'cluster.json')
+        with open(arquivo, 'w') as f:
+            json.dump({'servers': 4, 'base_port': 7000}, f)
+        config = load_config(argparse.Namespace(config=arquivo, servers=2, workers=None),
+                             {'servers': 3, 'base_port': 5000, 'workers': 1})
+    ok = verificar("opções dadas > arquivo > padrões",
+                   config == {'servers': 2, 'base_port': 7000, 'workers': 1})
+    
+    topologia = [(0, 0), (0, 1), (1, 2), (1, 3)]
+    grupos = distribuir_nucleos(2, topologia=topologia)
+    ok &= verificar("núcleos disjuntos, um nó NUMA por servidor",
+                    grupos == [{'cores': [0, 1], 'numa_node': 0}, {'cores': [2, 3], 'numa_node': 1}])
+    grupos = distribuir_nucleos(3, cores_per_server=2, topologia=topologia)
+    ok &= verificar("sem núcleos suficientes os conjuntos se repetem",
+                    [grupo['cores'] for grupo in grupos] == [[0, 1], [2, 3], [0, 1]]
+                    and grupos[0]['numa_node'] == 0)
+    
+    with servidores_teste([5240], cores=[0]) as processos:
+        ok &= verificar("servidor fixado no núcleo 0",
+                        not hasattr(os, 'sched_getaffinity')
+                        or os.sched_getaffinity(processos[0].pid) == {0})
+    
+    processo = iniciar_servidor(5241, host='127.0.0.1')
+    try:
+        pronto = aguardar_servidor(processo, 5241, host='127.0.0.1')
+        with socket.create_connection(('127.0.0.1', 5241), timeout=5):
+            ok &= verificar("--host: escuta no endereço pedido", pronto)
+    finally:
+        encerrar_servidores([processo])
+    return ok
+
+
+def teste_expressoes():
+    """Handles residentes nos servidores e cadeias na ordem ótima"""
+    print("\n[EXPRESSÕES] Cadeia de matrizes com handles")
+    from expression import (chain_order, evaluate_order, format_order, left_to_right_cost,
+                            left_spine, tree_leaves)
+    from server import MatrixCache
+    import numpy as np
+    
+    ok = verificar("10x100 @ 100x5 @ 5x50: (A @ B) @ C com 7500 multiplicações",
+                   chain_order([10, 100, 5, 50]) == (7500, [[0, 1], 2]))
+    dims = [40, 20, 30, 10, 30]
+    custo, ordem = chain_order(dims)
+    ok &= verificar(f"40x20 @ ... @ 10x30: {format_order(ordem, 'ABCD')} com {custo}",
+                    custo == 26000 and format_order(ordem, 'ABCD') == '((A @ (B @ C)) @ D)'
+                    and custo <= left_to_right_cost(dims))
+    ok &= verificar("ramo esquerdo: B @ C e D não dependem das linhas de A",
+                    left_spine(ordem) == [[1, 2], 3] and tree_leaves([1, 2]) == [1, 2])
+    rng = np.random.default_rng(25)
+    matrizes = [rng.integers(-3, 3, (dims[i], dims[i + 1])) for i in range(len(dims) - 1)]
+    esperado = matrizes[0] @ matrizes[1] @ matrizes[2] @ matrizes[3]
+    ok &= verificar("evaluate_order na ordem ótima dá o mesmo produto",
+                    np.array_equal(evaluate_order(ordem, matrizes, np.dot), esperado))
+    
+    cache = MatrixCache(max_bytes=2 * matrizes[0].nbytes)
+    cache.put('a', matrizes[0])
+    ok &= verificar("pin retorna a matriz em cache", cache.pin('a') is matrizes[0]
+                    and cache.pin('b') is None)
+    for nome in 'bcd':
+        cache.put(nome, np.copy(matrizes[0]))
+    ok &= verificar("matriz fixada não é descartada", cache.get('a') is not None)
+    cache.unpin('a')
+    for nome in 'ef':
+        cache.put(nome, np.copy(matrizes[0]))
+    ok &= verificar("após unpin volta a poder ser descartada", cache.get('a') is None)
+    
+    portas = [5250, 5251]
+    with servidores_teste(portas):
+        from client import MatrixClient
+        
+        servidores = [('localhost', port) for port in portas]
+        client = MatrixClient(servidores, timeout=30)
+        handles = [client.upload(matriz, name=nome) for matriz, nome in zip(matrizes, 'ABCD')]
+        C, _ = (handles[0] @ handles[1] @ handles[2] @ handles[3]).evaluate()
+        ok &= verificar("A @ B @ C @ D nos servidores",
+                        np.array_equal(C, esperado) and client.last_chain_order == ordem)
+        
+        estatisticas = [client.server_stats(server) for server in servidores]
+        cadeias = sum(stats['metrics']['counters'].get('requests_total[op=evaluate_chain]', 0)
+                      for stats in estatisticas)
+        ok &= verificar(f"B @ C calculado uma vez e liberado ({cadeias} cadeias nos servidores)",
+                        cadeias == 4 and client._handles == handles
+                        and all(stats['cache']['pinned'] == 4 for stats in estatisticas))
+        C, _ = (handles[2] @ handles[3]).evaluate()
+        ok &= verificar("subexpressão reaproveita os handles", np.array_equal(C, matrizes[2] @ matrizes[3]))
+        for handle in handles:
+            handle.release()
+        ok &= verificar("handles liberados nos servidores",
+                        client.server_stats(servidores[0])['cache']['pinned'] == 0)
+        client.close()
+    return ok
+
+
+# Grupos executados por este script, na ordem
+TESTES = [
+    teste_distribuicao_concorrente,
+    teste_pool_persistente,
+    teste_motores,
+    teste_protocolo,
+    teste_clientes_simultaneos,
+    teste_pool_de_conexoes,
+    teste_cache,
+    teste_grade_2d,
+    teste_agendamento_dinamico,
+    teste_modelo_de_custo,
+    teste_compressao,
+    teste_resultado_em_blocos,
+    teste_fora_da_memoria,
+    teste_failover,
+    teste_pipeline,
+    teste_lote,
+    teste_esparsas,
+    teste_benchmark,
+    teste_metricas,
+    teste_rastreamento,
+    teste_transporte_local,
+    teste_inicializacao,
+    teste_threads_blas,
+    teste_configuracao,
+    teste_expressoes,
+]
+
+
+def executar_testes(testes):
+    """Executa os grupos; uma exceção conta como falha do grupo. Retorna True se todos passaram"""
+    resultados = []
+    for teste in testes:
+        try:
+            resultados.append(bool(teste()))
+        except Exception as e:
+            print(f"  ✗ {teste.__name__}: {e}")
+            traceback.print_exc()
+            resultados.append(False)
+    print(f"\n{sum(resultados)}/{len(resultados)} grupos de testes passaram")
+    return all(resultados)
+
+
 if __name__ == "__main__":
-    teste_rapido()
\ No newline at end of file
+    teste_rapido()
+    sys.exit(0 if executar_testes(TESTES) else 1)
@@ -0,0 +1,185 @@
+"""
+Rastreamento (tracing) de requisições entre cliente e servidores.
+
+Cada multiplicação distribuída recebe um trace_id (o ID da requisição) e
+cada shard um span_id. Esses IDs vão nos metadados das mensagens
+('trace': {'trace_id', 'parent_id'}); o servidor registra seus próprios
+spans (espera na fila, cálculo, envio) e os devolve na resposta final, de
+modo que o cliente monta a linha do tempo completa de todos os shards.
+
+Os spans podem ser exportados como JSON simples ou no formato de trace do
+Chrome (abrir em chrome://tracing ou https://ui.perfetto.dev).
+"""
+import json
+import os
+import threading
+import time
+
+
+def new_id():
+    """Identificador aleatório de 64 bits em hexadecimal"""
+    return os.urandom(8).hex()
+
+
+def record_span(spans, name, start_ns, end_ns=None, **args):
+    """
+    Acrescenta um span já medido a uma lista (usado no servidor, que devolve
+    a lista na resposta). Tempos em ns de relógio de parede (time.time_ns).
+    """
+    if spans is None:
+        return
+    spans.append({
+        'name': name,
+        'span_id': new_id(),
+        'start_ns': start_ns,
+        'end_ns': end_ns if end_ns is not None else time.time_ns(),
+        'thread': threading.current_thread().name,
+        'args': args,
+    })
+
+
+class Span:
+    """Intervalo de tempo nomeado de um trace; usar com 'with' ou finish()"""
+    def __init__(self, tracer, name, parent_id=None, process='cliente', **args):
+        self.tracer = tracer
+        self.name = name
+        self.span_id = new_id()
+        self.parent_id = parent_id
+        self.process = process
+        self.thread = threading.current_thread().name
+        self.args = args
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+    
+    def child(self, name, **args):
+        """Inicia um span filho deste"""
+        return self.tracer.start(name, parent=self, **args)
+    
+    def context(self):
+        """IDs enviados ao servidor nos metadados da requisição"""
+        return {'trace_id': self.tracer.trace_id, 'parent_id': self.span_id}
+    
+    def add_remote(self, spans, process):
+        """Incorpora spans devolvidos por um servidor como filhos deste"""
+        self.tracer.add_remote(spans, self, process)
+    
+    def finish(self, **args):
+        if self.end_ns is None:
+            self.end_ns = time.time_ns()
+            self.args.update(args)
+            self.tracer._add(self)
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc, traceback):
+        self.finish(**({'error': str(exc)} if exc is not None else {}))
+    
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'trace_id': self.tracer.trace_id,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'process': self.process,
+            'thread': self.thread,
+            'start_ns': self.start_ns,
+            'end_ns': self.end_ns,
+            'args': self.args,
+        }
+
+
+class _NullSpan:
+    """Span que não registra nada, usado com o rastreamento desligado"""
+    def child(self, name, **args):
+        return self
+    
+    def context(self):
+        return None
+    
+    def add_remote(self, spans, process):
+        pass
+    
+    def finish(self, **args):
+        pass
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc, traceback):
+        pass
+
+
+NULL_SPAN = _NullSpan()
+
+
+class Tracer:
+    """Spans de uma requisição (trace_id), do cliente e dos servidores"""
+    def __init__(self, trace_id=None):
+        self.trace_id = trace_id or new_id()
+        self._spans = []
+        self._lock = threading.Lock()
+    
+    def start(self, name, parent=None, **args):
+        """Inicia um span (filho de parent, se dado)"""
+        return Span(self, name, parent.span_id if parent is not None else None, **args)
+    
+    def _add(self, span):
+        with self._lock:
+            self._spans.append(span.to_dict())
+    
+    def add_remote(self, spans, parent, process):
+        """Incorpora os spans devolvidos por um servidor como filhos de parent"""
+        if not isinstance(spans, list):
+            return
+        with self._lock:
+            for span in spans:
+                self._spans.append({
+                    'name': str(span.get('name')),
+                    'trace_id': self.trace_id,
+                    'span_id': str(span.get('span_id')),
+                    'parent_id': parent.span_id,
+                    'process': process,
+                    'thread': str(span.get('thread')),
+                    'start_ns': int(span.get('start_ns', 0)),
+                    'end_ns': int(span.get('end_ns', 0)),
+                    'args': span.get('args') if isinstance(span.get('args'), dict) else {},
+                })
+    
+    def spans(self):
+        """Spans concluídos, em ordem de início"""
+        with self._lock:
+            return sorted(self._spans, key=lambda span: span['start_ns'])
+    
+    def to_chrome(self):
+        """Trace no formato do Chrome: um processo por cliente/servidor, uma linha por thread"""
+        spans = self.spans()
+        processes, threads, events = {}, {}, []
+        for span in spans:
+            pid = processes.setdefault(span['process'], len(processes) + 1)
+            tid = threads.setdefault((pid, span['thread']), len(threads) + 1)
+            events.append({
+                'name': span['name'],
+                'cat': span['process'],
+                'ph': 'X',
+                'ts': span['start_ns'] / 1000,
+                'dur': max(span['end_ns'] - span['start_ns'], 0) / 1000,
+                'pid': pid,
+                'tid': tid,
+                'args': dict(span['args'], span_id=span['span_id'], parent_id=span['parent_id']),
+            })
+        for process, pid in processes.items():
+            events.append({'name': 'process_name', 'ph': 'M', 'pid': pid, 'args': {'name': process}})
+        for (pid, thread), tid in threads.items():
+            events.append({'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid,
+                           'args': {'name': thread}})
+        return {'traceEvents': events, 'displayTimeUnit': 'ms',
+                'otherData': {'trace_id': self.trace_id}}
+    
+    def save(self, path, format='chrome'):
+        """Grava o trace em arquivo: format 'chrome' ou 'json' (lista de spans)"""
+        data = self.to_chrome() if format == 'chrome' else {'trace_id': self.trace_id,
+                                                            'spans': self.spans()}
+        with open(path, 'w') as f:
+            json.dump(data, f, indent=1)
+        return path